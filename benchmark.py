@@ -0,0 +1,343 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Times the hot paths of the transformer and the clusterer on
+#          synthetic crash data, and flags regressions against a baseline
+
+# Usage: python benchmark.py [--save-baseline] [rows ...]
+#   rows            dataset sizes to run, defaults to BENCHMARK_SIZES
+#   --save-baseline also write the results to BASELINE_FILENAME
+# The synthetic export is written to BENCHMARK_DIRECTORY and goes through the
+# real transformer, so the clusterer benchmarks read a real cleaned.csv.
+# Every benchmark runs in its own forked process, so its peak RSS is its own.
+# The results go to RESULTS_FILENAME, and if BASELINE_FILENAME exists every
+# benchmark more than REGRESSION_TOLERANCE slower than in there is flagged
+# (and the exit status is 1).
+
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import transformer
+from clusterer_loader import LoadClusterer
+
+# Dataset sizes (rows of the raw export) to run when none are given.
+# 1000000 and 10000000 are the big runs, they take a while with the pure
+# Python engine.
+BENCHMARK_SIZES = [10000]
+BENCHMARK_DIRECTORY = "benchmark_data"
+RESULTS_FILENAME = "benchmark_results.json"
+BASELINE_FILENAME = "benchmark_baseline.json"
+# A benchmark is a regression if it takes this much longer than the baseline
+REGRESSION_TOLERANCE = 0.25
+# Each benchmark is run this many times, the fastest run counts
+REPEATS = 1
+# Prototypes used by the distance and one iteration benchmarks
+BENCHMARK_K = 8
+# Full convergence is skipped for datasets bigger than this
+CONVERGENCE_MAX_ROWS = 1000000
+BENCHMARK_SEED = 2015
+
+# Values of the synthetic export, with roughly the frequencies of the real one
+WEATHER_CONDITIONS = [("CLEAR", 11576), ("CLOUDY", 6586), ("RAIN", 2130), ("SNOW", 1753), ("UNKNOWN", 216),
+                      ("SLEET/HAIL/FREEZING RAIN", 99), ("FOG/SMOG/SMOKE", 18), ("OTHER", 11)]
+SURFACE_CONDITIONS = [("DRY", 15508), ("WET", 4450), ("SNOW/ICE", 2053), ("UNKNOWN", 210), ("SLUSH", 125),
+                      ("OTHER", 27), ("FLOODED WATER", 14), ("MUDDY", 2)]
+INJURIES = [("1.", 10442), ("1", 6514), ("2.", 2441), ("2", 1472), ("3.", 640), ("3", 324), ("4.", 187),
+            ("4", 103), ("0.", 76), ("5.", 64), ("0", 43), ("5", 30)]
+MUNICIPALITIES = ["Rochester", "Penfield", "Greece", "Irondequoit", "Henrietta", "Gates", "Webster", "Pittsford", ""]
+LIGHT_CONDITIONS = ["DAYLIGHT", "DARK-ROAD LIGHTED", "DARK-ROAD UNLIGHTED", "DUSK", "DAWN"]
+RAW_HEADER = ("QUERYID,CASE #,REGN_CNTY_CDE,Municipality,MUNITYPE,REF_MRKR,ATINTERSECTION_IND,Lat,Long,,Time,"
+              "Crash Type,Injuries,Fatalities,Number of Vehicles,ACCD_TYP,COLLISION_TYP,TRAF_CNTL,"
+              "Light Condition,Weather Condition,Road Surface Condition")
+
+# The benchmarks, in the order they run. transform has to come first, it
+# writes the cleaned.csv (and cache) the others read.
+CASES = ["transform", "format", "ingest_objects", "ingest_table", "ingest_cache",
+         "distance_v1", "distance_v2", "distance_v3",
+         "distance_v1_numpy", "distance_v2_numpy", "distance_v3_numpy",
+         "kmeans_iteration", "kmeans_converge", "dbscan"]
+
+###############################################################################
+# Writes a synthetic raw export of the given number of rows, in the same 21
+# column format (and \r line endings) as the real one. Dates and times come
+# in both the formats the real export uses.
+# string * int * seed -> None
+###############################################################################
+def WriteSyntheticExport(filename, rows, seed):
+    rand = random.Random(seed)
+    weather = [value for (value, count) in WEATHER_CONDITIONS]
+    weather_weights = [count for (value, count) in WEATHER_CONDITIONS]
+    surface = [value for (value, count) in SURFACE_CONDITIONS]
+    surface_weights = [count for (value, count) in SURFACE_CONDITIONS]
+    injuries = [value for (value, count) in INJURIES]
+    injury_weights = [count for (value, count) in INJURIES]
+
+    f = open(filename + ".tmp", "w", newline="")
+    f.write(RAW_HEADER + "\r")
+    batch = []
+    for row in range(rows):
+        month = rand.randint(1, 12)
+        day = rand.randint(1, 28)
+        hour = rand.randint(0, 23)
+        minute = rand.randint(0, 59)
+        if rand.random() < 0.6:
+            # 01/02/2013 5:00 PM
+            date = "%02d/%02d/%d" % (month, day, rand.randint(2011, 2014))
+            clock = "%d:%02d %s" % ((hour % 12) or 12, minute, "AM" if hour < 12 else "PM")
+        else:
+            # 1/6/10 18:03
+            date = "%d/%d/10" % (month, day)
+            clock = "%d:%02d" % (hour, minute)
+        municipality = rand.choice(MUNICIPALITIES) if rand.random() < 0.01 else rand.choice(MUNICIPALITIES[:-1])
+        point = [str(13985 + (row % 100)), str(33300000 + row), "MONROE", municipality, str(rand.randint(1, 3)), "",
+                 rand.choice("NY"), "%.7f" % (43 + rand.random() * 0.3), "%.7f" % (-77.8 + rand.random() * 0.5),
+                 date, clock, "PROPERTY DAMAGE AND INJURY",
+                 rand.choices(injuries, injury_weights)[0], "0", str(rand.randint(1, 3)),
+                 "COLLISION WITH MOTOR VEHICLE", "OTHER", "NONE", rand.choice(LIGHT_CONDITIONS),
+                 rand.choices(weather, weather_weights)[0], rand.choices(surface, surface_weights)[0]]
+        batch.append(",".join(point))
+        if len(batch) == 10000:
+            f.write("\r".join(batch) + "\r")
+            batch = []
+    if batch:
+        f.write("\r".join(batch) + "\r")
+    f.close()
+    os.replace(filename + ".tmp", filename)
+
+###############################################################################
+# Makes sure the dataset of the given size exists, and returns its directory
+# int -> string
+###############################################################################
+def PrepareDataset(rows):
+    directory = os.path.join(os.path.abspath(BENCHMARK_DIRECTORY), str(rows))
+    os.makedirs(directory, exist_ok=True)
+    raw_filename = os.path.join(directory, "raw.csv")
+    if not os.path.exists(raw_filename):
+        print("Generating " + str(rows) + " synthetic crashes...")
+        WriteSyntheticExport(raw_filename, rows, BENCHMARK_SEED + rows)
+    return directory
+
+###############################################################################
+# Peak resident memory of this process so far, in MB
+# None -> float
+###############################################################################
+def PeakRSS():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak / 1024
+
+###############################################################################
+# Times one benchmark. Runs in a forked worker process (see RunCase).
+# Every case sets up its data untimed, then returns the seconds its timed
+# part took, the number of rows it handled and the number of distance
+# evaluations it did (0 if it does none).
+# string * string -> float, int, int
+###############################################################################
+def TimeCase(case, directory):
+    os.chdir(directory)
+    cc = LoadClusterer()
+    k = BENCHMARK_K
+
+    if case == "transform":
+        transformer.RAW_FILENAME = "raw.csv"
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            transformer.StreamTransform()
+        seconds = time.perf_counter() - start
+        return seconds, CountLines("raw.csv") - 1, 0
+    if case == "format":
+        f = open("raw.csv", newline="")
+        reader = transformer.ReadCSVRows(f)
+        next(reader)
+        points = list(reader)
+        f.close()
+        start = time.perf_counter()
+        for point in points:
+            transformer.FormatPoint(point)
+        return time.perf_counter() - start, len(points), 0
+    if case.startswith("ingest_"):
+        read = {"ingest_objects": cc.ReadInCrashes, "ingest_table": cc.ReadInCrashTable,
+                "ingest_cache": cc.ReadInCachedCrashTable}[case]
+        start = time.perf_counter()
+        crashes = read("cleaned.csv")
+        return time.perf_counter() - start, len(crashes), 0
+    if case == "dbscan":
+        crashes = cc.ReadInCrashTable("cleaned.csv")
+        start = time.perf_counter()
+        cc.FindHotspots(crashes)
+        return time.perf_counter() - start, len(crashes), 0
+
+    crashes = cc.ReadInCrashes("cleaned.csv")
+    prototypes = cc.PickStartingPrototypes(k, BENCHMARK_SEED)
+    if case.startswith("distance_"):
+        version = int(case.split("_")[1][1:])
+        if case.endswith("_numpy"):
+            if cc.np is None:
+                return None
+            # Encoding happens once per run, it isn't part of the distances
+            encoded = cc.EncodedCrashes(crashes)
+            start = time.perf_counter()
+            encoded_prototypes = cc.ReshapeEncoded(cc.EncodeCrashes(prototypes), (1, -1))
+            for block_start in range(0, len(crashes), cc.ENGINE_BLOCK_SIZE):
+                block = cc.TakeEncoded(encoded, slice(block_start, block_start + cc.ENGINE_BLOCK_SIZE))
+                cc.CrashDistanceArrays(version, cc.ReshapeEncoded(block, (-1, 1)), encoded_prototypes)
+            seconds = time.perf_counter() - start
+        else:
+            distance = cc.CrashDistance
+            start = time.perf_counter()
+            for crash in crashes:
+                for prototype in prototypes:
+                    distance(version, crash, prototype)
+            seconds = time.perf_counter() - start
+        return seconds, len(crashes), len(crashes) * len(prototypes)
+    if case == "kmeans_iteration":
+        start = time.perf_counter()
+        crashes = cc.AssignNearestPrototypes(crashes, prototypes)
+        clusters = cc.SeparateClusters(crashes, len(prototypes))
+        cc.FindPrototypesForClustering(clusters, prototypes)
+        return time.perf_counter() - start, len(crashes), len(crashes) * len(prototypes)
+    if case == "kmeans_converge":
+        if len(crashes) > CONVERGENCE_MAX_ROWS:
+            return None
+        # Each iteration computes the distance from every crash to every
+        # prototype once (the SSE adds up the distances the assignment
+        # recorded, it doesn't compute any)
+        start = time.perf_counter()
+        (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, prototypes, float('inf'))
+        seconds = time.perf_counter() - start
+        return seconds, len(crashes), iterations * len(crashes) * len(prototypes)
+    raise ValueError("Unknown benchmark " + case)
+
+###############################################################################
+# Number of lines in a file, counting \r, \n and \r\n line breaks
+# string -> int
+###############################################################################
+def CountLines(filename):
+    f = open(filename)
+    lines = sum(1 for line in f)
+    f.close()
+    return lines
+
+###############################################################################
+# Runs one benchmark REPEATS times, in the worker process, and returns its
+# result (None if the case doesn't apply)
+# string * string -> dict
+###############################################################################
+def RunCase(case, directory):
+    best = None
+    for repeat in range(REPEATS):
+        timed = TimeCase(case, directory)
+        if timed is None:
+            return None
+        if best is None or timed[0] < best[0]:
+            best = timed
+    (seconds, rows, evaluations) = best
+    result = {"seconds": seconds,
+              "rows": rows,
+              "rows_per_second": rows / seconds if seconds > 0 else None,
+              "peak_rss_mb": PeakRSS()}
+    if evaluations:
+        result["distance_evaluations"] = evaluations
+        result["evaluations_per_second"] = evaluations / seconds if seconds > 0 else None
+    return result
+
+###############################################################################
+# Runs every benchmark on every dataset size. Each benchmark gets a fresh
+# forked process so peak RSS is measured per benchmark.
+# List<int> -> dict
+###############################################################################
+def RunBenchmarks(sizes):
+    results = {}
+    context = multiprocessing.get_context("fork")
+    for rows in sizes:
+        directory = PrepareDataset(rows)
+        results[str(rows)] = {}
+        for case in CASES:
+            executor = ProcessPoolExecutor(1, mp_context=context)
+            result = executor.submit(RunCase, case, directory).result()
+            executor.shutdown()
+            if result is None:
+                print("%-10s %-20s skipped" % (rows, case))
+                continue
+            results[str(rows)][case] = result
+            print("%-10s %-20s %10.3fs %14.0f rows/s %10.1f MB" %
+                  (rows, case, result["seconds"], result["rows_per_second"] or 0, result["peak_rss_mb"]))
+    return results
+
+###############################################################################
+# Compares results to a baseline. Returns the benchmarks that got more than
+# REGRESSION_TOLERANCE slower, as (size, case, seconds, baseline seconds).
+# Benchmarks missing from either side are left out.
+# dict * dict -> List<(string, string, float, float)>
+###############################################################################
+def FindRegressions(results, baseline):
+    regressions = []
+    for (rows, cases) in results.items():
+        for (case, result) in cases.items():
+            before = baseline.get(rows, {}).get(case)
+            if before is None:
+                continue
+            if result["seconds"] > before["seconds"] * (1 + REGRESSION_TOLERANCE):
+                regressions.append((rows, case, result["seconds"], before["seconds"]))
+    return regressions
+
+###############################################################################
+# The settings that decide how fast things run, stored with the results so
+# runs with different settings aren't compared by accident
+# None -> dict
+###############################################################################
+def BenchmarkSettings():
+    cc = LoadClusterer()
+    return {"python": platform.python_version(),
+            "machine": platform.machine(),
+            "numpy": cc.np.__version__ if cc.np is not None else None,
+            "engine": cc.ENGINE,
+            "assignment": cc.ASSIGNMENT,
+            "date_difference": cc.DATE_DIFFERENCE,
+            "k": BENCHMARK_K,
+            "repeats": REPEATS}
+
+def Main():
+    args = sys.argv[1:]
+    save_baseline = "--save-baseline" in args
+    sizes = [int(arg) for arg in args if arg != "--save-baseline"] or BENCHMARK_SIZES
+
+    report = {"settings": BenchmarkSettings(), "results": RunBenchmarks(sizes)}
+    f = open(RESULTS_FILENAME, "w")
+    json.dump(report, f, indent=2)
+    f.close()
+    print("Wrote " + RESULTS_FILENAME)
+
+    regressions = []
+    if os.path.exists(BASELINE_FILENAME):
+        f = open(BASELINE_FILENAME)
+        baseline = json.load(f)
+        f.close()
+        if baseline["settings"] != report["settings"]:
+            print("Baseline was run with different settings: " + json.dumps(baseline["settings"]))
+        regressions = FindRegressions(report["results"], baseline["results"])
+        for (rows, case, seconds, before) in regressions:
+            print("REGRESSION %s %s: %.3fs, was %.3fs" % (rows, case, seconds, before))
+        if not regressions:
+            print("No regressions against " + BASELINE_FILENAME)
+    if save_baseline:
+        f = open(BASELINE_FILENAME, "w")
+        json.dump(report, f, indent=2)
+        f.close()
+        print("Wrote " + BASELINE_FILENAME)
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,21 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Loads crash-clusterer.py for the scripts that use it as a module
+
+import importlib.util
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Loads crash-clusterer.py, which can't be imported by name because of the
+# dash. It is registered as crash_clusterer so its functions can be pickled
+# (for worker processes), and only loaded once.
+# None -> module
+def LoadClusterer():
+    if "crash_clusterer" in sys.modules:
+        return sys.modules["crash_clusterer"]
+    spec = importlib.util.spec_from_file_location("crash_clusterer", os.path.join(HERE, "crash-clusterer.py"))
+    clusterer = importlib.util.module_from_spec(spec)
+    sys.modules["crash_clusterer"] = clusterer
+    spec.loader.exec_module(clusterer)
+    return clusterer
@@ -1,41 +1,403 @@
 # Authors: Ryan Lisnoff and Derek Brown
 # Purpose: To try out different clustering algorithms on our crash data
 
+import csv
+import functools
+import io
 import math
 import datetime
 import random
+import bisect
+import itertools
+import json
+import hashlib
+import multiprocessing
+import os
+import time
+import cProfile
+import pstats
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from array import array
 from collections import Counter
+from statistics import NormalDist
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap, to_rgba
+import crashcache
+import distancematrix
+# NumPy is only needed for the "numpy" engine below
+try:
+    import numpy as np
+except ImportError:
+    np = None
 # Which distance metric version to use for the crashes
 DISTANCE_VERSION = 1
+# Which engine computes the crash to prototype distances:
+#       "python" calls CrashDistance once per (crash, prototype) pair
+#       "numpy" computes the whole N x K distance matrix at once
+ENGINE = "python"
+# How crashes are stored once read in:
+#       "objects" makes one Crash per row
+#       "table" keeps them in the columns of a CrashTable, using far less memory
+#       "cache" memory-maps the CrashTable columns from the binary cache the
+#       transformer writes next to cleaned.csv (cleaned.bin). If the cache is
+#       missing or older than cleaned.csv, the csv is read and the cache rebuilt.
+CRASH_STORAGE = "objects"
 # Number of clusters to find
 K = 2
 # Seed for random num generator, keeps our random numbers consistent
 SEED = "tingo"
+# Value counts written by transformer.py. If set, the weather and surface
+# conditions for random prototypes come from here instead of the lists in
+# PickStartingPrototypes, leaving out the ones rarer than RARE_CATEGORY_SHARE
+VALUE_COUNTS_FILE = None
+RARE_CATEGORY_SHARE = 0.002
+# Which K-Means to run:
+#       "full" assigns every crash each iteration (CrashKMeans)
+#       "minibatch" updates the prototypes from random batches of crashes
+#       (MiniBatchCrashKMeans), stopping after MINI_BATCH_MAX_ITERATIONS or
+#       once the smoothed batch SSE changes by less than MINI_BATCH_TOLERANCE
+#       (relative)
+KMEANS_MODE = "full"
+MINI_BATCH_SIZE = 1024
+MINI_BATCH_MAX_ITERATIONS = 100
+MINI_BATCH_TOLERANCE = 0.001
+# How the starting prototypes are picked:
+#       "random" makes up random crashes (PickStartingPrototypes)
+#       "kmeans++" picks real crashes, each one likely far from those already
+#       picked (PickKMeansPlusPlusPrototypes)
+#       "kmeans||" picks many real crashes in KMEANS_PARALLEL_ROUNDS passes
+#       and narrows them down to K with weighted k-means++ and K-Means
+#       (PickKMeansParallelPrototypes). Takes about 2K * KMEANS_PARALLEL_ROUNDS
+#       distances per crash against K for "kmeans++", so it is slower with
+#       the "python" engine but usually starts from a lower SSE
+SEEDING = "random"
+KMEANS_PARALLEL_ROUNDS = 5
+# Number of K-Means runs from different starting prototypes, the run with the
+# lowest SSE is kept. The runs are spread over N_INIT_WORKERS processes.
+N_INIT = 1
+N_INIT_WORKERS = 1
+# How CrashKMeans assigns crashes to prototypes:
+#       "full" computes the distance to every prototype every iteration
+#       "hamerly" keeps distance bounds for each crash and skips the distances
+#       that can't change its nearest prototype (HamerlyAssigner). Falls back
+#       to "full" for distance versions where skipping isn't exact, see
+#       METRIC_DECOMPOSITIONS.
+ASSIGNMENT = "full"
+# CrashKMeans stops once an iteration lowers the SSE by less than
+# SSE_TOLERANCE of the SSE before it (or doesn't lower it at all)
+SSE_TOLERANCE = 0.001
+# How CrashKMeans gets the SSE of each iteration:
+#       "exact" adds up the distances the assignment recorded (with
+#       ASSIGNMENT = "hamerly", that means one distance per iteration for
+#       each crash whose prototype moved, even if it keeps that prototype)
+#       "sampled" estimates it from the same SSE_SAMPLE_SIZE random crashes
+#       every iteration, with a SSE_CONFIDENCE confidence interval. It stops
+#       once it is that confident the SSE went down by less than
+#       SSE_TOLERANCE, or the estimate went up. Lets "hamerly" skip the
+#       crashes whose bounds alone keep their prototype.
+SSE_MODE = "exact"
+SSE_SAMPLE_SIZE = 10000
+SSE_CONFIDENCE = 0.95
+# How versions 1 and 2 compare dates:
+#       "circular" looks up the distance between the days of the year in
+#       DAY_DIFFERENCE_TABLE, the shorter way around the calendar
+#       "reference" is the original DateDifference, kept to compare against.
+#       It is signed (Mar 1 to Jan 1 is 59 days, Jan 1 to Mar 1 is -59) and
+#       wraps around using the dates' real years
+DATE_DIFFERENCE = "circular"
+# JSON-lines file CrashKMeans appends one event per iteration to (timings of
+# each step, SSE, cluster sizes and crashes reassigned), None for no log.
+# Functions in ITERATION_CALLBACKS get the same events as dictionaries.
+ITERATION_LOG = None
+ITERATION_CALLBACKS = []
+# Profiles the clustering in main:
+#       None doesn't profile
+#       "cprofile" prints the slowest functions and saves the stats to PROFILE_FILENAME
+#       "tracemalloc" prints the peak memory and where the most memory was allocated
+# Only the main process is profiled, not N_INIT_WORKERS restart workers.
+PROFILE = None
+PROFILE_FILENAME = "kmeans.prof"
+# Where GenerateGraph draws the clusters: None opens a window (and waits
+# until it is closed), a filename ending in .png or .svg writes the graph
+# there without needing a display
+GRAPH_OUTPUT = None
+# How GenerateGraph draws each cluster:
+#       "scatter" draws a point per crash, but clusters with more than
+#       GRAPH_MAX_POINTS crashes are randomly sampled down to that many, which
+#       keeps dense areas dense
+#       "hexbin" counts the crashes in hexagonal bins, shaded by count
+GRAPH_STYLE = "scatter"
+GRAPH_MAX_POINTS = 20000
+# With INCREMENTAL, main keeps a clustering up to date instead of starting
+# over: the prototypes, the running totals of each cluster and how far into
+# cleaned.csv it got are kept in KMEANS_STATE_FILENAME. Each run only reads
+# the crashes added to cleaned.csv since (see transformer.py's INCREMENTAL),
+# assigns them to the nearest prototypes and updates those prototypes
+# (IncrementalKMeans). Once the SSE per crash of the crashes added since the
+# last full clustering is more than INCREMENTAL_SSE_DRIFT (relative) above
+# the SSE per crash of that clustering, or cleaned.csv or the settings
+# changed, everything is clustered again.
+INCREMENTAL = False
+KMEANS_STATE_FILENAME = "kmeans_state.json"
+# Changes when the saved state gets other fields, so an old one isn't used
+# 2: added_sse and added_count instead of the SSE of the whole history
+KMEANS_STATE_FORMAT = 2
+INCREMENTAL_SSE_DRIFT = 0.1
+# Every clustering run (not DBSCAN) saves its prototypes and the distance
+# settings they were made with here, for scoring.py to score new crashes with
+SCORING_STATE_FILENAME = "scoring_state.json"
+# What main clusters the crashes by:
+#       "kmeans" clusters by date, time, injuries and conditions (the settings
+#       above)
+#       "kmedoids" uses K crashes (medoids) as the prototypes, the ones with
+#       the lowest total distance to the crashes nearest them (PAM, see
+#       KMedoidsPAM), picked from a random sample of SAMPLE_SIZE crashes.
+#       With CLARA_SAMPLES > 1 that many samples are tried and the medoids
+#       with the lowest total distance over all the crashes are kept (CLARA).
+#       "agglomerative" merges the closest clusters of a sample of SAMPLE_SIZE
+#       crashes, bottom up, until K are left (see AgglomerativeMerges for
+#       LINKAGE), the medoid of each being its prototype.
+#       "dbscan" finds hotspots, places with many crashes close together
+#       (FindHotspots). A crash with at least DBSCAN_MIN_CRASHES crashes
+#       (itself included) within DBSCAN_RADIUS_METERS starts or grows a
+#       hotspot; crashes that aren't near one are left out as noise.
+#       Every hotspot goes to HOTSPOTS_FILENAME, biggest first, and the
+#       biggest HOTSPOTS_SHOWN are printed and graphed.
+# After "kmedoids" and "agglomerative" every crash is assigned to the nearest
+# prototype, same as K-Means.
+CLUSTERING = "kmeans"
+# "kmedoids" and "agglomerative" use the distance of every pair of sampled
+# crashes, worked out once by DISTANCE_MATRIX_WORKERS processes and kept as
+# float32 (SAMPLE_SIZE^2 * 2 bytes; "agglomerative" also works on a float64
+# copy, SAMPLE_SIZE^2 * 4 bytes). With DISTANCE_MATRIX_DIRECTORY set, the
+# distances are saved there and memory-mapped, so later runs with the same
+# sample and distance settings (any K, either algorithm) don't work them out
+# again.
+SAMPLE_SIZE = 1000
+CLARA_SAMPLES = 1
+LINKAGE = "average"
+DISTANCE_MATRIX_DIRECTORY = None
+DISTANCE_MATRIX_WORKERS = 1
+DBSCAN_RADIUS_METERS = 50
+DBSCAN_MIN_CRASHES = 20
+HOTSPOTS_FILENAME = "hotspots.csv"
+HOTSPOTS_SHOWN = 10
 ###############################################################################
 # Represents a single crash, used class instead of a simple list just because
 # it makes the code much easier to read.
 ###############################################################################
 class Crash:
-    def __init__(self, wc, sc, inj, date, time):
+    def __init__(self, wc, sc, inj, date, time, lat=None, lon=None):
         self.WeatherCondition = wc
         self.SurfaceCondition = sc
         self.Injuries = inj
         self.Date = date
         self.Time = time
+        # NaN when the crash (or a prototype) has no coordinates
+        self.Latitude = NO_COORDINATE if lat is None else lat
+        self.Longitude = NO_COORDINATE if lon is None else lon
         self.NearestPrototypeIX = None
+        # Distance to that prototype, recorded when the crash is assigned
+        self.NearestDistance = None
+        # Worked out once here so the distances don't need the datetimes
+        self.DayOfYear = DayOfYear(date)
+        self.MinuteOfDay = (time.hour * 60) + time.minute
 
     def __str__(self):
         return str(self.Date) + " @ " + str(self.Time) + " w/ " + str(self.Injuries) + " injuries. " + self.WeatherCondition + "," + self.SurfaceCondition
 
 ###############################################################################
-# Switches the distance metric depending on the version number
+# Weather and surface conditions are stored as small integer codes.
+# The codes are shared by every table, crash and prototype so they compare.
 ###############################################################################
-def CrashDistance(version, c1, c2):
+CATEGORY_CODES = {}
+# Code -> value, the reverse of CATEGORY_CODES
+CATEGORY_VALUES = []
+# Dates are stored as days since this ordinal, the year every date is moved
+# into by DateDifference
+DAY_OF_YEAR_BASE = datetime.date(2010, 1, 1).toordinal()
+# Latitude and longitude of crashes that have none
+NO_COORDINATE = float("nan")
+
+###############################################################################
+# Returns the day of the year of a date (0 for Jan 1 ... 364 for Dec 31).
+# Leap days count as Feb 28, same as transformer.py does.
+# Date -> int
+###############################################################################
+@functools.lru_cache(maxsize=4096)
+def DayOfYear(date):
+    if date.month == 2 and date.day == 29:
+        return datetime.date(2010, 2, 28).toordinal() - DAY_OF_YEAR_BASE
+    return datetime.date(2010, date.month, date.day).toordinal() - DAY_OF_YEAR_BASE
+
+###############################################################################
+# Returns the integer code of a weather/surface condition, adding new values
+# String -> int
+###############################################################################
+def CategoryCode(value):
+    code = CATEGORY_CODES.get(value)
+    if code is None:
+        code = len(CATEGORY_VALUES)
+        CATEGORY_CODES[value] = code
+        CATEGORY_VALUES.append(value)
+    return code
+
+###############################################################################
+# Holds many crashes as columns (struct of arrays) instead of Crash objects.
+# Each crash costs 44 bytes here (the sizes below add up per crash), compared
+# to several hundred for a Crash with its __dict__, datetime objects and
+# strings.
+#       Weather, Surface: category codes (2 bytes each)
+#       Injuries: injuries (8 bytes)
+#       DayOfYear: days since Jan 1, crashes are read in as 2010 dates (2 bytes)
+#       MinuteOfDay: minutes since midnight (2 bytes)
+#       Latitude, Longitude: degrees, NaN if the crash has no coordinates
+#                            (8 bytes each)
+#       NearestPrototypeIX: assigned cluster, -1 if not assigned yet (4 bytes)
+#       NearestDistance: distance to that cluster (8 bytes)
+# Indexing or iterating gives CrashRow views, so code written for Crash keeps
+# working on a table.
+###############################################################################
+class CrashTable:
+    def __init__(self):
+        self.Weather = array('H')
+        self.Surface = array('H')
+        self.Injuries = array('d')
+        self.DayOfYear = array('H')
+        self.MinuteOfDay = array('H')
+        self.Latitude = array('d')
+        self.Longitude = array('d')
+        self.NearestPrototypeIX = array('i')
+        # Filled in by AssignNearestPrototypes, see DistanceColumn
+        self.NearestDistance = array('d')
+
+    def __len__(self):
+        return len(self.Injuries)
+
+    def __getitem__(self, ix):
+        if ix < 0:
+            ix += len(self)
+        if ix < 0 or ix >= len(self):
+            raise IndexError("crash table index out of range")
+        return CrashRow(self, ix)
+
+    def __iter__(self):
+        for ix in range(len(self)):
+            yield CrashRow(self, ix)
+
+    # Adds a crash to the end of the table, same arguments as Crash
+    def Append(self, wc, sc, inj, date, time, lat=NO_COORDINATE, lon=NO_COORDINATE):
+        day = DayOfYear(date)
+        self.AppendEncoded(wc, sc, inj, day, (time.hour * 60) + time.minute, lat, lon)
+
+    # Adds a crash given as day of year and minute of day
+    def AppendEncoded(self, wc, sc, inj, day, minutes, lat=NO_COORDINATE, lon=NO_COORDINATE):
+        self.Weather.append(CategoryCode(wc))
+        self.Surface.append(CategoryCode(sc))
+        self.Injuries.append(inj)
+        self.DayOfYear.append(day)
+        self.MinuteOfDay.append(minutes)
+        self.Latitude.append(lat)
+        self.Longitude.append(lon)
+        self.NearestPrototypeIX.append(-1)
+
+    # Returns a new table holding only the crashes at the given indexes
+    def Take(self, ixs):
+        table = CrashTable()
+        for name in ("Weather", "Surface", "Injuries", "DayOfYear", "MinuteOfDay", "Latitude", "Longitude",
+                     "NearestPrototypeIX"):
+            column = getattr(self, name)
+            getattr(table, name).extend(column[ix] for ix in ixs)
+        if len(self.NearestDistance) == len(self):
+            table.NearestDistance.extend(self.NearestDistance[ix] for ix in ixs)
+        return table
+
+    # The NearestDistance column, made as long as the table if it isn't yet
+    # (tables are put together column by column in a few places)
+    def DistanceColumn(self):
+        if len(self.NearestDistance) != len(self):
+            self.NearestDistance = array('d', [0.0]) * len(self)
+        return self.NearestDistance
+
+###############################################################################
+# A single crash inside a CrashTable, with the same attributes as a Crash.
+# Only holds the table and the row index, everything else is looked up.
+###############################################################################
+class CrashRow:
+    __slots__ = ("Table", "IX")
+
+    def __init__(self, table, ix):
+        self.Table = table
+        self.IX = ix
+
+    @property
+    def WeatherCondition(self):
+        return CATEGORY_VALUES[self.Table.Weather[self.IX]]
+
+    @property
+    def SurfaceCondition(self):
+        return CATEGORY_VALUES[self.Table.Surface[self.IX]]
+
+    @property
+    def Injuries(self):
+        return self.Table.Injuries[self.IX]
+
+    @property
+    def Date(self):
+        return datetime.date.fromordinal(DAY_OF_YEAR_BASE + self.Table.DayOfYear[self.IX])
+
+    @property
+    def Time(self):
+        minutes = self.Table.MinuteOfDay[self.IX]
+        return datetime.time(minutes // 60, minutes % 60)
+
+    @property
+    def DayOfYear(self):
+        return self.Table.DayOfYear[self.IX]
+
+    @property
+    def MinuteOfDay(self):
+        return self.Table.MinuteOfDay[self.IX]
+
+    @property
+    def Latitude(self):
+        return self.Table.Latitude[self.IX]
+
+    @property
+    def Longitude(self):
+        return self.Table.Longitude[self.IX]
+
+    @property
+    def NearestPrototypeIX(self):
+        prototype_ix = self.Table.NearestPrototypeIX[self.IX]
+        return None if prototype_ix < 0 else prototype_ix
+
+    @NearestPrototypeIX.setter
+    def NearestPrototypeIX(self, prototype_ix):
+        self.Table.NearestPrototypeIX[self.IX] = -1 if prototype_ix is None else prototype_ix
+
+    @property
+    def NearestDistance(self):
+        return self.Table.DistanceColumn()[self.IX]
+
+    @NearestDistance.setter
+    def NearestDistance(self, distance):
+        self.Table.DistanceColumn()[self.IX] = distance
+
+    def __str__(self):
+        return Crash.__str__(self)
+
+###############################################################################
+# Switches the distance metric depending on the version number. Versions 1
+# and 2 compare dates the way date_difference says to (see DATE_DIFFERENCE),
+# DATE_DIFFERENCE itself if it isn't given.
+###############################################################################
+def CrashDistance(version, c1, c2, date_difference=None):
     if version == 1:
-        return CrashDistanceV1(c1,c2)
+        return CrashDistanceV1(c1,c2,date_difference)
     elif version == 2:
-        return CrashDistanceV2(c1,c2)
+        return CrashDistanceV2(c1,c2,date_difference)
     elif version == 3:
         return CrashDistanceV3(c1,c2)
 ###############################################################################
@@ -48,17 +410,17 @@ def CrashDistance(version, c1, c2):
 # Date and time are 25% of the score each,
 # then the other three constitute the rest of the similarity measurement.
 ###############################################################################
-def CrashDistanceV1(c1, c2):
+def CrashDistanceV1(c1, c2, date_difference=None):
     score = 0
     if c1.WeatherCondition == c2.WeatherCondition:
         score += (50/3)
     if c1.SurfaceCondition == c2.SurfaceCondition:
         score += (50/3)
-    score += (50/3) * (math.fabs(c1.Injuries - c2.Injuries)/ max(c1.Injuries, c2.Injuries))
+    score += (50/3) * InjuryDifference(c1.Injuries, c2.Injuries)
     # Multiply how close the dates are by the max score the dates can achieve
-    score += (25) * (1 - (DateDifference(c1.Date, c2.Date) / 182))
+    score += (25) * (1 - (CrashDateDifference(c1, c2, date_difference) / 182))
     # Do something similar with the time
-    score += (25) * (1 - (TimeDifference(c1.Time, c2.Time) / 1439))
+    score += (25) * (1 - (math.fabs(c1.MinuteOfDay - c2.MinuteOfDay) / 1439))
     # Divide by 100, get a measure of SIMILARITY. Thus, need to subtract from 1.
     return 1 - (score / 100)
 
@@ -67,13 +429,13 @@ def CrashDistanceV1(c1, c2):
 # Only looks at numeric values, being injuries, date, and time
 # Weighs Date, Time and Injuries equally
 ###############################################################################
-def CrashDistanceV2(c1, c2):
+def CrashDistanceV2(c1, c2, date_difference=None):
     score = 0
-    score += (100/3) * (math.fabs(c1.Injuries - c2.Injuries)/ max(c1.Injuries, c2.Injuries))
+    score += (100/3) * InjuryDifference(c1.Injuries, c2.Injuries)
     # Multiply how close the dates are by the max score the dates can achieve
-    score += (100/3) * (1 - (DateDifference(c1.Date, c2.Date) / 182))
+    score += (100/3) * (1 - (CrashDateDifference(c1, c2, date_difference) / 182))
     # Do something similar with the time
-    score += (100/3) * (1 - (TimeDifference(c1.Time, c2.Time) / 1439))
+    score += (100/3) * (1 - (math.fabs(c1.MinuteOfDay - c2.MinuteOfDay) / 1439))
     # Divide by 100, get a measure of SIMILARITY. Thus, need to subtract from 1.
     return 1 - (score / 100)
 
@@ -95,6 +457,40 @@ def CrashDistanceV3(c1, c2):
     # Divide by 100, get a measure of SIMILARITY. Thus, need to subtract from 1.
     return 1 - (score / 100)
 
+###############################################################################
+# Returns how different two injury counts are, relative to the larger one.
+# Two crashes without injuries are the same (0) instead of dividing by zero,
+# which happens once real crashes are used as prototypes.
+###############################################################################
+def InjuryDifference(i1, i2):
+    largest = max(i1, i2)
+    if largest == 0:
+        return 0
+    return math.fabs(i1 - i2) / largest
+
+###############################################################################
+# Returns the difference in days between the dates of two crashes, the way
+# date_difference (or if not given, DATE_DIFFERENCE) says to
+# Crash * Crash * String -> int
+###############################################################################
+def CrashDateDifference(c1, c2, date_difference=None):
+    if (DATE_DIFFERENCE if date_difference is None else date_difference) == "reference":
+        return DateDifference(c1.Date, c2.Date)
+    return DAY_DIFFERENCE_TABLE[(c1.DayOfYear * 366) + c2.DayOfYear]
+
+###############################################################################
+# Number of days between two days of the year, going the shorter way around
+# the calendar (at most 182)
+# int * int -> int
+###############################################################################
+def DayDifference(day1, day2):
+    diff = abs(day1 - day2)
+    return min(diff, 365 - diff)
+
+# DayDifference for every pair of days of the year, looked up as
+# DAY_DIFFERENCE_TABLE[(day1 * 366) + day2]
+DAY_DIFFERENCE_TABLE = array('H', [DayDifference(day1, day2) for day1 in range(366) for day2 in range(366)])
+
 ###############################################################################
 # Returns the closest difference between two dates, regardless of year
 # ---
@@ -124,14 +520,178 @@ def TimeDifference(t1, t2):
     min_t = min(t1,t2)
     return ((max_t.hour * 60) + max_t.minute) - ((min_t.hour * 60) + min_t.minute)
 
+###############################################################################
+# NUMPY ENGINE
+# The engine works on crashes encoded as columns of numbers instead of Crash
+# objects. Weather and surface become integer codes, dates become the day of
+# the year (and the date ordinal, which DateDifference still looks at when it
+# wraps around the year), times become the minute of the day.
+# The distances it computes match the CrashDistance versions above.
+###############################################################################
+###############################################################################
+# Turns a list of crashes into a dictionary of NumPy columns
+# List<Crash> -> Dict<String, ndarray>
+###############################################################################
+def EncodeCrashes(crashes):
+    n = len(crashes)
+    weather = np.empty(n, dtype=np.int32)
+    surface = np.empty(n, dtype=np.int32)
+    injuries = np.empty(n, dtype=np.float64)
+    day = np.empty(n, dtype=np.int32)
+    ordinal = np.empty(n, dtype=np.int64)
+    minute = np.empty(n, dtype=np.int32)
+    for i in range(n):
+        crash = crashes[i]
+        weather[i] = CategoryCode(crash.WeatherCondition)
+        surface[i] = CategoryCode(crash.SurfaceCondition)
+        injuries[i] = crash.Injuries
+        day[i] = crash.DayOfYear
+        ordinal[i] = crash.Date.toordinal()
+        minute[i] = crash.MinuteOfDay
+
+    return {"weather": weather, "surface": surface, "injuries": injuries,
+            "day": day, "ordinal": ordinal, "minute": minute}
+
+# The last list of crashes that was encoded, and its encoding
+_encoded_source = None
+_encoded_crashes = None
+
+###############################################################################
+# Encodes the crashes, reusing the last encoding if it is the same list.
+# Only NearestPrototypeIX changes between K-Means iterations, so the crashes
+# only need to be encoded once per run.
+# List<Crash> -> Dict<String, ndarray>
+###############################################################################
+def EncodedCrashes(crashes):
+    global _encoded_source, _encoded_crashes
+    if _encoded_source is not crashes or len(_encoded_crashes["day"]) != len(crashes):
+        if isinstance(crashes, CrashTable):
+            _encoded_crashes = EncodeCrashTable(crashes)
+        else:
+            _encoded_crashes = EncodeCrashes(crashes)
+        _encoded_source = crashes
+    return _encoded_crashes
+
+###############################################################################
+# A CrashTable is already in columns, so categories and injuries are used
+# without copying. Days and minutes are widened so differences can go negative.
+# CrashTable -> Dict<String, ndarray>
+###############################################################################
+def EncodeCrashTable(table):
+    day = np.frombuffer(table.DayOfYear, dtype=np.uint16).astype(np.int32)
+    return {"weather": np.frombuffer(table.Weather, dtype=np.uint16),
+            "surface": np.frombuffer(table.Surface, dtype=np.uint16),
+            "injuries": np.frombuffer(table.Injuries, dtype=np.float64),
+            "day": day,
+            "ordinal": day.astype(np.int64) + DAY_OF_YEAR_BASE,
+            "minute": np.frombuffer(table.MinuteOfDay, dtype=np.uint16).astype(np.int32)}
+
+###############################################################################
+# Selects the rows given by ixs from every column of an encoding
+# Dict<String, ndarray> * ndarray -> Dict<String, ndarray>
+###############################################################################
+def TakeEncoded(encoded, ixs):
+    return {name: column[ixs] for name, column in encoded.items()}
+
+###############################################################################
+# Adds a new axis to every column so two encodings broadcast into a matrix
+# Dict<String, ndarray> * (int|None, ...) -> Dict<String, ndarray>
+###############################################################################
+def ReshapeEncoded(encoded, shape):
+    return {name: column.reshape(shape) for name, column in encoded.items()}
+
+###############################################################################
+# Same as CrashDateDifference, element by element on day and ordinal columns
+###############################################################################
+def DateDifferenceArrays(a, b, date_difference=None):
+    if (DATE_DIFFERENCE if date_difference is None else date_difference) != "reference":
+        diff = np.abs(a["day"] - b["day"])
+        return np.minimum(diff, 365 - diff)
+
+    diff = a["day"] - b["day"]
+    # When wrapping around, DateDifference compares the original dates
+    wrapped = 365 - np.abs(a["ordinal"] - b["ordinal"])
+    return np.where(diff > 182, wrapped, diff)
+
+###############################################################################
+# Same as TimeDifference, element by element on minute columns
+###############################################################################
+def TimeDifferenceArrays(a, b):
+    return np.abs(a["minute"] - b["minute"])
+
+###############################################################################
+# Same as InjuryDifference, element by element
+###############################################################################
+def InjuryDifferenceArrays(a, b):
+    diff = np.abs(a["injuries"] - b["injuries"])
+    largest = np.maximum(a["injuries"], b["injuries"])
+    return np.divide(diff, largest, out=np.zeros(np.broadcast(diff, largest).shape), where=largest != 0)
+
+###############################################################################
+# Computes CrashDistance(version, a, b) for every broadcast pair of encoded
+# crashes. Use ReshapeEncoded to get a matrix, or rows of the same length to
+# get the distance of each pair.
+# The terms are added in the same order as the scalar versions so the
+# results agree with them.
+###############################################################################
+def CrashDistanceArrays(version, a, b, date_difference=None):
+    if version == 1:
+        score = (50/3) * (a["weather"] == b["weather"])
+        score = score + (50/3) * (a["surface"] == b["surface"])
+        score = score + (50/3) * InjuryDifferenceArrays(a, b)
+        score = score + (25) * (1 - (DateDifferenceArrays(a, b, date_difference) / 182))
+        score = score + (25) * (1 - (TimeDifferenceArrays(a, b) / 1439))
+    elif version == 2:
+        score = (100/3) * InjuryDifferenceArrays(a, b)
+        score = score + (100/3) * (1 - (DateDifferenceArrays(a, b, date_difference) / 182))
+        score = score + (100/3) * (1 - (TimeDifferenceArrays(a, b) / 1439))
+    elif version == 3:
+        score = (100/3) * (a["weather"] == b["weather"])
+        score = score + (100/3) * (a["surface"] == b["surface"])
+        score = score + np.where(a["injuries"] == b["injuries"], (100/3), (100/3) * InjuryDifferenceArrays(a, b))
+    return 1 - (score / 100)
+
+# Rows of the distance matrix computed at a time, bounds the engine's memory
+ENGINE_BLOCK_SIZE = 65536
+
+###############################################################################
+# Returns the N x K matrix of distances from each crash to each prototype
+# List<Crash> * List<Crash> -> ndarray
+###############################################################################
+def CrashDistanceMatrix(version, crashes, prototypes):
+    enc_crashes = ReshapeEncoded(EncodedCrashes(crashes), (-1, 1))
+    enc_prototypes = ReshapeEncoded(EncodeCrashes(prototypes), (1, -1))
+    return CrashDistanceArrays(version, enc_crashes, enc_prototypes)
+
+###############################################################################
+# Same as argmin(CrashDistanceMatrix(...), axis=1) but only ENGINE_BLOCK_SIZE
+# rows of the matrix exist at once. Also returns the distance from each crash
+# to its nearest prototype.
+# List<Crash> * List<Crash> -> ndarray, ndarray
+###############################################################################
+def NearestPrototypes(version, crashes, prototypes):
+    enc_crashes = EncodedCrashes(crashes)
+    enc_prototypes = ReshapeEncoded(EncodeCrashes(prototypes), (1, -1))
+    nearest = np.empty(len(crashes), dtype=np.int32)
+    nearest_distance = np.empty(len(crashes), dtype=np.float64)
+    for start in range(0, len(crashes), ENGINE_BLOCK_SIZE):
+        block = ReshapeEncoded(TakeEncoded(enc_crashes, slice(start, start + ENGINE_BLOCK_SIZE)), (-1, 1))
+        distances = CrashDistanceArrays(version, block, enc_prototypes)
+        block_nearest = np.argmin(distances, axis=1)
+        nearest[start:start + ENGINE_BLOCK_SIZE] = block_nearest
+        nearest_distance[start:start + ENGINE_BLOCK_SIZE] = distances[np.arange(len(block_nearest)), block_nearest]
+    return nearest, nearest_distance
+
 ###############################################################################
 # Computes the "Average" crash within a cluster
 # List<Crash> -> Crash
 ###############################################################################
 def ComputeClusterMean(clust, CurrentCenter):
-    if clust == []:
+    if len(clust) == 0:
         return CurrentCenter
-    
+    if isinstance(clust, CrashTable):
+        return ComputeTableMean(clust)
+
     weather = Counter([x.WeatherCondition for x in clust]).most_common(1)[0][0]
     surface = Counter([x.SurfaceCondition for x in clust]).most_common(1)[0][0]
     injuries =  math.ceil(sum([x.Injuries for x in clust]) / len(clust))
@@ -142,6 +702,23 @@ def ComputeClusterMean(clust, CurrentCenter):
 
     return mean
 
+###############################################################################
+# Same as ComputeClusterMean, straight from the columns of a CrashTable.
+# Counter keeps the first seen of equally common codes, like it does for
+# the values, so ties are broken the same way.
+# CrashTable -> Crash
+###############################################################################
+def ComputeTableMean(clust):
+    weather = CATEGORY_VALUES[Counter(clust.Weather).most_common(1)[0][0]]
+    surface = CATEGORY_VALUES[Counter(clust.Surface).most_common(1)[0][0]]
+    injuries = math.ceil(sum(clust.Injuries) / len(clust))
+    date = datetime.date.fromordinal(math.ceil(((DAY_OF_YEAR_BASE * len(clust)) + sum(clust.DayOfYear)) / len(clust)))
+    time_in_mins = math.ceil(sum(clust.MinuteOfDay) / len(clust))
+    time = datetime.time(math.floor(time_in_mins / 60), time_in_mins % 60)
+    mean = Crash(weather, surface, injuries, date, time)
+
+    return mean
+
 ###############################################################################
 # Computes the prototypes for this clustering
 # ListL<List<Crash>> -> List<Crash>
@@ -157,30 +734,128 @@ def FindPrototypesForClustering(clustering, OriginalPrototypes):
 
 ###############################################################################
 # Reads in crashes from file
-# ASSUMES: csv is in format: Date,Time,Injuries,Fatalities,WeatherCondition,Surface Condition
+# ASSUMES: csv is in format: Latitude,Longitude,Date,Time,Injuries,Fatalities,WeatherCondition,SurfaceCondition
 # String -> List<Crash>
 ###############################################################################
 def ReadInCrashes(filename):
-    file = open(filename)
-    file.__next__() # toss out the header
+    file = open(filename, newline="")
+    reader = csv.reader(file)
+    next(reader) # toss out the header
     crashes = []
-    for line in file:
-        data = line.split(',')
-        date = datetime.date(2010, int(data[0].split('-')[0]), int(data[0].split('-')[1]))
-        time = datetime.time(int(data[1].split(':')[0]), int(data[1].split(':')[1]))
-        injuries = float(data[2])
-        weat_con = data[4]
-        surf_con = data[5]
-        crash  = Crash(weat_con, surf_con, injuries, date, time)
-        crashes.append(crash)
+    for row in reader:
+        crashes.append(ParseCrash(row))
+    file.close()
 
     return crashes
 
 ###############################################################################
-# Assigns each crash a nearest prototype from the list of prototypes
+# Makes a Crash out of one row of cleaned.csv, as read by the csv module
+# List<String> -> Crash
+###############################################################################
+def ParseCrash(row):
+    lat = crashcache.ParseCoordinate(row[0])
+    lon = crashcache.ParseCoordinate(row[1])
+    date = ParseDate(row[2])
+    time = ParseTime(row[3])
+    injuries = float(row[4])
+    weat_con = row[6]
+    surf_con = row[7]
+    return Crash(weat_con, surf_con, injuries, date, time, lat, lon)
+
+###############################################################################
+# The date of an MM-dd string and the time of an HH:mm string. There are only
+# 365 dates and 1440 times, so each one is parsed once and then shared.
+# String -> datetime.date / datetime.time
+###############################################################################
+@functools.lru_cache(maxsize=4096)
+def ParseDate(text):
+    (month, day) = text.split('-')
+    return datetime.date(2010, int(month), int(day))
+
+@functools.lru_cache(maxsize=4096)
+def ParseTime(text):
+    (hour, minute) = text.split(':')
+    return datetime.time(int(hour), int(minute))
+
+###############################################################################
+# Reads in the crashes from a byte offset of the file on, up to its last
+# full line. Returns them and the offset just past the last line read.
+# String * int -> List<Crash>, int
+###############################################################################
+def ReadInCrashesFrom(filename, offset):
+    file = open(filename, "rb")
+    file.seek(offset)
+    data = file.read()
+    file.close()
+    data = data[:data.rfind(b"\n") + 1]
+    crashes = [ParseCrash(row) for row in csv.reader(io.StringIO(data.decode(), newline=""))]
+    return crashes, offset + len(data)
+
+###############################################################################
+# Reads in crashes the way CRASH_STORAGE says to
+# String -> List<Crash>
+###############################################################################
+def ReadCrashes(filename):
+    if CRASH_STORAGE == "cache":
+        return ReadInCachedCrashTable(filename)
+    elif CRASH_STORAGE == "table":
+        return ReadInCrashTable(filename)
+    return ReadInCrashes(filename)
+
+###############################################################################
+# Same as ReadInCrashes, but stores the crashes in a CrashTable
+# String -> CrashTable
+###############################################################################
+def ReadInCrashTable(filename):
+    file = open(filename, newline="")
+    reader = csv.reader(file)
+    next(reader) # toss out the header
+    crashes = CrashTable()
+    for row in reader:
+        (day, minutes, injuries, weat_con, surf_con, lat, lon) = crashcache.ParseCleanedRow(row)
+        crashes.AppendEncoded(weat_con, surf_con, injuries, day, minutes, lat, lon)
+    file.close()
+
+    return crashes
+
+###############################################################################
+# Same as ReadInCrashTable, but uses the binary cache of the file when it is
+# up to date. The columns are memory-mapped, nothing is parsed or copied
+# (unless the category codes of the cache need renumbering). A missing or
+# stale cache is rebuilt from the csv for next time.
+# String -> CrashTable
+###############################################################################
+def ReadInCachedCrashTable(filename):
+    cache_filename = crashcache.CacheFilename(filename)
+    cached = crashcache.OpenCache(cache_filename, filename)
+    if cached is None:
+        crashes = ReadInCrashTable(filename)
+        crashcache.WriteCache(cache_filename, filename, CATEGORY_VALUES,
+                              {name: getattr(crashes, name) for (name, typecode) in crashcache.COLUMNS})
+        return crashes
+
+    (categories, columns) = cached
+    codes = [CategoryCode(value) for value in categories]
+    crashes = CrashTable()
+    for (name, typecode) in crashcache.COLUMNS:
+        setattr(crashes, name, columns[name])
+    if codes != list(range(len(codes))):
+        crashes.Weather = array('H', [codes[code] for code in columns["Weather"]])
+        crashes.Surface = array('H', [codes[code] for code in columns["Surface"]])
+    crashes.NearestPrototypeIX = array('i', [-1]) * len(columns["Injuries"])
+
+    return crashes
+
+###############################################################################
+# Assigns each crash a nearest prototype from the list of prototypes, and
+# records the distance to it (NearestDistance) so AssignedSSE doesn't need to
+# compute it again
 # List<Crash> * List<Crash> -> List<Crash>
 ###############################################################################
 def AssignNearestPrototypes(crashes, prototypes):
+    if ENGINE == "numpy":
+        return AssignNearestPrototypesNumPy(crashes, prototypes)
+
     for crash in crashes:
         closest_prototype_ix = None
         closest_prototype_distance = float('inf')
@@ -191,27 +866,672 @@ def AssignNearestPrototypes(crashes, prototypes):
                 closest_prototype_distance = dist_to_prototype
 
         crash.NearestPrototypeIX = closest_prototype_ix
+        crash.NearestDistance = closest_prototype_distance
 
     return crashes
 
+###############################################################################
+# Same as AssignNearestPrototypes, using the NumPy distance matrix.
+# argmin picks the first of equally close prototypes, like the loop does.
+# List<Crash> * List<Crash> -> List<Crash>
+###############################################################################
+def AssignNearestPrototypesNumPy(crashes, prototypes):
+    nearest, nearest_distance = NearestPrototypes(DISTANCE_VERSION, crashes, prototypes)
+    if isinstance(crashes, CrashTable):
+        np.frombuffer(crashes.NearestPrototypeIX, dtype=np.int32)[:] = nearest
+        np.frombuffer(crashes.DistanceColumn(), dtype=np.float64)[:] = nearest_distance
+        return crashes
+
+    for crash, prototype_ix, distance in zip(crashes, nearest.tolist(), nearest_distance.tolist()):
+        crash.NearestPrototypeIX = prototype_ix
+        crash.NearestDistance = distance
+
+    return crashes
 
-# Recursively goes through the K-Means algorithm on a list of crashes until:
+###############################################################################
+# Goes through the K-Means algorithm on a list of crashes until:
 #   The SSE stays the same or gets worse, or
-#   The SSE doesn't decrease by at least a certain amount
-# List<Crash> * List<Crash>  * int -> List<Crash> , List<Crash>
+#   The SSE doesn't decrease by at least SSE_TOLERANCE of itself
+# The mode/mean prototypes don't always lower the SSE, so if the last step
+# made it worse the prototypes from before that step are kept.
+# This used to recurse once per iteration, it loops now so long runs can't
+# hit the recursion limit. Also returns the number of iterations it took.
+# List<Crash> * List<Crash>  * int -> List<Crash> , List<Crash> , int
 ###############################################################################
 def CrashKMeans(crashes, prototypes, previous_sse):
+    sampled = SSE_MODE == "sampled" and len(crashes) > SSE_SAMPLE_SIZE
+    assigner = None
+    if ASSIGNMENT == "hamerly" and CanSplitDistance(DISTANCE_VERSION):
+        # A sampled SSE computes the distances it needs itself
+        assigner = HamerlyAssigner(crashes, record_distances=not sampled)
+    if sampled:
+        sample = sorted(random.Random(SEED).sample(range(len(crashes)), SSE_SAMPLE_SIZE))
+        previous_squares = None
+    sse_bound = 0
+    iteration = 0
+    while True:
+        iteration += 1
+        event = StartIterationEvent(crashes, iteration)
+        if assigner is not None:
+            crashes = assigner.Assign(prototypes)
+        else:
+            crashes = AssignNearestPrototypes(crashes, prototypes)
+        event.Lap("assign")
+        if sampled:
+            squares = SampleSquaredDistances(crashes, prototypes, sample)
+            (cur_sse, sse_bound) = EstimateTotal(squares, len(crashes))
+            converged = False
+            if previous_squares is not None:
+                (improvement, improvement_bound) = EstimateTotal([p - c for (p, c) in zip(previous_squares, squares)], len(crashes))
+                converged = improvement <= 0 or improvement + improvement_bound < SSE_TOLERANCE * previous_sse
+            previous_squares = squares
+        else:
+            cur_sse = AssignedSSE(crashes)
+            converged = cur_sse >= previous_sse or previous_sse - cur_sse < SSE_TOLERANCE * previous_sse
+        event.Lap("sse")
+        event.Record(crashes, sse=cur_sse, sse_bound=sse_bound)
 
-    crashes = AssignNearestPrototypes(crashes, prototypes)
-    cur_sse = ComputeSSE(crashes, prototypes)
+        if converged:
+            if cur_sse > previous_sse:
+                # The last step made it worse, go back to the prototypes before it
+                prototypes = previous_prototypes
+                crashes = assigner.Assign(prototypes) if assigner is not None else AssignNearestPrototypes(crashes, prototypes)
+            event.Emit(True, crashes, len(prototypes))
+            return crashes, prototypes, iteration
 
-    if cur_sse >= previous_sse or previous_sse - cur_sse < 1000:
-        return crashes, prototypes
-    
-    clusters = SeparateClusters(crashes, len(prototypes))
+        clusters = SeparateClusters(crashes, len(prototypes))
+        event.Lap("separate")
+        previous_prototypes = prototypes
+        prototypes = FindPrototypesForClustering(clusters, prototypes)
+        event.Lap("prototypes")
+        previous_sse = cur_sse
+        event.Emit(False, crashes, len(prototypes), clusters)
+
+###############################################################################
+# SSE of the crashes from the distances AssignNearestPrototypes recorded.
+# Adds them up in the same order as ComputeSSE, so it gives the same SSE as
+# long as the crashes were assigned to these prototypes in full.
+# List<Crash> -> float
+###############################################################################
+def AssignedSSE(crashes):
+    if ENGINE == "numpy":
+        if isinstance(crashes, CrashTable):
+            distances = np.frombuffer(crashes.DistanceColumn(), dtype=np.float64)
+        else:
+            distances = np.array([crash.NearestDistance for crash in crashes], dtype=np.float64)
+        sse = 0
+        for start in range(0, len(crashes), ENGINE_BLOCK_SIZE):
+            sse += float(np.sum(distances[start:start + ENGINE_BLOCK_SIZE] ** 2))
+        return sse
+
+    if isinstance(crashes, CrashTable):
+        distances = crashes.DistanceColumn()
+    else:
+        distances = [crash.NearestDistance for crash in crashes]
+    sse = 0
+    for dist in distances:
+        sse += (dist ** 2)
+    return sse
+
+###############################################################################
+# Squared distance from each of the sampled crashes to its prototype
+# List<Crash> * List<Crash> * List<int> -> List<float>
+###############################################################################
+def SampleSquaredDistances(crashes, prototypes, sample):
+    squares = []
+    for ix in sample:
+        crash = crashes[ix]
+        squares.append(CrashDistance(DISTANCE_VERSION, crash, prototypes[crash.NearestPrototypeIX]) ** 2)
+    return squares
+
+###############################################################################
+# Estimates the sum of a value over all total crashes from its values on a
+# random sample of them. Returns the estimate and the half width of its
+# SSE_CONFIDENCE confidence interval (normal approximation, with the finite
+# population correction since the sample is drawn without replacement).
+# List<float> * int -> float, float
+###############################################################################
+def EstimateTotal(values, total):
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2 or n >= total:
+        return mean * total, 0
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    z = NormalDist().inv_cdf(0.5 + (SSE_CONFIDENCE / 2))
+    return mean * total, z * total * math.sqrt(variance / n) * math.sqrt(1 - (n / total))
+
+###############################################################################
+# INSTRUMENTATION
+# With ITERATION_LOG or ITERATION_CALLBACKS set, every CrashKMeans iteration
+# sends out an event like:
+#       {"event": "iteration", "iteration": 3, "restart": 0, "sse": 1234.5, "sse_bound": 0,
+#        "assign_seconds": 0.8, "sse_seconds": 0.2, "separate_seconds": 0.01,
+#        "prototypes_seconds": 0.05, "reassigned": 120,
+#        "cluster_sizes": [11000, 11000], "converged": false}
+# sse_bound is the half width of the confidence interval of a sampled SSE
+# (SSE_MODE), 0 for an exact one.
+# The last iteration (converged: true) has no separate/prototypes timings,
+# it stops before those steps. Events are also sent from restart workers,
+# restart tells the runs apart.
+###############################################################################
+# The restart KMeansRestart is running, for the events
+_current_restart = 0
+
+###############################################################################
+# The event of one CrashKMeans iteration, built up as the iteration goes.
+# Lap(step) records the seconds the step took (since the last lap), Record
+# adds the SSE and how many crashes were reassigned, and Emit adds the
+# cluster sizes and sends the event out.
+###############################################################################
+class IterationEvent:
+    def __init__(self, crashes, iteration):
+        self.Event = {"event": "iteration", "iteration": iteration, "restart": _current_restart}
+        self.PreviousAssignments = Assignments(crashes)
+        self.LapStarted = time.perf_counter()
+
+    def Lap(self, step):
+        now = time.perf_counter()
+        self.Event[step + "_seconds"] = now - self.LapStarted
+        self.LapStarted = now
+
+    # Counting the reassigned crashes isn't part of any step's time
+    def Record(self, crashes, **values):
+        self.Event.update(values)
+        self.Event["reassigned"] = CountReassigned(self.PreviousAssignments, Assignments(crashes))
+        self.LapStarted = time.perf_counter()
+
+    def Emit(self, converged, crashes, k, clusters=None):
+        if clusters is not None:
+            self.Event["cluster_sizes"] = [len(cluster) for cluster in clusters]
+        else:
+            self.Event["cluster_sizes"] = ClusterSizes(crashes, k)
+        self.Event["converged"] = converged
+        EmitIterationEvent(self.Event)
+
+###############################################################################
+# Stands in for an IterationEvent when nothing listens for events, so an
+# uninstrumented run doesn't time or count anything
+###############################################################################
+class NoIterationEvent:
+    def Lap(self, step):
+        pass
+
+    def Record(self, crashes, **values):
+        pass
+
+    def Emit(self, converged, crashes, k, clusters=None):
+        pass
+
+NO_ITERATION_EVENT = NoIterationEvent()
+
+###############################################################################
+# The event for an iteration of CrashKMeans, or NO_ITERATION_EVENT if there is
+# no ITERATION_LOG and no ITERATION_CALLBACKS
+# List<Crash> * int -> IterationEvent
+###############################################################################
+def StartIterationEvent(crashes, iteration):
+    if ITERATION_LOG is None and len(ITERATION_CALLBACKS) == 0:
+        return NO_ITERATION_EVENT
+    return IterationEvent(crashes, iteration)
+
+###############################################################################
+# Sends an event to ITERATION_LOG and every function in ITERATION_CALLBACKS
+# Dict -> None
+###############################################################################
+def EmitIterationEvent(event):
+    if ITERATION_LOG is not None:
+        WriteJSONLine(ITERATION_LOG, event)
+    for callback in ITERATION_CALLBACKS:
+        callback(event)
+
+###############################################################################
+# Appends an event to a JSON-lines file. The file is opened for every event
+# so the log can be watched (tail -f) while a long run goes on, and so
+# forked restart workers can write to it too.
+# String * Dict -> None
+###############################################################################
+def WriteJSONLine(filename, event):
+    event = dict(event, time=time.time(), pid=os.getpid())
+    file = open(filename, "a")
+    file.write(json.dumps(event) + "\n")
+    file.close()
+
+###############################################################################
+# The prototype index of every crash, as one array
+# List<Crash> -> array<int>
+###############################################################################
+def Assignments(crashes):
+    if isinstance(crashes, CrashTable):
+        return array('i', crashes.NearestPrototypeIX)
+    return array('i', [-1 if crash.NearestPrototypeIX is None else crash.NearestPrototypeIX for crash in crashes])
+
+###############################################################################
+# Number of crashes whose prototype changed between two Assignments
+# array<int> * array<int> -> int
+###############################################################################
+def CountReassigned(before, after):
+    if np is not None:
+        return int(np.count_nonzero(np.frombuffer(before, dtype=np.int32) != np.frombuffer(after, dtype=np.int32)))
+    return sum(1 for (b, a) in zip(before, after) if b != a)
+
+###############################################################################
+# Number of crashes assigned to each of the k prototypes
+# List<Crash> * int -> List<int>
+###############################################################################
+def ClusterSizes(crashes, k):
+    counts = Counter(Assignments(crashes))
+    return [counts[prototype_ix] for prototype_ix in range(k)]
+
+###############################################################################
+# Runs function(*args) under the profiler PROFILE asks for and prints what
+# it found. Returns what function returns.
+# Function * ... -> ...
+###############################################################################
+def Profiled(function, *args):
+    if PROFILE == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, *args)
+        profiler.dump_stats(PROFILE_FILENAME)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        print("Profile saved to " + PROFILE_FILENAME)
+        return result
+    if PROFILE == "tracemalloc":
+        tracemalloc.start()
+        result = function(*args)
+        (current, peak) = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print("Peak traced memory: " + str(round(peak / (1024 * 1024), 1)) + " MB")
+        for stat in snapshot.statistics("lineno")[:10]:
+            print(stat)
+        return result
+    return function(*args)
+
+###############################################################################
+# ACCELERATED ASSIGNMENT
+# Hamerly's method skips distance computations using the triangle inequality,
+# but none of the CrashDistance versions is a true metric. What we can do is
+# split a distance into a metric part and a bounded rest:
+#       CrashDistance(c1, c2) = metric(c1, c2) + rest(c1, c2)
+#       REST_MIN <= rest(c1, c2) <= REST_MAX
+# and keep the bounds on the metric part only. A crash provably keeps its
+# prototype a if
+#       upper bound of metric(x, a) + REST_MAX < lower bound of metric(x, other) + REST_MIN
+# which makes the skipping exact: crashes get the same prototype as with
+# AssignNearestPrototypes. The rest only depends on the injuries, so
+# instead of REST_MIN/REST_MAX HamerlyAssigner uses the exact rest to the
+# assigned prototype and the smallest rest to any other prototype, worked out
+# once per injury count. The wider the rest, the less gets skipped.
+#
+# Version 1: exact with DATE_DIFFERENCE = "circular".
+#            metric = 1/6 per differing weather/surface condition + the date
+#            and time parts (days around the calendar and minutes apart are
+#            both metrics), rest = the injury part, between 0 and 1/6.
+#            Not exact with "reference": DateDifference is signed and uses
+#            the dates' years when wrapping, so the date part is not a metric
+# Version 2: exact with DATE_DIFFERENCE = "circular". metric = the date and
+#            time parts, rest = the injury part, between 0 and 1/3
+# Version 3: exact. metric = 1/3 per differing weather/surface condition
+#            (Hamming distance), rest = the injury part, which is between
+#            0 and 1/3 and gets *smaller* the more the injuries differ, so it
+#            can't be part of the metric
+# CheckTriangleInequality tests a version's split on sampled crashes.
+###############################################################################
+# Version -> (REST_MIN, REST_MAX), for the versions that can be split
+METRIC_DECOMPOSITIONS = {1: (0, 1/6), 2: (0, 1/3), 3: (0, 1/3)}
+# Allowance for rounding, since metric + rest is added up differently from
+# CrashDistance
+BOUND_EPSILON = 1e-9
+
+###############################################################################
+# Splits CrashDistance(version, c1, c2) into its metric part and the rest,
+# see METRIC_DECOMPOSITIONS
+# int * Crash * Crash -> float, float
+###############################################################################
+def CrashDistanceParts(version, c1, c2):
+    return MetricPart(version, c1, c2), DistanceRest(version, c1.Injuries, c2.Injuries)
+
+###############################################################################
+# The metric part of CrashDistance(version, c1, c2), see CrashDistanceParts
+# int * Crash * Crash -> float
+###############################################################################
+def MetricPart(version, c1, c2):
+    if version == 1:
+        metric = 0
+        if c1.WeatherCondition != c2.WeatherCondition:
+            metric += 1/6
+        if c1.SurfaceCondition != c2.SurfaceCondition:
+            metric += 1/6
+        metric += 0.25 * (CrashDateDifference(c1, c2) / 182)
+        metric += 0.25 * (math.fabs(c1.MinuteOfDay - c2.MinuteOfDay) / 1439)
+    elif version == 2:
+        metric = (1/3) * (CrashDateDifference(c1, c2) / 182)
+        metric += (1/3) * (math.fabs(c1.MinuteOfDay - c2.MinuteOfDay) / 1439)
+    elif version == 3:
+        metric = 0
+        if c1.WeatherCondition != c2.WeatherCondition:
+            metric += 1/3
+        if c1.SurfaceCondition != c2.SurfaceCondition:
+            metric += 1/3
+    return metric
 
-    new_prototypes = FindPrototypesForClustering(clusters, prototypes)
-    return CrashKMeans(crashes, new_prototypes, cur_sse)
+###############################################################################
+# The rest of a distance (see CrashDistanceParts). For every version it only
+# depends on the injuries, which HamerlyAssigner uses to work it out once per
+# injury count instead of once per crash.
+# int * float * float -> float
+###############################################################################
+def DistanceRest(version, i1, i2):
+    if version == 1:
+        return (1/6) * (1 - InjuryDifference(i1, i2))
+    elif version == 2:
+        return (1/3) * (1 - InjuryDifference(i1, i2))
+    elif version == 3:
+        if i1 == i2:
+            return 0
+        return (1/3) * (1 - InjuryDifference(i1, i2))
+
+###############################################################################
+# True if distance version can be split for HamerlyAssigner right now
+# int -> bool
+###############################################################################
+def CanSplitDistance(version):
+    if version in (1, 2) and DATE_DIFFERENCE == "reference":
+        return False
+    return version in METRIC_DECOMPOSITIONS
+
+###############################################################################
+# Checks the split of a distance version on random triples of crashes.
+# Returns how many triples break the triangle inequality for the metric part,
+# how many break it for the whole distance, and how many pairs have a rest
+# outside of (REST_MIN, REST_MAX) or parts that don't add up to CrashDistance.
+# int * List<Crash> * int -> int, int, int
+###############################################################################
+def CheckTriangleInequality(version, crashes, samples=10000, seed=None):
+    rand = random.Random(SEED if seed is None else seed)
+    (rest_min, rest_max) = METRIC_DECOMPOSITIONS.get(version, (0, 0))
+    metric_violations = 0
+    distance_violations = 0
+    bad_splits = 0
+    for sample in range(samples):
+        (a, b, c) = [crashes[rand.randrange(len(crashes))] for i in range(3)]
+        if CrashDistance(version, a, c) > CrashDistance(version, a, b) + CrashDistance(version, b, c) + BOUND_EPSILON:
+            distance_violations += 1
+        if not CanSplitDistance(version):
+            continue
+        (ab, ab_rest) = CrashDistanceParts(version, a, b)
+        (bc, bc_rest) = CrashDistanceParts(version, b, c)
+        (ac, ac_rest) = CrashDistanceParts(version, a, c)
+        if ac > ab + bc + BOUND_EPSILON:
+            metric_violations += 1
+        if not (rest_min - BOUND_EPSILON <= ac_rest <= rest_max + BOUND_EPSILON) or math.fabs(ac + ac_rest - CrashDistance(version, a, c)) > BOUND_EPSILON:
+            bad_splits += 1
+
+    return metric_violations, distance_violations, bad_splits
+
+###############################################################################
+# Hamerly's accelerated K-Means assignment. Keeps, for every crash:
+#       Upper: upper bound on the metric part to its assigned prototype
+#       Lower: lower bound on the whole distance to every other prototype
+# When the prototypes move, Upper grows by how far the assigned prototype
+# moved. Lower shrinks by how far any other prototype moved, plus how much
+# its rest went down for the crash's injury count (the rests are known
+# exactly, only the metric parts need the triangle inequality). A crash
+# keeps its prototype if Upper + the rest to it is below Lower. Only the
+# crashes whose bounds can't prove that get the distance to every
+# prototype computed. Every distance is computed once, as metric part +
+# rest, and the one to the assigned prototype is recorded in
+# NearestDistance like AssignNearestPrototypes does.
+# With record_distances, the distance of every crash whose prototype moved
+# (or whose rest to it changed) is computed every iteration, so AssignedSSE
+# can add them up; the bound on it is then exact, which also skips more.
+# Crashes of prototypes that stayed put keep the distance they have. Without
+# it (for a sampled SSE), crashes the loose bounds already keep are skipped,
+# and their NearestDistance is left as it was.
+# DistanceEvaluations counts every (crash, prototype) and (prototype,
+# prototype) distance computed, compared to N x K for a full assignment.
+###############################################################################
+class HamerlyAssigner:
+    def __init__(self, crashes, record_distances=True):
+        self.Crashes = crashes
+        self.RecordDistances = record_distances
+        self.InjuryCounts = set(crash.Injuries for crash in crashes)
+        self.Upper = [0.0] * len(crashes)
+        self.Lower = [0.0] * len(crashes)
+        self.Prototypes = None
+        # Injury count -> rest to each of the prototypes
+        self.Rests = None
+        self.DistanceEvaluations = 0
+
+    # Same as AssignNearestPrototypes(self.Crashes, prototypes)
+    # List<Crash> -> List<Crash>
+    def Assign(self, prototypes):
+        rests = {injuries: [DistanceRest(DISTANCE_VERSION, injuries, prototype.Injuries) for prototype in prototypes]
+                 for injuries in self.InjuryCounts}
+
+        if self.Prototypes is None or len(prototypes) < 2:
+            for ix in range(len(self.Crashes)):
+                crash = self.Crashes[ix]
+                self.AssignFully(ix, crash, prototypes, rests[crash.Injuries])
+            self.Prototypes = prototypes
+            self.Rests = rests
+            return self.Crashes
+
+        # How far each prototype moved
+        moved = [MetricPart(DISTANCE_VERSION, old, new) for (old, new) in zip(self.Prototypes, prototypes)]
+        # Half the metric distance from each prototype to its closest other prototype
+        half_gap = [float('inf')] * len(prototypes)
+        for j in range(len(prototypes)):
+            for other in range(j + 1, len(prototypes)):
+                half = MetricPart(DISTANCE_VERSION, prototypes[j], prototypes[other]) / 2
+                half_gap[j] = min(half_gap[j], half)
+                half_gap[other] = min(half_gap[other], half)
+        self.DistanceEvaluations += len(prototypes) + (len(prototypes) * (len(prototypes) - 1)) // 2
+
+        # Injury count -> (how much the distance to any prototype but each one
+        # can have dropped, the smallest rest to any prototype but each one,
+        # whether the distance to each one stayed the same)
+        bounds = {}
+        for injuries in self.InjuryCounts:
+            (old_rest, rest) = (self.Rests[injuries], rests[injuries])
+            drops = [moved[j] + max(0, old_rest[j] - rest[j]) for j in range(len(prototypes))]
+            unchanged = [moved[j] == 0 and old_rest[j] == rest[j] for j in range(len(prototypes))]
+            bounds[injuries] = (AllButEach(drops, max), AllButEach(rest, min), unchanged)
+
+        for ix in range(len(self.Crashes)):
+            crash = self.Crashes[ix]
+            assigned = crash.NearestPrototypeIX
+            rest = rests[crash.Injuries]
+            (drop_others, rest_others, unchanged) = bounds[crash.Injuries]
+            self.Upper[ix] += moved[assigned]
+            self.Lower[ix] -= drop_others[assigned]
+            if not self.RecordDistances or unchanged[assigned]:
+                # With record_distances, Upper and NearestDistance are exact
+                # after every Assign, and stay exact while the prototype
+                # doesn't move and the rest to it stays the same
+                if self.Keeps(ix, assigned, half_gap, rest[assigned], rest_others[assigned]):
+                    continue
+                if self.RecordDistances:
+                    self.AssignFully(ix, crash, prototypes, rest)
+                    continue
+            # Tighten the upper bound and try again
+            metric = MetricPart(DISTANCE_VERSION, crash, prototypes[assigned])
+            self.DistanceEvaluations += 1
+            self.Upper[ix] = metric
+            if self.Keeps(ix, assigned, half_gap, rest[assigned], rest_others[assigned]):
+                crash.NearestDistance = metric + rest[assigned]
+                continue
+            self.AssignFully(ix, crash, prototypes, rest)
+
+        self.Prototypes = prototypes
+        self.Rests = rests
+        return self.Crashes
+
+    # True if the bounds prove crash ix is still strictly closest to assigned.
+    # Besides Lower, the distance to any other prototype is at least the
+    # metric gap between the prototypes minus Upper, plus the smallest rest.
+    def Keeps(self, ix, assigned, half_gap, rest_assigned, rest_others):
+        lower = max(self.Lower[ix], (2 * half_gap[assigned]) - self.Upper[ix] + rest_others)
+        return self.Upper[ix] + rest_assigned < lower - BOUND_EPSILON
+
+    # Looks at every prototype, like AssignNearestPrototypes, and resets the
+    # bounds. to_prototype has the rest to each prototype for the crash.
+    def AssignFully(self, ix, crash, prototypes, to_prototype):
+        closest_prototype_ix = None
+        closest_prototype_distance = float('inf')
+        metrics = []
+        distances = []
+        for prototype_ix in range(len(prototypes)):
+            metric = MetricPart(DISTANCE_VERSION, crash, prototypes[prototype_ix])
+            metrics.append(metric)
+            dist_to_prototype = metric + to_prototype[prototype_ix]
+            distances.append(dist_to_prototype)
+            if (dist_to_prototype < closest_prototype_distance):
+                closest_prototype_ix = prototype_ix
+                closest_prototype_distance = dist_to_prototype
+        self.DistanceEvaluations += len(prototypes)
+
+        crash.NearestPrototypeIX = closest_prototype_ix
+        crash.NearestDistance = closest_prototype_distance
+        self.Upper[ix] = metrics[closest_prototype_ix]
+        others = [distances[j] for j in range(len(distances)) if j != closest_prototype_ix]
+        self.Lower[ix] = min(others) if others else float('inf')
+
+###############################################################################
+# For each index, the largest (or smallest, with pick = min) of the values at
+# every other index. Works out the best two once instead of K - 1 values K
+# times. A single value gives [-inf] ([inf] for min).
+# List<float> * function -> List<float>
+###############################################################################
+def AllButEach(values, pick):
+    if len(values) < 2:
+        return [float('-inf') if pick is max else float('inf')] * len(values)
+    best = pick(range(len(values)), key=lambda j: values[j])
+    second = pick(values[j] for j in range(len(values)) if j != best)
+    return [second if j == best else values[best] for j in range(len(values))]
+
+###############################################################################
+# Running totals for one cluster, enough to compute its prototype the same
+# way ComputeClusterMean does without keeping the crashes around:
+# the counts of each weather/surface condition and the sums of the injuries,
+# date ordinals and minutes of the day.
+###############################################################################
+class ClusterStatistics:
+    def __init__(self):
+        self.Count = 0
+        self.Weather = Counter()
+        self.Surface = Counter()
+        self.InjurySum = 0
+        self.OrdinalSum = 0
+        self.MinuteSum = 0
+
+    # Adds a crash, or weight crashes just like it
+    def Add(self, crash, weight=1):
+        self.Count += weight
+        self.Weather[crash.WeatherCondition] += weight
+        self.Surface[crash.SurfaceCondition] += weight
+        self.InjurySum += weight * crash.Injuries
+        self.OrdinalSum += weight * crash.Date.toordinal()
+        self.MinuteSum += weight * crash.MinuteOfDay
+
+    def ToJSON(self):
+        return {"count": self.Count, "weather": dict(self.Weather), "surface": dict(self.Surface),
+                "injury_sum": self.InjurySum, "ordinal_sum": self.OrdinalSum, "minute_sum": self.MinuteSum}
+
+    @staticmethod
+    def FromJSON(data):
+        stats = ClusterStatistics()
+        stats.Count = data["count"]
+        stats.Weather = Counter(data["weather"])
+        stats.Surface = Counter(data["surface"])
+        stats.InjurySum = data["injury_sum"]
+        stats.OrdinalSum = data["ordinal_sum"]
+        stats.MinuteSum = data["minute_sum"]
+        return stats
+
+    # Same as ComputeClusterMean on every crash added so far
+    def Prototype(self, CurrentCenter):
+        if self.Count == 0:
+            return CurrentCenter
+
+        weather = self.Weather.most_common(1)[0][0]
+        surface = self.Surface.most_common(1)[0][0]
+        injuries = math.ceil(self.InjurySum / self.Count)
+        date = datetime.date.fromordinal(math.ceil(self.OrdinalSum / self.Count))
+        time_in_mins = math.ceil(self.MinuteSum / self.Count)
+        time = datetime.time(math.floor(time_in_mins / 60), time_in_mins % 60)
+        return Crash(weather, surface, injuries, date, time)
+
+###############################################################################
+# Builds the running totals for each cluster of a clustering, so it can be
+# kept up to date with PartialFit
+# List<List<Crash>> -> List<ClusterStatistics>
+###############################################################################
+def StatisticsForClustering(clustering):
+    statistics = []
+    for cluster in clustering:
+        stats = ClusterStatistics()
+        for crash in cluster:
+            stats.Add(crash)
+        statistics.append(stats)
+
+    return statistics
+
+###############################################################################
+# Returns the crashes at the given indexes, as a CrashTable if crashes is one
+# List<Crash> * List<int> -> List<Crash>
+###############################################################################
+def TakeCrashes(crashes, ixs):
+    if isinstance(crashes, CrashTable):
+        return crashes.Take(ixs)
+    return [crashes[ix] for ix in ixs]
+
+###############################################################################
+# Streaming K-Means step: assigns a batch of (new) crashes to the nearest
+# prototypes, adds them to the running totals of their clusters, and returns
+# the updated prototypes along with the SSE of the batch before the update.
+# The crashes of earlier batches are not needed again, every prototype is the
+# mean/mode of every crash that was ever added to its cluster.
+# List<Crash> * List<Crash> * List<ClusterStatistics> -> List<Crash>, float
+###############################################################################
+def PartialFit(batch, prototypes, statistics):
+    batch = AssignNearestPrototypes(batch, prototypes)
+    batch_sse = AssignedSSE(batch)
+    for crash in batch:
+        statistics[crash.NearestPrototypeIX].Add(crash)
+
+    new_prototypes = [statistics[i].Prototype(prototypes[i]) for i in range(len(prototypes))]
+    return new_prototypes, batch_sse
+
+###############################################################################
+# Mini-batch K-Means. Each iteration fits a random batch of MINI_BATCH_SIZE
+# crashes with PartialFit. Stops after MINI_BATCH_MAX_ITERATIONS, or once the
+# average SSE per crash (smoothed over the last few batches) changes by less
+# than MINI_BATCH_TOLERANCE of itself. Finally every crash is assigned to the
+# nearest of the prototypes found. Also returns the number of batches fitted.
+# List<Crash> * List<Crash> -> List<Crash> , List<Crash> , int
+###############################################################################
+def MiniBatchCrashKMeans(crashes, prototypes, seed=None):
+    rand = random.Random(SEED if seed is None else seed)
+    statistics = [ClusterStatistics() for prototype in prototypes]
+    batch_size = min(MINI_BATCH_SIZE, len(crashes))
+    smoothed_sse = None
+    iterations = 0
+    while iterations < MINI_BATCH_MAX_ITERATIONS:
+        iterations += 1
+        batch = TakeCrashes(crashes, rand.sample(range(len(crashes)), batch_size))
+        prototypes, batch_sse = PartialFit(batch, prototypes, statistics)
+
+        previous_sse = smoothed_sse
+        if smoothed_sse is None:
+            smoothed_sse = batch_sse / batch_size
+        else:
+            smoothed_sse = (0.7 * smoothed_sse) + (0.3 * (batch_sse / batch_size))
+        if previous_sse is not None and math.fabs(previous_sse - smoothed_sse) <= MINI_BATCH_TOLERANCE * previous_sse:
+            break
+
+    crashes = AssignNearestPrototypes(crashes, prototypes)
+    return crashes, prototypes, iterations
 
 ###############################################################################
 # Computes the SSE of this clustering by looking at each crash, figuring the
@@ -220,6 +1540,9 @@ def CrashKMeans(crashes, prototypes, previous_sse):
 # List<Crash> * List<Crash> -> int
 ###############################################################################
 def ComputeSSE(crashes, prototypes):
+    if ENGINE == "numpy":
+        return ComputeSSENumPy(crashes, prototypes)
+
     sse = 0
     for crash in crashes:
         prototype = prototypes[crash.NearestPrototypeIX]
@@ -228,13 +1551,31 @@ def ComputeSSE(crashes, prototypes):
 
     return sse
 
+###############################################################################
+# Same as ComputeSSE, pairing each encoded crash with its encoded prototype
+# List<Crash> * List<Crash> -> float
+###############################################################################
+def ComputeSSENumPy(crashes, prototypes):
+    if isinstance(crashes, CrashTable):
+        assigned = np.frombuffer(crashes.NearestPrototypeIX, dtype=np.int32)
+    else:
+        assigned = np.array([crash.NearestPrototypeIX for crash in crashes], dtype=np.intp)
+    enc_crashes = EncodedCrashes(crashes)
+    enc_prototypes = EncodeCrashes(prototypes)
+    sse = 0
+    for start in range(0, len(crashes), ENGINE_BLOCK_SIZE):
+        block = slice(start, start + ENGINE_BLOCK_SIZE)
+        dist = CrashDistanceArrays(DISTANCE_VERSION, TakeEncoded(enc_crashes, block), TakeEncoded(enc_prototypes, assigned[block]))
+        sse += float(np.sum(dist ** 2))
+    return sse
+
 ###############################################################################
 # Returns k many random crash prototypes
 ###############################################################################
-def PickStartingPrototypes(k):
+def PickStartingPrototypes(k, seed=None):
 
     # Seeding the random number generator
-    random.seed(SEED)
+    random.seed(SEED if seed is None else seed)
 
     # Note: OTHER and FOG/SMOKE/SMOG are omitted because these occur very rarely
     weat_cons = ["CLOUDY","CLEAR","RAIN","SLEET/HAIL/FREEZING RAIN","UNKNOWN", "SNOW"]
@@ -242,6 +1583,10 @@ def PickStartingPrototypes(k):
     # Same with FLOODED WATER, MUDDY, and OTHER, these are very rarely recorded
     surf_cons = ["SNOW/ICE", "WET", "DRY", "SLUSH", "UNKNOWN"]
 
+    if VALUE_COUNTS_FILE is not None:
+        weat_cons = ReadCommonValues(VALUE_COUNTS_FILE, "Weather Condition", RARE_CATEGORY_SHARE)
+        surf_cons = ReadCommonValues(VALUE_COUNTS_FILE, "Road Surface Condition", RARE_CATEGORY_SHARE)
+
     # Start and end dates for random date generation, though year is never considered...
     start_date = datetime.date(2010, 1, 1).toordinal()
     end_date = datetime.date(2014, 12, 31).toordinal()
@@ -266,12 +1611,1016 @@ def PickStartingPrototypes(k):
 
     return prototypes
 ###############################################################################
+# Copies a crash (or a CrashRow) into a new Crash, to be used as a prototype
+# Crash -> Crash
+###############################################################################
+def CopyCrash(crash):
+    return Crash(crash.WeatherCondition, crash.SurfaceCondition, crash.Injuries, crash.Date, crash.Time,
+                 crash.Latitude, crash.Longitude)
+
+###############################################################################
+# Returns, for each crash, the distance to the closest of the prototypes and
+# that prototype's index. Uses the NumPy engine if it is selected, in which
+# case the results are NumPy arrays.
+# List<Crash> * List<Crash> -> List<float>, List<int>
+###############################################################################
+def ClosestDistances(crashes, prototypes):
+    if ENGINE == "numpy":
+        nearest, nearest_distance = NearestPrototypes(DISTANCE_VERSION, crashes, prototypes)
+        return nearest_distance, nearest
+
+    distances = []
+    nearest = []
+    for crash in crashes:
+        closest_prototype_ix = None
+        closest_prototype_distance = float('inf')
+        for prototype_ix in range(len(prototypes)):
+            dist_to_prototype = CrashDistance(DISTANCE_VERSION, crash, prototypes[prototype_ix])
+            if (dist_to_prototype < closest_prototype_distance):
+                closest_prototype_ix = prototype_ix
+                closest_prototype_distance = dist_to_prototype
+        distances.append(closest_prototype_distance)
+        nearest.append(closest_prototype_ix)
+
+    return distances, nearest
+
+###############################################################################
+# D^2 weight of a crash for k-means++: its squared distance to the closest
+# prototype picked so far. Some distance versions can go below 0, those count
+# as 0 (the crash is as close as it gets).
+# List<float> -> List<float>
+###############################################################################
+def SeedingWeights(distances):
+    if IsArray(distances):
+        return np.maximum(distances, 0) ** 2
+    return [max(d, 0) ** 2 for d in distances]
+
+###############################################################################
+# Smaller of each pair of distances
+# List<float> * List<float> -> List<float>
+###############################################################################
+def ElementwiseMin(a, b):
+    if IsArray(a):
+        return np.minimum(a, b)
+    return [min(x, y) for (x, y) in zip(a, b)]
+
+def IsArray(values):
+    return np is not None and isinstance(values, np.ndarray)
+
+###############################################################################
+# Picks an index with probability proportional to its weight, or uniformly
+# if every weight is 0
+# List<float> * Random -> int
+###############################################################################
+def WeightedChoice(weights, rand):
+    if IsArray(weights):
+        cumulative = np.cumsum(weights)
+        total = float(cumulative[-1])
+    else:
+        cumulative = list(itertools.accumulate(weights))
+        total = cumulative[-1]
+    if total <= 0:
+        return rand.randrange(len(weights))
+    ix = bisect.bisect_right(cumulative, rand.random() * total)
+    return min(ix, len(weights) - 1)
+
+###############################################################################
+# k-means++ seeding: the first prototype is a random crash, each next one is
+# a crash picked with probability proportional to its squared distance to the
+# closest prototype picked so far. Converges in far fewer iterations than
+# made up random prototypes.
+# List<Crash> * int * seed -> List<Crash>
+###############################################################################
+def PickKMeansPlusPlusPrototypes(crashes, k, seed=None):
+    rand = random.Random(SEED if seed is None else seed)
+    prototypes = [CopyCrash(crashes[rand.randrange(len(crashes))])]
+    (closest, nearest) = ClosestDistances(crashes, prototypes)
+    while len(prototypes) < k:
+        prototype = CopyCrash(crashes[WeightedChoice(SeedingWeights(closest), rand)])
+        prototypes.append(prototype)
+        (distances, nearest) = ClosestDistances(crashes, [prototype])
+        closest = ElementwiseMin(closest, distances)
+
+    return prototypes
+
+###############################################################################
+# k-means|| seeding (scalable k-means++). Starts with one random crash, then
+# each of KMEANS_PARALLEL_ROUNDS passes picks every crash independently with
+# probability 2k * weight / total weight, so many candidates are picked per
+# pass over the data instead of one. The candidates are weighted by how many
+# crashes are closest to them (kept track of during the passes), narrowed
+# down to k with weighted k-means++ and refined with weighted K-Means over
+# the candidates (RefineCandidatePrototypes).
+# List<Crash> * int * seed -> List<Crash>
+###############################################################################
+def PickKMeansParallelPrototypes(crashes, k, seed=None):
+    rand = random.Random(SEED if seed is None else seed)
+    oversampling = 2 * k
+    candidates = [CopyCrash(crashes[rand.randrange(len(crashes))])]
+    (closest, nearest) = ClosestDistances(crashes, candidates)
+    for round_ix in range(KMEANS_PARALLEL_ROUNDS):
+        weights = SeedingWeights(closest)
+        total = float(sum(weights))
+        if total <= 0:
+            break
+        if IsArray(weights):
+            draws = np.random.default_rng(rand.getrandbits(64)).random(len(crashes))
+            picked = np.flatnonzero(draws < (oversampling * weights / total)).tolist()
+        else:
+            picked = [ix for ix in range(len(crashes)) if rand.random() < (oversampling * weights[ix] / total)]
+        if picked == []:
+            continue
+        new_candidates = [CopyCrash(crashes[ix]) for ix in picked]
+        (distances, new_nearest) = ClosestDistances(crashes, new_candidates)
+        (closest, nearest) = CloserOf(closest, nearest, distances, new_nearest, len(candidates))
+        candidates += new_candidates
+
+    # Too few candidates (tiny or duplicate heavy data), top up with random ones
+    while len(candidates) < k:
+        candidates.append(CopyCrash(crashes[rand.randrange(len(crashes))]))
+    if len(candidates) == k:
+        return candidates
+
+    # Weight each candidate by the number of crashes closest to it
+    counts = Counter(nearest.tolist() if IsArray(nearest) else nearest)
+    weights = [counts[ix] for ix in range(len(candidates))]
+
+    # Weighted k-means++ over the candidates
+    chosen = [WeightedChoice(weights, rand)]
+    closest = [CrashDistance(DISTANCE_VERSION, candidate, candidates[chosen[0]]) for candidate in candidates]
+    while len(chosen) < k:
+        candidate_ix = WeightedChoice([w * d for (w, d) in zip(weights, SeedingWeights(closest))], rand)
+        chosen.append(candidate_ix)
+        distances = [CrashDistance(DISTANCE_VERSION, candidate, candidates[candidate_ix]) for candidate in candidates]
+        closest = ElementwiseMin(closest, distances)
+
+    return RefineCandidatePrototypes(candidates, weights, [candidates[ix] for ix in chosen])
+
+###############################################################################
+# Closest distance and index of the closest prototype for each crash, given
+# those for the prototypes so far and for new prototypes (numbered from
+# offset on). Ties keep the earlier prototype, like ClosestDistances does.
+# List<float> * List<int> * List<float> * List<int> * int -> List<float>, List<int>
+###############################################################################
+def CloserOf(closest, nearest, distances, new_nearest, offset):
+    if IsArray(closest):
+        closer = distances < closest
+        return np.where(closer, distances, closest), np.where(closer, new_nearest + offset, nearest)
+    closer = [d < c for (c, d) in zip(closest, distances)]
+    return ([d if is_closer else c for (c, d, is_closer) in zip(closest, distances, closer)],
+            [n + offset if is_closer else old for (old, n, is_closer) in zip(nearest, new_nearest, closer)])
+
+###############################################################################
+# Weighted K-Means over the k-means|| candidates, each one standing in for
+# the crashes closest to it: assigns the candidates to the nearest
+# prototypes and moves each prototype to the weighted mean of its candidates,
+# for as long as that lowers the weighted SSE of the candidates
+# List<Crash> * List<int> * List<Crash> -> List<Crash>
+###############################################################################
+def RefineCandidatePrototypes(candidates, weights, prototypes):
+    (distances, nearest) = ClosestDistances(candidates, prototypes)
+    sse = sum(w * (d ** 2) for (w, d) in zip(weights, distances))
+    while True:
+        statistics = [ClusterStatistics() for prototype in prototypes]
+        for (candidate, weight, prototype_ix) in zip(candidates, weights, nearest):
+            statistics[prototype_ix].Add(candidate, weight)
+        refined = [statistics[i].Prototype(prototypes[i]) for i in range(len(prototypes))]
+        (distances, nearest) = ClosestDistances(candidates, refined)
+        refined_sse = sum(w * (d ** 2) for (w, d) in zip(weights, distances))
+        if refined_sse >= sse:
+            return prototypes
+        (prototypes, sse) = (refined, refined_sse)
+
+###############################################################################
+# Picks k starting prototypes the way SEEDING says to
+# List<Crash> * int * seed -> List<Crash>
+###############################################################################
+def PickInitialPrototypes(crashes, k, seed=None):
+    if SEEDING == "kmeans++":
+        return PickKMeansPlusPlusPrototypes(crashes, k, seed)
+    elif SEEDING == "kmeans||":
+        return PickKMeansParallelPrototypes(crashes, k, seed)
+    return PickStartingPrototypes(k, seed)
+
+###############################################################################
+# Seed for the given restart. The first restart uses SEED itself, so a single
+# run picks the same prototypes as before.
+# int -> seed
+###############################################################################
+def RestartSeed(restart):
+    if restart == 0 or SEED is None:
+        return SEED
+    return str(SEED) + "/" + str(restart)
+
+###############################################################################
+# Runs the K-Means selected by KMEANS_MODE. Returns the clustering, the
+# prototypes and how many iterations (or mini-batches) it took.
+# List<Crash> * List<Crash> * seed -> List<Crash> , List<Crash> , int
+###############################################################################
+def RunKMeans(crashes, prototypes, seed=None):
+    if KMEANS_MODE == "minibatch":
+        return MiniBatchCrashKMeans(crashes, prototypes, seed)
+    return CrashKMeans(crashes, prototypes, float('inf'))
+
+# The crashes the restart worker processes cluster. Set before the workers
+# are forked, so the crashes are shared with them instead of pickled.
+_restart_crashes = None
+
+###############################################################################
+# One restart: picks starting prototypes with the restart's seed and runs
+# K-Means. Returns the SSE, the prototypes, each crash's cluster and the
+# number of iterations.
+# int -> float, List<Crash>, List<int>, int
+###############################################################################
+def KMeansRestart(restart):
+    global _current_restart
+    _current_restart = restart
+    crashes = _restart_crashes
+    prototypes = PickInitialPrototypes(crashes, K, RestartSeed(restart))
+    (crashes, prototypes, iterations) = RunKMeans(crashes, prototypes, RestartSeed(restart))
+    assignments = [crash.NearestPrototypeIX for crash in crashes] if not isinstance(crashes, CrashTable) else array('i', crashes.NearestPrototypeIX)
+    return ComputeSSE(crashes, prototypes), prototypes, assignments, iterations
+
+###############################################################################
+# Runs K-Means N_INIT times from different starting prototypes and keeps the
+# run with the lowest SSE (the earliest one on ties). With N_INIT_WORKERS > 1
+# the runs are spread over that many forked processes.
+# List<Crash> -> List<Crash> , List<Crash>
+###############################################################################
+def BestOfRestarts(crashes):
+    global _restart_crashes
+    _restart_crashes = crashes
+    if N_INIT_WORKERS > 1 and N_INIT > 1:
+        executor = ProcessPoolExecutor(N_INIT_WORKERS, mp_context=multiprocessing.get_context("fork"))
+        results = list(executor.map(KMeansRestart, range(N_INIT)))
+        executor.shutdown()
+    else:
+        results = [KMeansRestart(restart) for restart in range(N_INIT)]
+    _restart_crashes = None
+
+    best = min(range(len(results)), key=lambda restart: results[restart][0])
+    (sse, prototypes, assignments, iterations) = results[best]
+    print("Kept restart " + str(best) + " of " + str(N_INIT) + ", SSE " + str(sse) + " after " + str(iterations) + " iterations")
+    if isinstance(crashes, CrashTable):
+        crashes.NearestPrototypeIX = array('i', assignments)
+    else:
+        for crash, prototype_ix in zip(crashes, assignments):
+            crash.NearestPrototypeIX = prototype_ix
+
+    return crashes, prototypes
+
+###############################################################################
+# INCREMENTAL K-MEANS
+# The state kept between runs (KMEANS_STATE_FILENAME) is JSON:
+#       settings    the settings the clustering was made with
+#       offset      how far into cleaned.csv the crashes have been added,
+#       sha1        and the sha1 of cleaned.csv up to there
+#       prototypes  [weather, surface, injuries, date ordinal, minute of day]
+#       statistics  the ClusterStatistics of each cluster
+#       fitted_sse  SSE per crash right after the last full clustering
+#       added_sse,  SSE of the crashes added since the last full clustering
+#       added_count (each when it was added), and how many there are
+# The SSE of a crash isn't recomputed when the prototypes move later on, so
+# added_sse / added_count is how well the new crashes fit as they came in.
+# Only those count towards the drift: with the whole history in it, the
+# more crashes a clustering has the longer new ones could fit it badly
+# before a refit.
+###############################################################################
+
+###############################################################################
+# The settings that have to match for a saved clustering to be reused
+# None -> Dict
+###############################################################################
+def IncrementalSettings():
+    return {"K": K, "DISTANCE_VERSION": DISTANCE_VERSION, "DATE_DIFFERENCE": DATE_DIFFERENCE,
+            "CATEGORY_FORMAT": crashcache.FORMAT_VERSION, "STATE_FORMAT": KMEANS_STATE_FORMAT}
+
+def CrashToJSON(crash):
+    return [crash.WeatherCondition, crash.SurfaceCondition, crash.Injuries, crash.Date.toordinal(), crash.MinuteOfDay]
+
+def CrashFromJSON(data):
+    (weather, surface, injuries, ordinal, minutes) = data
+    return Crash(weather, surface, injuries, datetime.date.fromordinal(ordinal), datetime.time(minutes // 60, minutes % 60))
+
+###############################################################################
+# Reads the saved clustering, None if there is none or it can't be used for
+# filename any more (other settings, or the file changed before the offset)
+# String -> Dict
+###############################################################################
+def LoadKMeansState(filename):
+    if not os.path.exists(KMEANS_STATE_FILENAME):
+        return None
+    file = open(KMEANS_STATE_FILENAME)
+    state = json.load(file)
+    file.close()
+    if state["settings"] != IncrementalSettings():
+        return None
+    if os.path.getsize(filename) < state["offset"] or crashcache.PrefixHash(filename, state["offset"]) != state["sha1"]:
+        return None
+    return state
+
+###############################################################################
+# Saves the prototypes of a clustering and the distance settings they were
+# made with (SCORING_STATE_FILENAME), for scoring.py
+# List<Crash> -> None
+###############################################################################
+def SaveScoringState(prototypes):
+    state = {"settings": {"CLUSTERING": CLUSTERING, "K": len(prototypes), "DISTANCE_VERSION": DISTANCE_VERSION,
+                          "DATE_DIFFERENCE": DATE_DIFFERENCE},
+             "prototypes": [CrashToJSON(prototype) for prototype in prototypes]}
+    file = open(SCORING_STATE_FILENAME + ".tmp", "w")
+    json.dump(state, file)
+    file.close()
+    os.replace(SCORING_STATE_FILENAME + ".tmp", SCORING_STATE_FILENAME)
+
+def SaveKMeansState(state):
+    file = open(KMEANS_STATE_FILENAME + ".tmp", "w")
+    json.dump(state, file)
+    file.close()
+    os.replace(KMEANS_STATE_FILENAME + ".tmp", KMEANS_STATE_FILENAME)
+
+###############################################################################
+# Clusters every crash in the file from scratch and saves the state for
+# IncrementalKMeans. Assumes the file isn't written to during the run.
+# String -> Dict
+###############################################################################
+def FullKMeansState(filename):
+    offset = os.path.getsize(filename)
+    crashes = ReadCrashes(filename)
+    (crashes, prototypes) = BestOfRestarts(crashes)
+    statistics = StatisticsForClustering(SeparateClusters(crashes, len(prototypes)))
+    sse = ComputeSSE(crashes, prototypes)
+    state = {"settings": IncrementalSettings(),
+             "offset": offset,
+             "sha1": crashcache.PrefixHash(filename, offset),
+             "prototypes": [CrashToJSON(prototype) for prototype in prototypes],
+             "statistics": [stats.ToJSON() for stats in statistics],
+             "fitted_sse": sse / max(len(crashes), 1),
+             "added_sse": 0,
+             "added_count": 0}
+    SaveKMeansState(state)
+    return state
+
+###############################################################################
+# How much higher (relative) the SSE per crash of the crashes added since the
+# last full clustering is than that clustering's, 0 if none were added
+# Dict -> float
+###############################################################################
+def SSEDrift(state):
+    if state["added_count"] == 0 or state["fitted_sse"] <= 0:
+        return 0
+    return ((state["added_sse"] / state["added_count"]) / state["fitted_sse"]) - 1
+
+###############################################################################
+# Brings the saved clustering up to date with the crashes added to the file
+# since the last run: they are assigned to the nearest prototypes and added
+# to the running totals of their clusters, which moves the prototypes the
+# same as ComputeClusterMean over the whole cluster would (PartialFit).
+# Crashes from earlier runs are not read or reassigned. Falls back to a full
+# clustering (FullKMeansState) when there is no usable state, or the SSE per
+# crash drifted more than INCREMENTAL_SSE_DRIFT from the last full one.
+# String -> List<Crash>, List<ClusterStatistics>
+###############################################################################
+def IncrementalKMeans(filename):
+    state = LoadKMeansState(filename)
+    if state is None:
+        print("No saved clustering for " + filename + ", clustering everything...")
+        state = FullKMeansState(filename)
+    else:
+        (crashes, offset) = ReadInCrashesFrom(filename, state["offset"])
+        prototypes = [CrashFromJSON(prototype) for prototype in state["prototypes"]]
+        statistics = [ClusterStatistics.FromJSON(stats) for stats in state["statistics"]]
+        if crashes:
+            (prototypes, batch_sse) = PartialFit(crashes, prototypes, statistics)
+            state["added_sse"] += batch_sse
+            state["added_count"] += len(crashes)
+        state["offset"] = offset
+        state["sha1"] = crashcache.PrefixHash(filename, offset)
+        state["prototypes"] = [CrashToJSON(prototype) for prototype in prototypes]
+        state["statistics"] = [stats.ToJSON() for stats in statistics]
+        drift = SSEDrift(state)
+        print("Added " + str(len(crashes)) + " crashes, SSE per added crash is " + str(round(drift * 100, 2)) +
+              "% off the last full clustering")
+        if drift > INCREMENTAL_SSE_DRIFT:
+            print("Drifted more than " + str(INCREMENTAL_SSE_DRIFT * 100) + "%, clustering everything again...")
+            state = FullKMeansState(filename)
+        else:
+            SaveKMeansState(state)
+
+    prototypes = [CrashFromJSON(prototype) for prototype in state["prototypes"]]
+    statistics = [ClusterStatistics.FromJSON(stats) for stats in state["statistics"]]
+    return prototypes, statistics
+
+###############################################################################
+# Latitudes and longitudes of the crashes, NaN where a crash has none
+# List<Crash> -> array<float>, array<float>
+###############################################################################
+def CrashCoordinates(crashes):
+    if isinstance(crashes, CrashTable):
+        return crashes.Latitude, crashes.Longitude
+    return array('d', [crash.Latitude for crash in crashes]), array('d', [crash.Longitude for crash in crashes])
+
+# Meters in a degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111195.0
+
+###############################################################################
+# Puts the crashes on a flat map in meters, so distances between them are
+# plain Euclidean ones. Longitudes are scaled by the cosine of the crashes'
+# mean latitude (equirectangular), which is off by well under 1% over a
+# county and not by much more over a state. Crashes without coordinates get
+# NaN.
+# List<Crash> -> array<float>, array<float>
+###############################################################################
+def ProjectCrashes(crashes):
+    (lats, lons) = CrashCoordinates(crashes)
+    total = 0.0
+    located = 0
+    for lat in lats:
+        if lat == lat:
+            total += lat
+            located += 1
+    x_scale = METERS_PER_DEGREE * math.cos(math.radians(total / located if located else 0.0))
+    xs = array('d', [lon * x_scale for lon in lons])
+    ys = array('d', [lat * METERS_PER_DEGREE for lat in lats])
+    return xs, ys
+
+###############################################################################
+# Uniform grid over projected crashes, to find the crashes within a radius
+# without looking at every pair. Cells are radius / sqrt(2) wide, so any two
+# crashes in the same cell are within the radius of each other, and every
+# crash within the radius of a crash is in its cell or one of the cells
+# Neighbors gives. Crashes without coordinates aren't in any cell.
+###############################################################################
+class GridIndex:
+    def __init__(self, xs, ys, radius):
+        self.Radius = radius
+        self.CellSize = radius / math.sqrt(2)
+        # (column, row) -> indexes of the crashes in the cell
+        self.Cells = {}
+        for ix in range(len(xs)):
+            (x, y) = (xs[ix], ys[ix])
+            if x != x or y != y:
+                continue
+            key = (math.floor(x / self.CellSize), math.floor(y / self.CellSize))
+            cell = self.Cells.get(key)
+            if cell is None:
+                self.Cells[key] = [ix]
+            else:
+                cell.append(ix)
+        # Offsets of the cells that can hold a crash within the radius of a
+        # crash in cell (0, 0)
+        reach = math.ceil(radius / self.CellSize)
+        self.Offsets = [(dx, dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)
+                        if (dx, dy) != (0, 0) and self.Gap(dx) ** 2 + self.Gap(dy) ** 2 <= radius ** 2]
+
+    # Smallest distance along one axis between cells that many cells apart
+    def Gap(self, offset):
+        return max(abs(offset) - 1, 0) * self.CellSize
+
+    # Keys of the non-empty cells around a cell, not counting the cell itself
+    def Neighbors(self, key):
+        (column, row) = key
+        cells = self.Cells
+        return [neighbor for neighbor in [(column + dx, row + dy) for (dx, dy) in self.Offsets] if neighbor in cells]
+
+# Hotspot of crashes that aren't in one
+NOISE = -1
+
+###############################################################################
+# DBSCAN over projected crashes, with a GridIndex for the neighbor queries.
+# Returns the hotspot of every crash (NOISE if it isn't in one), hotspots
+# numbered biggest first.
+#       1. A crash is a core crash if at least min_crashes crashes (itself
+#          included) are within the radius. Every crash of a cell holding that
+#          many is core without counting; elsewhere counting stops as soon as
+#          there are enough, and is skipped if the cell and its neighbors
+#          don't hold enough crashes between them.
+#       2. Core crashes within the radius of each other are in the same
+#          hotspot. Core crashes in the same cell always are, so cells are
+#          joined (union-find) instead of crashes.
+#       3. A crash that isn't core joins the hotspot of the nearest core crash
+#          within the radius, if there is one.
+# Only crashes in neighboring cells are ever compared, so the time grows with
+# the number of crashes times the number near each one, not with the number
+# of pairs.
+# array<float> * array<float> * float * int -> array<int>
+###############################################################################
+def DBSCAN(xs, ys, radius, min_crashes):
+    grid = GridIndex(xs, ys, radius)
+    cells = grid.Cells
+    radius_squared = radius * radius
+
+    # 1. Core crashes of each cell that has any, and the cells around those
+    core_members = {}
+    core_around = {}
+    for (key, members) in cells.items():
+        neighbors = grid.Neighbors(key)
+        if len(members) >= min_crashes:
+            core_members[key] = members
+            core_around[key] = neighbors
+            continue
+        points = [cells[neighbor] for neighbor in neighbors]
+        if len(members) + sum([len(neighbor) for neighbor in points]) < min_crashes:
+            continue
+        core = []
+        for ix in members:
+            (x, y) = (xs[ix], ys[ix])
+            count = len(members)
+            for neighbor in points:
+                for other in neighbor:
+                    dx = xs[other] - x
+                    dy = ys[other] - y
+                    if dx * dx + dy * dy <= radius_squared:
+                        count += 1
+                if count >= min_crashes:
+                    core.append(ix)
+                    break
+        if core:
+            core_members[key] = core
+            core_around[key] = neighbors
+
+    # 2. Join neighboring cells with core crashes within the radius
+    parents = {key: key for key in core_members}
+    for (key, core) in core_members.items():
+        for neighbor in core_around[key]:
+            if neighbor > key and neighbor in core_members:
+                (root, neighbor_root) = (FindRoot(parents, key), FindRoot(parents, neighbor))
+                if root != neighbor_root and AnyWithin(xs, ys, core, core_members[neighbor], radius_squared):
+                    parents[neighbor_root] = root
+    hotspot_of_root = {}
+    hotspot_of_cell = {}
+    for key in core_members:
+        hotspot_of_cell[key] = hotspot_of_root.setdefault(FindRoot(parents, key), len(hotspot_of_root))
+
+    # 3. Label core crashes, then the rest by their nearest core crash. Only
+    # cells near a core cell (or holding one) can have crashes that join.
+    labels = array('i', [NOISE]) * len(xs)
+    candidates = {}
+    for (key, core) in core_members.items():
+        for ix in core:
+            labels[ix] = hotspot_of_cell[key]
+        if len(core) < len(cells[key]):
+            candidates.setdefault(key, []).append(key)
+        for neighbor in core_around[key]:
+            if neighbor not in core_members or len(core_members[neighbor]) < len(cells[neighbor]):
+                candidates.setdefault(neighbor, []).append(key)
+    for (key, near) in candidates.items():
+        for ix in cells[key]:
+            if labels[ix] != NOISE:
+                continue
+            (x, y) = (xs[ix], ys[ix])
+            closest = radius_squared
+            for candidate in near:
+                hotspot = hotspot_of_cell[candidate]
+                for other in core_members[candidate]:
+                    dx = xs[other] - x
+                    dy = ys[other] - y
+                    distance_squared = dx * dx + dy * dy
+                    if distance_squared <= closest:
+                        closest = distance_squared
+                        labels[ix] = hotspot
+
+    # Renumber the hotspots biggest first
+    sizes = Counter(label for label in labels if label != NOISE)
+    order = sorted(sizes, key=lambda label: (-sizes[label], label))
+    renumber = {label: new_label for (new_label, label) in enumerate(order)}
+    renumber[NOISE] = NOISE
+    return array('i', [renumber[label] for label in labels])
+
+###############################################################################
+# Root of a key in a union-find forest, halving the path to it on the way
+# Dict * key -> key
+###############################################################################
+def FindRoot(parents, key):
+    while parents[key] != key:
+        parents[key] = parents[parents[key]]
+        key = parents[key]
+    return key
+
+###############################################################################
+# True if any crash of a is within the radius of any crash of b
+# array<float> * array<float> * List<int> * List<int> * float -> bool
+###############################################################################
+def AnyWithin(xs, ys, a, b, radius_squared):
+    for ix in a:
+        (x, y) = (xs[ix], ys[ix])
+        for other in b:
+            if (xs[other] - x) ** 2 + (ys[other] - y) ** 2 <= radius_squared:
+                return True
+    return False
+
+###############################################################################
+# Size, injuries and center (mean latitude and longitude) of every hotspot,
+# biggest first
+# List<Crash> * array<int> -> List<Dict>
+###############################################################################
+def HotspotSummaries(crashes, labels):
+    (lats, lons) = CrashCoordinates(crashes)
+    injuries = crashes.Injuries if isinstance(crashes, CrashTable) else [crash.Injuries for crash in crashes]
+    hotspots = [{"hotspot": hotspot, "crashes": 0, "injuries": 0.0, "latitude": 0.0, "longitude": 0.0}
+                for hotspot in range(max(labels, default=NOISE) + 1)]
+    for ix in range(len(labels)):
+        if labels[ix] == NOISE:
+            continue
+        hotspot = hotspots[labels[ix]]
+        hotspot["crashes"] += 1
+        hotspot["injuries"] += injuries[ix]
+        hotspot["latitude"] += lats[ix]
+        hotspot["longitude"] += lons[ix]
+    for hotspot in hotspots:
+        hotspot["latitude"] /= hotspot["crashes"]
+        hotspot["longitude"] /= hotspot["crashes"]
+    return hotspots
+
+HOTSPOT_COLUMNS = ["hotspot", "crashes", "injuries", "latitude", "longitude"]
+
+def WriteHotspots(hotspots, filename):
+    file = open(filename, "w", newline="")
+    writer = csv.DictWriter(file, HOTSPOT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(hotspots)
+    file.close()
+    print("Finished writing to " + filename)
+
+###############################################################################
+# Finds the hotspots of the crashes (see DBSCAN and CLUSTERING)
+# List<Crash> -> array<int>, List<Dict>
+###############################################################################
+def FindHotspots(crashes):
+    (xs, ys) = ProjectCrashes(crashes)
+    labels = DBSCAN(xs, ys, DBSCAN_RADIUS_METERS, DBSCAN_MIN_CRASHES)
+    return labels, HotspotSummaries(crashes, labels)
+
+###############################################################################
+# K-MEDOIDS AND AGGLOMERATIVE CLUSTERING
+# Both work on a sample of the crashes, using the distance of every pair of
+# sampled crashes (a distancematrix.DistanceMatrix). A matrix is worked out
+# once per sample and distance settings, then reused by both algorithms and
+# any K: kept in this process, and with DISTANCE_MATRIX_DIRECTORY on disk.
+###############################################################################
+
+# Matrices already worked out in this process, by MatrixKey
+_distance_matrices = {}
+# The sample the matrix worker processes compute distances for. Set before
+# the workers are forked, like _restart_crashes.
+_matrix_sample = None
+
+###############################################################################
+# A random sample of size crashes, in file order
+# List<Crash> * int * seed -> List<Crash>
+###############################################################################
+def SampleCrashes(crashes, size, seed):
+    rand = random.Random(seed)
+    return TakeCrashes(crashes, sorted(rand.sample(range(len(crashes)), min(size, len(crashes)))))
+
+###############################################################################
+# What the distance matrix of a sample depends on: the sampled crashes and
+# the distance settings
+# List<Crash> -> String
+###############################################################################
+def MatrixKey(sample):
+    sha1 = hashlib.sha1(json.dumps({"DISTANCE_VERSION": DISTANCE_VERSION, "DATE_DIFFERENCE": DATE_DIFFERENCE}).encode())
+    for crash in sample:
+        sha1.update(json.dumps(CrashToJSON(crash)).encode())
+    return sha1.hexdigest()
+
+###############################################################################
+# Distances of the pairs of a block of rows, in the order a DistanceMatrix
+# keeps them: crash i to crashes i+1 ... n-1, for each row i
+# List<Crash> * int * int -> array<float>
+###############################################################################
+def DistanceRows(sample, row_start, row_end):
+    n = len(sample)
+    values = array('f')
+    if ENGINE == "numpy":
+        encoded = EncodedCrashes(sample)
+        for i in range(row_start, row_end):
+            distances = CrashDistanceArrays(DISTANCE_VERSION, TakeEncoded(encoded, slice(i, i + 1)),
+                                            TakeEncoded(encoded, slice(i + 1, n)))
+            values.frombytes(distances.astype(np.float32).tobytes())
+        return values
+    crashes = list(sample)
+    for i in range(row_start, row_end):
+        crash = crashes[i]
+        values.extend([CrashDistance(DISTANCE_VERSION, crash, other) for other in crashes[i + 1:]])
+    return values
+
+###############################################################################
+# Worker: works out a block of rows of the matrix of _matrix_sample, and
+# writes it into the matrix file if there is one (returns it otherwise)
+# (int, int, String) -> array<float>
+###############################################################################
+def DistanceMatrixBlock(block):
+    (row_start, row_end, temp_filename) = block
+    values = DistanceRows(_matrix_sample, row_start, row_end)
+    if temp_filename is None:
+        return values
+    distancematrix.WriteRows(temp_filename, len(_matrix_sample), row_start, values)
+    return None
+
+###############################################################################
+# The distance matrix of a sample: one this process already has, the one
+# saved in DISTANCE_MATRIX_DIRECTORY (memory-mapped), or a new one worked out
+# in blocks of rows by DISTANCE_MATRIX_WORKERS forked processes (and saved
+# there).
+# List<Crash> -> DistanceMatrix
+###############################################################################
+def PairwiseDistances(sample):
+    global _matrix_sample
+    key = MatrixKey(sample)
+    if key in _distance_matrices:
+        return _distance_matrices[key]
+    n = len(sample)
+    filename = None
+    temp_filename = None
+    if DISTANCE_MATRIX_DIRECTORY is not None:
+        filename = distancematrix.MatrixFilename(DISTANCE_MATRIX_DIRECTORY, key)
+        matrix = distancematrix.OpenMatrixFile(filename, key)
+        if matrix is not None:
+            _distance_matrices[key] = matrix
+            return matrix
+        os.makedirs(DISTANCE_MATRIX_DIRECTORY, exist_ok=True)
+        temp_filename = distancematrix.CreateMatrixFile(filename, key, n)
+
+    # A few blocks per worker, so one slow block doesn't hold up the rest
+    blocks = [(start, end, temp_filename) for (start, end) in distancematrix.BlockRanges(n, 4 * DISTANCE_MATRIX_WORKERS)]
+    _matrix_sample = sample
+    if DISTANCE_MATRIX_WORKERS > 1:
+        executor = ProcessPoolExecutor(DISTANCE_MATRIX_WORKERS, mp_context=multiprocessing.get_context("fork"))
+        results = list(executor.map(DistanceMatrixBlock, blocks))
+        executor.shutdown()
+    else:
+        results = [DistanceMatrixBlock(block) for block in blocks]
+    _matrix_sample = None
+
+    if filename is not None:
+        distancematrix.FinishMatrixFile(temp_filename, filename)
+        matrix = distancematrix.OpenMatrixFile(filename, key)
+    else:
+        values = array('f')
+        for block_values in results:
+            values.extend(block_values)
+        matrix = distancematrix.DistanceMatrix(n, values)
+    _distance_matrices[key] = matrix
+    return matrix
+
+###############################################################################
+# For every crash of a matrix: which of the medoids is nearest (its index in
+# medoids), the distance to it, and the distance to the second nearest
+# DistanceMatrix * List<int> -> List<int>, List<float>, List<float>
+###############################################################################
+def NearestTwoMedoids(matrix, medoids):
+    n = len(matrix)
+    assign = [0] * n
+    nearest = [float('inf')] * n
+    second = [float('inf')] * n
+    for (medoid_ix, medoid) in enumerate(medoids):
+        row = matrix.Row(medoid)
+        for o in range(n):
+            distance = row[o]
+            if distance < nearest[o]:
+                second[o] = nearest[o]
+                nearest[o] = distance
+                assign[o] = medoid_ix
+            elif distance < second[o]:
+                second[o] = distance
+    return assign, nearest, second
+
+###############################################################################
+# PAM k-medoids on a distance matrix. Returns the medoids (crash indexes) and
+# the total distance of every crash to its nearest medoid.
+#       BUILD picks the medoids one at a time, each time the crash that lowers
+#       the total the most.
+#       SWAP then makes the one swap of a medoid for another crash that lowers
+#       the total the most, until no swap does. Each round tries every crash
+#       against all k medoids in one pass over the crashes (FastPAM1: the
+#       loss of removing each medoid is worked out once per round), so a
+#       round is n^2 distance lookups instead of k n^2.
+# A medoid counts as 0 from itself. V1 and V2 give every crash the same
+# distance to itself instead, which adds the same to every total.
+# Rows of the matrix are read one at a time as they are needed, so it is
+# never copied whole.
+# DistanceMatrix * int -> List<int>, float
+###############################################################################
+def KMedoidsPAM(matrix, k):
+    n = len(matrix)
+    k = min(k, n)
+
+    nearest = [float('inf')] * n
+    medoids = []
+    for medoid_ix in range(k):
+        best = None
+        best_total = float('inf')
+        for candidate in range(n):
+            if candidate in medoids:
+                continue
+            total = sum(map(min, nearest, matrix.Row(candidate)))
+            if total < best_total:
+                (best, best_total) = (candidate, total)
+        medoids.append(best)
+        nearest = list(map(min, nearest, matrix.Row(best)))
+    if k < 2:
+        return medoids, sum(nearest)
+
+    while True:
+        (assign, nearest, second) = NearestTwoMedoids(matrix, medoids)
+        removal_loss = [0.0] * k
+        for o in range(n):
+            removal_loss[assign[o]] += second[o] - nearest[o]
+        # Rounding of the float32 distances mustn't make swaps go back and forth
+        best_change = -1e-9 * sum(nearest)
+        best_swap = None
+        for candidate in range(n):
+            if candidate in medoids:
+                continue
+            row = matrix.Row(candidate)
+            change = list(removal_loss)
+            shared = 0.0
+            for o in range(n):
+                distance = row[o]
+                if distance < nearest[o]:
+                    shared += distance - nearest[o]
+                    change[assign[o]] += nearest[o] - second[o]
+                elif distance < second[o]:
+                    change[assign[o]] += distance - second[o]
+            medoid_ix = min(range(k), key=change.__getitem__)
+            if change[medoid_ix] + shared < best_change:
+                best_change = change[medoid_ix] + shared
+                best_swap = (medoid_ix, candidate)
+        if best_swap is None:
+            return medoids, sum(nearest)
+        medoids[best_swap[0]] = best_swap[1]
+
+###############################################################################
+# Sum of the distances of the crashes to their assigned prototypes
+# List<Crash> -> float
+###############################################################################
+def TotalDistance(crashes):
+    if isinstance(crashes, CrashTable):
+        return sum(crashes.DistanceColumn())
+    return sum([crash.NearestDistance for crash in crashes])
+
+###############################################################################
+# K-medoids (CLUSTERING = "kmedoids"): PAM on a sample of SAMPLE_SIZE
+# crashes, the medoids being the prototypes. With CLARA_SAMPLES > 1 that many
+# samples are tried (CLARA) and the medoids with the lowest total distance
+# over all the crashes are kept. Every crash is assigned to the nearest one.
+# List<Crash> -> List<Crash> , List<Crash>
+###############################################################################
+def KMedoids(crashes):
+    best = None
+    for sample_ix in range(CLARA_SAMPLES):
+        sample = SampleCrashes(crashes, SAMPLE_SIZE, RestartSeed(sample_ix))
+        (medoids, sample_total) = KMedoidsPAM(PairwiseDistances(sample), K)
+        prototypes = [CopyCrash(sample[ix]) for ix in medoids]
+        if CLARA_SAMPLES == 1:
+            return AssignNearestPrototypes(crashes, prototypes), prototypes
+        crashes = AssignNearestPrototypes(crashes, prototypes)
+        total = TotalDistance(crashes)
+        if best is None or total < best[0]:
+            best = (total, prototypes)
+    prototypes = best[1]
+    return AssignNearestPrototypes(crashes, prototypes), prototypes
+
+###############################################################################
+# Agglomerative clustering of the crashes of a distance matrix: from one
+# cluster per crash, the two closest clusters are merged until one is left.
+# How close two clusters are is set by linkage:
+#       "single" the closest pair of crashes between them
+#       "complete" the farthest pair
+#       "average" the mean of every pair
+# Uses the nearest-neighbor chain: it follows nearest neighbors from cluster
+# to cluster until two are each other's nearest, and merges those. For these
+# linkages that makes the same merges as always merging the closest pair, in
+# n^2 time instead of n^3. Clusters are numbered by one of their crashes.
+# The distances between clusters are kept the way the matrix keeps its pairs,
+# as float64 so merged distances aren't rounded: half of a full matrix.
+# Returns every merge as (distance, cluster, cluster), in the order made.
+# DistanceMatrix * String -> List<(float, int, int)>
+###############################################################################
+def AgglomerativeMerges(matrix, linkage):
+    if linkage not in ("single", "complete", "average"):
+        raise ValueError("Unknown linkage " + str(linkage))
+    n = len(matrix)
+    distances = array('d', matrix.Values)
+    (starts, offset) = (matrix.Starts, matrix.Offset)
+    inf = float('inf')
+    sizes = [1] * n
+    active = set(range(n))
+    chain = []
+    merges = []
+    while len(active) > 1:
+        if not chain:
+            chain.append(min(active))
+        a = chain[-1]
+        start = starts[a]
+        # A cluster is infinitely far from itself
+        b = min(active, key=lambda c: distances[start + c] if a < c else distances[starts[c] + a] if c < a else inf)
+        # Ties go to the previous cluster of the chain, or it could loop
+        if len(chain) > 1 and distances[offset(a, chain[-2])] <= distances[offset(a, b)]:
+            b = chain[-2]
+        if len(chain) < 2 or b != chain[-2]:
+            chain.append(b)
+            continue
+
+        chain.pop()
+        chain.pop()
+        merges.append((distances[offset(a, b)], a, b))
+        (keep, drop) = (min(a, b), max(a, b))
+        active.remove(drop)
+        for c in active:
+            if c == keep:
+                continue
+            keep_offset = offset(keep, c)
+            (keep_distance, drop_distance) = (distances[keep_offset], distances[offset(drop, c)])
+            if linkage == "single":
+                distance = min(keep_distance, drop_distance)
+            elif linkage == "complete":
+                distance = max(keep_distance, drop_distance)
+            else:
+                distance = ((sizes[keep] * keep_distance) + (sizes[drop] * drop_distance)) / (sizes[keep] + sizes[drop])
+            distances[keep_offset] = distance
+        sizes[keep] += sizes[drop]
+    return merges
+
+###############################################################################
+# Cuts the merges of AgglomerativeMerges into k clusters: the n - k merges at
+# the smallest distances are made. Returns the cluster of every crash,
+# numbered in order of their first crash.
+# List<(float, int, int)> * int * int -> List<int>
+###############################################################################
+def CutMerges(merges, n, k):
+    parents = {ix: ix for ix in range(n)}
+    for (distance, a, b) in sorted(merges)[:max(n - k, 0)]:
+        parents[FindRoot(parents, b)] = FindRoot(parents, a)
+    numbers = {}
+    return [numbers.setdefault(FindRoot(parents, ix), len(numbers)) for ix in range(n)]
+
+###############################################################################
+# The medoid of each cluster: the member with the lowest total distance to
+# the other members
+# DistanceMatrix * List<int> -> List<int>
+###############################################################################
+def ClusterMedoids(matrix, labels):
+    members = {}
+    for (ix, label) in enumerate(labels):
+        members.setdefault(label, []).append(ix)
+    medoids = []
+    for label in sorted(members):
+        totals = []
+        for ix in members[label]:
+            row = matrix.Row(ix)
+            totals.append((sum([row[other] for other in members[label]]), ix))
+        medoids.append(min(totals)[1])
+    return medoids
+
+###############################################################################
+# Agglomerative clustering (CLUSTERING = "agglomerative") of a sample of
+# SAMPLE_SIZE crashes, cut into K clusters. The medoids of the clusters are
+# the prototypes, every crash is assigned to the nearest one.
+# List<Crash> -> List<Crash> , List<Crash>
+###############################################################################
+def AgglomerativeClustering(crashes):
+    sample = SampleCrashes(crashes, SAMPLE_SIZE, SEED)
+    matrix = PairwiseDistances(sample)
+    labels = CutMerges(AgglomerativeMerges(matrix, LINKAGE), len(matrix), K)
+    prototypes = [CopyCrash(sample[ix]) for ix in ClusterMedoids(matrix, labels)]
+    return AssignNearestPrototypes(crashes, prototypes), prototypes
+
+###############################################################################
+# Reads the values of one column from the value counts transformer.py writes,
+# leaving out values that make up less than min_share of the column.
+# Values come back most common first.
+# String * String * float -> List<String>
+###############################################################################
+def ReadCommonValues(filename, column, min_share):
+    file = open(filename)
+    file.__next__() # toss out the header
+    counts = []
+    for line in file:
+        (col, rest) = line.rstrip("\n").split(',', 1)
+        (value, count) = rest.rsplit(',', 1)
+        if col == column:
+            counts.append((value, int(count)))
+    file.close()
+
+    total = sum([count for (value, count) in counts])
+    return [value for (value, count) in counts if count >= min_share * total]
+
+###############################################################################
 # This takes the list of crashes that have been assigned to a cluster and
 # creates a List<List<Crash>> that separates out the different crashes to the
 # appropriate cluster.
+# A CrashTable is separated into one smaller CrashTable per cluster.
 # List<Crash> -> List<List<Crash>
 ###############################################################################
 def SeparateClusters(Crashes, K):
+    if isinstance(Crashes, CrashTable):
+        members = [[] for i in range(K)]
+        for crash_ix, prototype_ix in enumerate(Crashes.NearestPrototypeIX):
+            members[prototype_ix].append(crash_ix)
+        return [Crashes.Take(ixs) for ixs in members]
+
     clusters = []
     for i in range(K):
         clusters.append([])
@@ -286,34 +2635,142 @@ def SeparateClusters(Crashes, K):
 # List<List<Crash>> -> None
 ###############################################################################
 def GenerateGraph(Crashes):
+    if GRAPH_OUTPUT is not None:
+        plt.switch_backend("Agg")
+    rand = random.Random(SEED)
     scatters = []
-    colors = {0: 'r', 1: 'b', 2: 'g', 3: 'y'}
     for i in range(len(Crashes)):
-        cluster = Crashes[i]
-        x = []  # Date
-        y = []  # Time
-        
-        for crash in cluster:
-            x.append(crash.Date.toordinal())
-            t = crash.Time.isoformat()
-            (h, m, s) = t.split(":")
-            timeNum = int(h) * 3600 + int(m) * 60 + int(s)
-            y.append(timeNum)
-            
-        scatters.append(plt.scatter(x, y, c = colors[i]))
-        
+        (x, y) = ClusterCoordinates(Crashes[i])  # Date, Time
+        color = ClusterColor(i, len(Crashes))
+
+        if GRAPH_STYLE == "hexbin":
+            if len(x) > 0:
+                # Same bins for every cluster: the whole year by the whole day
+                shades = LinearSegmentedColormap.from_list("cluster" + str(i), [to_rgba(color, 0.25), to_rgba(color, 1)])
+                scatters.append(plt.hexbin(x, y, gridsize=50, cmap=shades, mincnt=1,
+                                           extent=(DAY_OF_YEAR_BASE, DAY_OF_YEAR_BASE + 365, 0, 86400)))
+            continue
+        if len(x) > GRAPH_MAX_POINTS:
+            keep = sorted(rand.sample(range(len(x)), GRAPH_MAX_POINTS))
+            x = [x[ix] for ix in keep]
+            y = [y[ix] for ix in keep]
+        scatters.append(plt.scatter(x, y, c = [color], s = 4))
+
     plt.title("Clustered Crash Data")
     plt.xlabel("Date")
     plt.ylabel("Time")
 
-    plt.show()
+    if GRAPH_OUTPUT is not None:
+        plt.savefig(GRAPH_OUTPUT)
+        plt.close()
+        print("Graph saved to " + GRAPH_OUTPUT)
+    else:
+        plt.show()
+
+###############################################################################
+# The x (date ordinal) and y (seconds into the day) of every crash in a
+# cluster, from the days of the year and minutes of the day the crashes
+# already have. Comes back as NumPy arrays when NumPy is installed.
+# List<Crash> -> List<int>, List<int>
+###############################################################################
+def ClusterCoordinates(cluster):
+    if isinstance(cluster, CrashTable):
+        days = cluster.DayOfYear
+        minutes = cluster.MinuteOfDay
+    else:
+        days = array('H', [crash.DayOfYear for crash in cluster])
+        minutes = array('H', [crash.MinuteOfDay for crash in cluster])
+    if np is not None:
+        x = np.frombuffer(days, dtype=np.uint16).astype(np.int64) + DAY_OF_YEAR_BASE
+        y = np.frombuffer(minutes, dtype=np.uint16).astype(np.int64) * 60
+        return x, y
+    return [DAY_OF_YEAR_BASE + day for day in days], [minute * 60 for minute in minutes]
+
+###############################################################################
+# Graph the hotspots on a map: the HOTSPOTS_SHOWN biggest in their own
+# colors, the rest dark grey and the noise light grey (randomly sampled down
+# to GRAPH_MAX_POINTS crashes, like GRAPH_STYLE = "scatter")
+# List<Crash> * array<int> -> None
+###############################################################################
+def GenerateHotspotGraph(crashes, labels):
+    if GRAPH_OUTPUT is not None:
+        plt.switch_backend("Agg")
+    (lats, lons) = CrashCoordinates(crashes)
+    groups = {}
+    for ix in range(len(labels)):
+        if lats[ix] == lats[ix]:
+            groups.setdefault(min(labels[ix], HOTSPOTS_SHOWN), []).append(ix)
+    rand = random.Random(SEED)
+    for (group, ixs) in sorted(groups.items()):
+        if len(ixs) > GRAPH_MAX_POINTS:
+            ixs = sorted(rand.sample(ixs, GRAPH_MAX_POINTS))
+        if group == NOISE:
+            (color, size) = ("lightgrey", 1)
+        elif group == HOTSPOTS_SHOWN:
+            (color, size) = ("dimgrey", 4)
+        else:
+            (color, size) = (ClusterColor(group, HOTSPOTS_SHOWN), 8)
+        plt.scatter([lons[ix] for ix in ixs], [lats[ix] for ix in ixs], c = [color], s = size)
+
+    plt.title("Crash Hotspots")
+    plt.xlabel("Longitude")
+    plt.ylabel("Latitude")
+
+    if GRAPH_OUTPUT is not None:
+        plt.savefig(GRAPH_OUTPUT)
+        plt.close()
+        print("Graph saved to " + GRAPH_OUTPUT)
+    else:
+        plt.show()
+
+###############################################################################
+# Color of cluster i of k. The first four are the red, blue, green and yellow
+# the graph always used, after that they come from the tab10/tab20 colormaps.
+# Past 20 clusters those would repeat, so every cluster gets its own hue
+# spread evenly around the hsv colormap instead (neighbouring hues get hard
+# to tell apart with many clusters, but no two are the same).
+# int * int -> color
+###############################################################################
+def ClusterColor(i, k):
+    colors = ['r', 'b', 'g', 'y']
+    if i < len(colors):
+        return colors[i]
+    if k <= 10:
+        return plt.get_cmap("tab10")(i)
+    if k <= 20:
+        return plt.get_cmap("tab20")(i)
+    return plt.get_cmap("hsv")(i / k)
 
 def main():
-    crashes = ReadInCrashes("cleaned.csv")
-    initial_prototypes = PickStartingPrototypes(K)
-    clustering, prototypes = CrashKMeans(crashes, initial_prototypes, float('inf'))
+    if CLUSTERING == "dbscan":
+        crashes = ReadCrashes("cleaned.csv")
+        labels, hotspots = Profiled(FindHotspots, crashes)
+        WriteHotspots(hotspots, HOTSPOTS_FILENAME)
+        noise = sum(1 for label in labels if label == NOISE)
+        print("Found " + str(len(hotspots)) + " hotspots, " + str(noise) + " of " + str(len(labels)) +
+              " crashes aren't in one")
+        for hotspot in hotspots[:HOTSPOTS_SHOWN]:
+            print("Hotspot " + str(hotspot["hotspot"]) + ", " + str(hotspot["crashes"]) + " crashes, " +
+                  str(hotspot["injuries"]) + " injuries, around " +
+                  str(round(hotspot["latitude"], 6)) + "," + str(round(hotspot["longitude"], 6)))
+        GenerateHotspotGraph(crashes, labels)
+        return
+
+    if INCREMENTAL and CLUSTERING == "kmeans":
+        (prototypes, statistics) = IncrementalKMeans("cleaned.csv")
+        SaveScoringState(prototypes)
+        # Only the new crashes were read in, so there is nothing to graph
+        for prototype_ix in range(len(prototypes)):
+            print("Cluster " + str(prototype_ix) + ", " + str(statistics[prototype_ix].Count) + " crashes, with prototype:")
+            print(prototypes[prototype_ix])
+        return
+
+    crashes = ReadCrashes("cleaned.csv")
+    cluster = {"kmeans": BestOfRestarts, "kmedoids": KMedoids, "agglomerative": AgglomerativeClustering}[CLUSTERING]
+    clustering, prototypes = Profiled(cluster, crashes)
+    SaveScoringState(prototypes)
 
-    clusters = SeparateClusters(clustering, len(initial_prototypes))
+    clusters = SeparateClusters(clustering, len(prototypes))
 
     for prototype_ix in range(len(prototypes)):
         print("Cluster " + str(prototype_ix) + ", " + str(len(clusters[prototype_ix])) + " crashes, with prototype:")
@@ -323,4 +2780,5 @@ def main():
 
     GenerateGraph(clusters)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,271 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Binary cache of cleaned.csv, shared by the transformer and the clusterer
+
+# Layout of a cache file:
+#       8 bytes     MAGIC
+#       4 bytes     length of the JSON header (little endian)
+#       JSON header source file size/mtime/sha1, number of rows, category
+#                   values and the type and offset of every column
+#       columns     fixed width little endian columns, each 8 byte aligned
+# Weather and surface are stored as codes into the category list, dates as the
+# day of the year and times as the minute of the day, same as a CrashTable.
+# Crashes without coordinates have NaN latitude and longitude.
+# The clusterer memory-maps the file and uses the columns without copying.
+
+import datetime
+import functools
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+MAGIC = b"CRSHCACH"
+# 2: weather and surface conditions without the quotes of cleaned.csv
+# 3: latitude and longitude
+FORMAT_VERSION = 3
+# Name, array typecode
+COLUMNS = [("Injuries", "d"), ("Weather", "H"), ("Surface", "H"), ("DayOfYear", "H"), ("MinuteOfDay", "H"),
+           ("Latitude", "d"), ("Longitude", "d")]
+# Rows a spilling CacheBuilder keeps in memory before writing them out
+SPILL_ROWS = 1 << 16
+# Dates are stored as days since Jan 1 2010
+DAY_OF_YEAR_BASE = datetime.date(2010, 1, 1).toordinal()
+
+# Name of the cache that goes with a cleaned csv file
+# string -> string
+def CacheFilename(csv_filename):
+    return os.path.splitext(csv_filename)[0] + ".bin"
+
+# Turns a row of cleaned.csv (as read by the csv module) into the values a
+# CrashTable stores
+# ASSUMES: csv is in format: Latitude,Longitude,Date,Time,Injuries,Fatalities,WeatherCondition,SurfaceCondition
+# list<string> -> int, int, float, string, string, float, float
+def ParseCleanedRow(row):
+    return (ParseDayOfYear(row[2]), ParseMinuteOfDay(row[3]), float(row[4]), row[6], row[7],
+            ParseCoordinate(row[0]), ParseCoordinate(row[1]))
+
+# Latitude or longitude of a crash, NaN if the export has none
+# string -> float
+def ParseCoordinate(text):
+    return float(text) if text else float("nan")
+
+# Day of the year of an MM-dd date. There are only 365 different dates, so
+# each one is worked out once.
+# string -> int
+@functools.lru_cache(maxsize=4096)
+def ParseDayOfYear(date):
+    (month, day) = date.split('-')
+    return datetime.date(2010, int(month), int(day)).toordinal() - DAY_OF_YEAR_BASE
+
+# Minute of the day of an HH:mm time, memoized like ParseDayOfYear
+# string -> int
+@functools.lru_cache(maxsize=4096)
+def ParseMinuteOfDay(time):
+    (hour, minute) = time.split(':')
+    return (int(hour) * 60) + int(minute)
+
+# What the cache remembers about its source, to tell if it is stale
+# string -> dict
+def SourceSignature(filename, with_hash=True):
+    stat = os.stat(filename)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        signature["sha1"] = PrefixHash(filename, stat.st_size)
+    return signature
+
+# sha1 of the first length bytes of a file. The transformer and the clusterer
+# also use it to tell whether a file was only appended to since a last run.
+# string * int -> string
+def PrefixHash(filename, length):
+    sha1 = hashlib.sha1()
+    f = open(filename, "rb")
+    remaining = length
+    while remaining > 0:
+        block = f.read(min(remaining, 1024 * 1024))
+        if block == b"":
+            break
+        sha1.update(block)
+        remaining -= len(block)
+    f.close()
+    return sha1.hexdigest()
+
+# Collects the columns of a cache one cleaned row at a time.
+# With spill, the columns go out to a temporary file each every SPILL_ROWS
+# rows, so only the categories stay in memory however many rows there are.
+class CacheBuilder:
+    def __init__(self, spill=False):
+        self.Categories = []
+        self.CategoryCodes = {}
+        self.Rows = 0
+        self.Columns = {name: array(typecode) for (name, typecode) in COLUMNS}
+        self.Files = {name: tempfile.TemporaryFile() for (name, typecode) in COLUMNS} if spill else None
+
+    def Code(self, value):
+        code = self.CategoryCodes.get(value)
+        if code is None:
+            code = len(self.Categories)
+            self.CategoryCodes[value] = code
+            self.Categories.append(value)
+        return code
+
+    # Adds a row of cleaned.csv, without the quotes (see ParseCleanedRow)
+    def Add(self, row):
+        (day_of_year, minute_of_day, injuries, weather, surface, latitude, longitude) = ParseCleanedRow(row)
+        self.Columns["Injuries"].append(injuries)
+        self.Columns["Weather"].append(self.Code(weather))
+        self.Columns["Surface"].append(self.Code(surface))
+        self.Columns["DayOfYear"].append(day_of_year)
+        self.Columns["MinuteOfDay"].append(minute_of_day)
+        self.Columns["Latitude"].append(latitude)
+        self.Columns["Longitude"].append(longitude)
+        self.Rows += 1
+        if self.Files is not None and len(self.Columns["Injuries"]) >= SPILL_ROWS:
+            self.Spill()
+
+    # Adds every row of another (not spilled) builder, e.g. one filled by a
+    # worker process for a chunk of the export
+    def AddBuilder(self, other):
+        codes = array('H', [self.Code(value) for value in other.Categories])
+        for (name, typecode) in COLUMNS:
+            if name in ("Weather", "Surface"):
+                self.Columns[name].extend(codes[code] for code in other.Columns[name])
+            else:
+                self.Columns[name].extend(other.Columns[name])
+        self.Rows += other.Rows
+        if self.Files is not None and len(self.Columns["Injuries"]) >= SPILL_ROWS:
+            self.Spill()
+
+    # Appends the columns in memory to their files, little endian
+    def Spill(self):
+        for (name, typecode) in COLUMNS:
+            column = self.Columns[name]
+            if sys.byteorder != "little":
+                column.byteswap()
+            column.tofile(self.Files[name])
+            self.Columns[name] = array(typecode)
+
+    # The little endian bytes of a column, in blocks
+    def ColumnBlocks(self, name, typecode):
+        if self.Files is None:
+            return ColumnArrayBlocks(self.Columns[name], typecode)
+        self.Spill()
+        f = self.Files[name]
+        f.seek(0)
+        return iter(lambda: f.read(1024 * 1024), b"")
+
+    def Write(self, cache_filename, source_filename):
+        WriteCacheFile(cache_filename, source_filename, self.Categories, self.Rows, self.ColumnBlocks)
+        if self.Files is not None:
+            for f in self.Files.values():
+                f.close()
+            self.Files = None
+
+# The little endian bytes of a column held in memory
+# array * string -> list<bytes>
+def ColumnArrayBlocks(column, typecode):
+    column = array(typecode, column)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return [column.tobytes()]
+
+# Writes a cache for source_filename from columns held in memory
+# string * string * list<string> * dict<string, array> -> None
+def WriteCache(cache_filename, source_filename, categories, columns):
+    WriteCacheFile(cache_filename, source_filename, categories, len(columns["Injuries"]),
+                   lambda name, typecode: ColumnArrayBlocks(columns[name], typecode))
+
+# Writes a cache for source_filename, getting the bytes of each column from
+# ColumnBlocks(name, typecode). Written to a temporary file first so a reader
+# never sees half a cache.
+# string * string * list<string> * int * (string * string -> iterable<bytes>) -> None
+def WriteCacheFile(cache_filename, source_filename, categories, rows, ColumnBlocks):
+    layout = []
+    offset = 0
+    for (name, typecode) in COLUMNS:
+        layout.append({"name": name, "typecode": typecode, "offset": offset})
+        offset += Align(rows * array(typecode).itemsize)
+    header = {"version": FORMAT_VERSION,
+              "source": SourceSignature(source_filename),
+              "rows": rows,
+              "categories": categories,
+              "columns": layout}
+
+    temp_filename = cache_filename + ".tmp"
+    f = open(temp_filename, "wb")
+    WriteHeader(f, MAGIC, header)
+    for (name, typecode) in COLUMNS:
+        written = 0
+        for block in ColumnBlocks(name, typecode):
+            f.write(block)
+            written += len(block)
+        f.write(b"\0" * (Align(written) - written))
+    f.close()
+    os.replace(temp_filename, cache_filename)
+
+def Align(n):
+    return (n + 7) & ~7
+
+# Writes magic, the length of the JSON header and the header, padded so what
+# comes after it starts 8 byte aligned. Returns where that is.
+# file * bytes * dict -> int
+def WriteHeader(f, magic, header):
+    data = json.dumps(header).encode()
+    data += b" " * (Align(len(magic) + 4 + len(data)) - (len(magic) + 4 + len(data)))
+    f.write(magic)
+    f.write(struct.pack("<I", len(data)))
+    f.write(data)
+    return len(magic) + 4 + len(data)
+
+# Reads a header written by WriteHeader from the start of a file. Returns the
+# header and where the data after it starts, or None if the file doesn't
+# start with magic.
+# file * bytes -> dict, int
+def ReadHeader(f, magic):
+    f.seek(0)
+    if f.read(len(magic)) != magic:
+        return None
+    (header_length,) = struct.unpack("<I", f.read(4))
+    return json.loads(f.read(header_length).decode()), len(magic) + 4 + header_length
+
+# Opens the cache for source_filename if it exists and is up to date.
+# The cache is up to date if the source has the same size and mtime, or the
+# same contents (sha1) as when the cache was written.
+# Returns None, or the category values and a dict of read only memoryviews
+# over the memory-mapped columns.
+# string * string -> list<string>, dict<string, memoryview>
+def OpenCache(cache_filename, source_filename):
+    if not os.path.exists(cache_filename) or not os.path.exists(source_filename):
+        return None
+    f = open(cache_filename, "rb")
+    try:
+        read = ReadHeader(f, MAGIC)
+        if read is None:
+            return None
+        (header, start) = read
+        if header["version"] != FORMAT_VERSION or sys.byteorder != "little":
+            return None
+        source = header["source"]
+        current = SourceSignature(source_filename, with_hash=False)
+        if current["size"] != source["size"]:
+            return None
+        if current["mtime_ns"] != source["mtime_ns"] and SourceSignature(source_filename)["sha1"] != source["sha1"]:
+            return None
+
+        rows = header["rows"]
+        if rows == 0:
+            return header["categories"], {name: memoryview(array(typecode)) for (name, typecode) in COLUMNS}
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    view = memoryview(mapped)
+    columns = {}
+    for column in header["columns"]:
+        itemsize = array(column["typecode"]).itemsize
+        begin = start + column["offset"]
+        columns[column["name"]] = view[begin:begin + (rows * itemsize)].cast(column["typecode"])
+    return header["categories"], columns
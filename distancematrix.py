@@ -0,0 +1,134 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Pairwise distance matrices of sampled crashes, kept in memory or
+#          in a memory-mapped file so they are only computed once
+
+# A matrix of n crashes keeps the distance of every pair i < j once, as
+# float32, row by row (the upper triangle without the diagonal):
+#       (0,1) (0,2) ... (0,n-1) (1,2) ... (1,n-1) ... (n-2,n-1)
+# That is n(n-1)/2 values, half of a full matrix. The pairs of a run of rows
+# are next to each other, so a worker can fill a block of rows on its own.
+# The diagonal isn't kept and reads as 0.
+# Layout of a matrix file:
+#       8 bytes     MAGIC
+#       4 bytes     length of the JSON header (little endian)
+#       JSON header the key the matrix was made for, and n
+#       values      little endian float32, 8 byte aligned
+# Files are written under a temporary name and renamed once every block is
+# in, so a half written matrix is never opened.
+
+import mmap
+import os
+import sys
+from array import array
+import crashcache
+
+MAGIC = b"CRSHDIST"
+FORMAT_VERSION = 1
+
+# Number of pairs in a matrix of n crashes
+# int -> int
+def PairCount(n):
+    return (n * (n - 1)) // 2
+
+# Position of the pair (i, j), i < j, in the values
+# int * int * int -> int
+def PairOffset(n, i, j):
+    return (i * n) - ((i * (i + 1)) // 2) + (j - i - 1)
+
+# Splits the rows of a matrix into about blocks runs of rows, each with about
+# the same number of pairs (early rows have more than late ones)
+# int * int -> list<(int, int)>
+def BlockRanges(n, blocks):
+    ranges = []
+    target = PairCount(n) / max(blocks, 1)
+    start = 0
+    pairs = 0
+    for row in range(n):
+        pairs += n - row - 1
+        if pairs >= target and row + 1 < n:
+            ranges.append((start, row + 1))
+            start = row + 1
+            pairs = 0
+    if start < n:
+        ranges.append((start, n))
+    return ranges
+
+# The distances between n crashes, over an array or a memory-mapped file
+class DistanceMatrix:
+    def __init__(self, n, values):
+        self.N = n
+        self.Values = values
+        # Pair (i, j), i < j, is at Starts[i] + j
+        self.Starts = [PairOffset(n, i, 0) for i in range(n)]
+
+    def __len__(self):
+        return self.N
+
+    # Position of the pair (i, j) in the values, either way around
+    # int * int -> int
+    def Offset(self, i, j):
+        return self.Starts[i] + j if i < j else self.Starts[j] + i
+
+    # Distances from crash i to every crash (0 to itself)
+    # int -> array<float>
+    def Row(self, i):
+        n = self.N
+        row = array('d', map(self.Values.__getitem__, map(i.__add__, self.Starts[:i])))
+        row.append(0.0)
+        start = self.Starts[i] + i + 1
+        row.extend(array('d', self.Values[start:start + (n - i - 1)]))
+        return row
+
+# Name of the matrix file for a key in a directory
+# string * string -> string
+def MatrixFilename(directory, key):
+    return os.path.join(directory, "distances-" + key[:20] + ".f32")
+
+# Starts the temporary file of a matrix: header and n(n-1)/2 zeros for the
+# blocks to be written into (see WriteRows). Returns its name.
+# string * string * int -> string
+def CreateMatrixFile(filename, key, n):
+    temp_filename = filename + ".tmp"
+    f = open(temp_filename, "wb")
+    start = crashcache.WriteHeader(f, MAGIC, {"version": FORMAT_VERSION, "key": key, "n": n})
+    f.truncate(start + (PairCount(n) * 4))
+    f.close()
+    return temp_filename
+
+# Writes the values of a block of rows, starting at row, into a file made by
+# CreateMatrixFile. Blocks don't overlap, so workers can write at once.
+# string * int * int * array<float> -> None
+def WriteRows(temp_filename, n, row, values):
+    values = array('f', values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    f = open(temp_filename, "r+b")
+    (header, start) = crashcache.ReadHeader(f, MAGIC)
+    f.seek(start + (PairOffset(n, row, row + 1) * 4))
+    f.write(values.tobytes())
+    f.close()
+
+# Gives the finished matrix file its real name
+def FinishMatrixFile(temp_filename, filename):
+    os.replace(temp_filename, filename)
+
+# Memory-maps a matrix file, None if it is missing or was made for another key
+# string * string -> DistanceMatrix
+def OpenMatrixFile(filename, key):
+    if not os.path.exists(filename):
+        return None
+    f = open(filename, "rb")
+    try:
+        read = crashcache.ReadHeader(f, MAGIC)
+        if read is None:
+            return None
+        (header, start) = read
+        if header["version"] != FORMAT_VERSION or header["key"] != key or sys.byteorder != "little":
+            return None
+        n = header["n"]
+        if PairCount(n) == 0:
+            return DistanceMatrix(n, array('f'))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    return DistanceMatrix(n, memoryview(mapped)[start:start + (PairCount(n) * 4)].cast('f'))
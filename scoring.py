@@ -0,0 +1,271 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Scores single crashes, or batches of them, against saved prototypes
+
+# Usage: python scoring.py [--http PORT | --unix PATH]
+# Loads the prototypes (and the distance settings they were made with) that
+# every clustering run of crash-clusterer.py saves, SCORING_STATE_FILENAME.
+# In-process:
+#       scorer = LoadScorer()
+#       scorer.Score({"date": "01-05", "time": "9:14", "injuries": 1,
+#                     "weather": "CLOUDY", "surface": "SLUSH"})   -> (0, 0.28)
+#       scorer.ScoreBatch([crash, crash, ...])                    -> [(ix, distance), ...]
+# Dates are MM-DD and times HH:mm (24 hour), same as cleaned.csv. Weather and
+# surface conditions can be given with or without the quotes cleaned.csv has.
+# As a server, POST a crash (or {"crashes": [...]}) as JSON to /score, or
+# send one such JSON document per line over the Unix socket. Answers are
+# {"prototype": ix, "distance": d} (or {"results": [...]} for batches).
+# Single crashes are scored with the CrashDistance versions on a light crash
+# object (no datetime objects unless the prototypes were made with
+# DATE_DIFFERENCE = "reference"), batches with the NumPy distance arrays when
+# NumPy is installed.
+
+import http.server
+import json
+import os
+import socketserver
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from clusterer_loader import LoadClusterer
+
+SCORING_STATE_FILENAME = "scoring_state.json"
+HTTP_HOST = "127.0.0.1"
+HTTP_PORT = 8765
+# Batches smaller than this are scored one crash at a time, the NumPy setup
+# costs more than it saves
+VECTORIZE_MIN_BATCH = 32
+# Code a batch gets for a weather/surface condition no prototype has. It never
+# equals a prototype's code, same as an unknown string never equals one.
+UNKNOWN_CATEGORY = -1
+
+# Days before the first of each month (2010, no leap day: Feb 29 is scored as
+# Feb 28, same as the transformer does)
+MONTH_STARTS = [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+MONTH_LENGTHS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+###############################################################################
+# A crash to be scored. Has what the CrashDistance versions look at, the date
+# and time only as day of the year and minute of the day. Date and Time are
+# only made if something asks for them.
+###############################################################################
+class ScoringCrash:
+    __slots__ = ("WeatherCondition", "SurfaceCondition", "Injuries", "DayOfYear", "MinuteOfDay")
+
+    def __init__(self, weather, surface, injuries, day_of_year, minute_of_day):
+        self.WeatherCondition = weather
+        self.SurfaceCondition = surface
+        self.Injuries = injuries
+        self.DayOfYear = day_of_year
+        self.MinuteOfDay = minute_of_day
+
+    @property
+    def Date(self):
+        cc = LoadClusterer()
+        return cc.datetime.date.fromordinal(cc.DAY_OF_YEAR_BASE + self.DayOfYear)
+
+    @property
+    def Time(self):
+        return LoadClusterer().datetime.time(self.MinuteOfDay // 60, self.MinuteOfDay % 60)
+
+###############################################################################
+# Day of the year of an MM-DD date, and minute of the day of an HH:mm time
+# String -> int
+###############################################################################
+def ParseDayOfYear(date):
+    (month, day) = date.split('-')
+    (month, day) = (int(month), int(day))
+    if month < 1 or month > 12 or day < 1 or day > MONTH_LENGTHS[month - 1] + (1 if month == 2 else 0):
+        raise ValueError("Bad date " + date)
+    return MONTH_STARTS[month - 1] + min(day, MONTH_LENGTHS[month - 1]) - 1
+
+def ParseMinuteOfDay(time):
+    (hour, minute) = time.split(':')
+    (hour, minute) = (int(hour), int(minute))
+    if hour < 0 or hour > 23 or minute < 0 or minute > 59:
+        raise ValueError("Bad time " + time)
+    return (hour * 60) + minute
+
+###############################################################################
+# A condition without the quotes and line break cleaned.csv keeps around it
+# String -> String
+###############################################################################
+def BareCondition(value):
+    return value.strip().strip('"')
+
+###############################################################################
+# Finds the nearest prototype for crashes. Made from the prototypes and the
+# distance version and DATE_DIFFERENCE they were clustered with (see
+# LoadScorer), which are passed to the distance functions, so the
+# clusterer's own settings are left alone.
+###############################################################################
+class CrashScorer:
+    def __init__(self, prototypes, version, date_difference="circular"):
+        self.Clusterer = LoadClusterer()
+        self.Prototypes = prototypes
+        self.Version = version
+        self.DateDifference = date_difference
+        # Bare condition -> the condition as the prototypes have it
+        self.Conditions = {}
+        for prototype in prototypes:
+            for value in (prototype.WeatherCondition, prototype.SurfaceCondition):
+                self.Conditions[BareCondition(value)] = value
+        self.EncodedPrototypes = None
+        if self.Clusterer.np is not None:
+            self.EncodedPrototypes = self.Clusterer.ReshapeEncoded(self.Clusterer.EncodeCrashes(prototypes), (1, -1))
+        # Condition -> the code EncodeCrashes gave it, for encoding batches.
+        # Only read after this, so requests can't grow the clusterer's
+        # category codes, and threads scoring at once don't race on them.
+        self.CategoryCodes = {}
+        for prototype in prototypes:
+            for value in (prototype.WeatherCondition, prototype.SurfaceCondition):
+                self.CategoryCodes[value] = self.Clusterer.CategoryCode(value)
+
+    # Turns a crash given as a dictionary into a ScoringCrash
+    def Crash(self, crash):
+        weather = str(crash["weather"])
+        surface = str(crash["surface"])
+        return ScoringCrash(self.Conditions.get(BareCondition(weather), weather),
+                            self.Conditions.get(BareCondition(surface), surface),
+                            float(crash["injuries"]),
+                            ParseDayOfYear(crash["date"]),
+                            ParseMinuteOfDay(crash["time"]))
+
+    # Nearest prototype index and the distance to it, for one crash
+    # dict -> int, float
+    def Score(self, crash):
+        return self.Nearest(self.Crash(crash))
+
+    def Nearest(self, crash):
+        distance = self.Clusterer.CrashDistance
+        version = self.Version
+        date_difference = self.DateDifference
+        closest_ix = None
+        closest_distance = float('inf')
+        for prototype_ix in range(len(self.Prototypes)):
+            dist_to_prototype = distance(version, crash, self.Prototypes[prototype_ix], date_difference)
+            if dist_to_prototype < closest_distance:
+                closest_ix = prototype_ix
+                closest_distance = dist_to_prototype
+        return closest_ix, closest_distance
+
+    # Score for each crash of a batch, vectorized when NumPy is installed.
+    # Ties go to the first prototype either way, like Score.
+    # List<dict> -> List<(int, float)>
+    def ScoreBatch(self, crashes):
+        crashes = [self.Crash(crash) for crash in crashes]
+        if self.EncodedPrototypes is None or len(crashes) < VECTORIZE_MIN_BATCH:
+            return [self.Nearest(crash) for crash in crashes]
+
+        cc = self.Clusterer
+        np = cc.np
+        codes = self.CategoryCodes
+        day = np.array([crash.DayOfYear for crash in crashes], dtype=np.int32)
+        encoded = {"weather": np.array([codes.get(crash.WeatherCondition, UNKNOWN_CATEGORY) for crash in crashes], dtype=np.int32),
+                   "surface": np.array([codes.get(crash.SurfaceCondition, UNKNOWN_CATEGORY) for crash in crashes], dtype=np.int32),
+                   "injuries": np.array([crash.Injuries for crash in crashes], dtype=np.float64),
+                   "day": day,
+                   "ordinal": day.astype(np.int64) + cc.DAY_OF_YEAR_BASE,
+                   "minute": np.array([crash.MinuteOfDay for crash in crashes], dtype=np.int32)}
+        distances = cc.CrashDistanceArrays(self.Version, cc.ReshapeEncoded(encoded, (-1, 1)), self.EncodedPrototypes,
+                                           self.DateDifference)
+        nearest = np.argmin(distances, axis=1)
+        nearest_distance = distances[np.arange(len(crashes)), nearest]
+        return list(zip(nearest.tolist(), nearest_distance.tolist()))
+
+###############################################################################
+# Makes a CrashScorer from the state crash-clusterer.py saves after
+# clustering (its kmeans_state.json works too), scoring with the distance
+# settings the prototypes were made with.
+# String -> CrashScorer
+###############################################################################
+def LoadScorer(filename=None):
+    cc = LoadClusterer()
+    file = open(SCORING_STATE_FILENAME if filename is None else filename)
+    state = json.load(file)
+    file.close()
+    prototypes = [cc.CrashFromJSON(prototype) for prototype in state["prototypes"]]
+    return CrashScorer(prototypes, state["settings"]["DISTANCE_VERSION"], state["settings"]["DATE_DIFFERENCE"])
+
+###############################################################################
+# Answers one request: a crash, or {"crashes": [...]}
+# CrashScorer * dict -> dict
+###############################################################################
+def Answer(scorer, request):
+    try:
+        if "crashes" in request:
+            results = scorer.ScoreBatch(request["crashes"])
+            return {"results": [{"prototype": ix, "distance": distance} for (ix, distance) in results]}
+        (ix, distance) = scorer.Score(request)
+        return {"prototype": ix, "distance": distance}
+    except (KeyError, ValueError, TypeError) as error:
+        return {"error": "Bad crash: " + repr(error)}
+
+class ScoringHTTPHandler(http.server.BaseHTTPRequestHandler):
+    Scorer = None
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.send_error(400, "Body is not JSON")
+            return
+        answer = Answer(self.Scorer, request)
+        body = json.dumps(answer).encode()
+        self.send_response(400 if "error" in answer else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ScoringSocketHandler(socketserver.StreamRequestHandler):
+    Scorer = None
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                answer = Answer(self.Scorer, json.loads(line))
+            except ValueError:
+                answer = {"error": "Line is not JSON"}
+            self.wfile.write(json.dumps(answer).encode() + b"\n")
+            self.wfile.flush()
+
+def ServeHTTP(scorer, port):
+    ScoringHTTPHandler.Scorer = scorer
+    server = http.server.ThreadingHTTPServer((HTTP_HOST, port), ScoringHTTPHandler)
+    print("Scoring on http://" + HTTP_HOST + ":" + str(port) + "/score")
+    server.serve_forever()
+
+def ServeUnixSocket(scorer, path):
+    ScoringSocketHandler.Scorer = scorer
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, ScoringSocketHandler)
+    # Open connections don't keep the process from exiting
+    server.daemon_threads = True
+    print("Scoring on " + path)
+    server.serve_forever()
+
+def Main():
+    scorer = LoadScorer()
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == "--unix":
+        ServeUnixSocket(scorer, args[1])
+    elif len(args) == 2 and args[0] == "--http":
+        ServeHTTP(scorer, int(args[1]))
+    elif len(args) == 0:
+        ServeHTTP(scorer, HTTP_PORT)
+    else:
+        print("Usage: python scoring.py [--http PORT | --unix PATH]")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,202 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Runs the clusterer over a grid of K, distance versions and seeds
+#          in parallel, to pick the settings for a clustering run
+
+# Usage: python sweep.py
+# cleaned.csv is read once (through the binary cache, like
+# CRASH_STORAGE = "cache") and its columns are copied into a shared memory
+# block. The SWEEP_WORKERS worker processes attach to that block instead of
+# reading the file or getting a pickled copy, so a worker only adds its own
+# cluster assignments on top of the shared columns.
+# Every run's SSE, silhouette score (on a sample of SILHOUETTE_SAMPLE
+# crashes), iteration count and time go to SWEEP_RESULTS_FILENAME.
+# SSEs of different distance versions can't be compared with each other,
+# the silhouette scores can (higher is better, 1 at most).
+# Everything else (SEEDING, KMEANS_MODE, ENGINE, ASSIGNMENT, ...) comes from
+# the settings at the top of crash-clusterer.py.
+
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import crashcache
+from clusterer_loader import LoadClusterer
+
+SWEEP_K = [2, 3, 4, 5, 6, 8, 10]
+SWEEP_VERSIONS = [1, 2, 3]
+SWEEP_SEEDS = ["tingo", "sweep/1", "sweep/2"]
+SWEEP_WORKERS = os.cpu_count()
+# How the workers are started ("fork", "spawn", "forkserver"), None for the
+# platform's default
+SWEEP_START_METHOD = None
+# Crashes the silhouette score is computed on, it takes
+# SILHOUETTE_SAMPLE * SILHOUETTE_SAMPLE distances
+SILHOUETTE_SAMPLE = 1000
+SWEEP_CSV = "cleaned.csv"
+SWEEP_RESULTS_FILENAME = "sweep_results.csv"
+RESULT_COLUMNS = ["k", "distance_version", "seed", "sse", "silhouette", "iterations", "seconds"]
+
+###############################################################################
+# Copies the columns of a CrashTable into a new shared memory block, laid out
+# like the columns of a crash cache. Returns the block and what a worker
+# needs to find the columns in it.
+# CrashTable -> SharedMemory, dict
+###############################################################################
+def ShareCrashTable(table):
+    cc = LoadClusterer()
+    rows = len(table)
+    layout = []
+    offset = 0
+    for (name, typecode) in crashcache.COLUMNS:
+        layout.append((name, typecode, offset))
+        offset += crashcache.Align(rows * array(typecode).itemsize)
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, typecode, offset) in layout:
+        data = array(typecode, getattr(table, name)).tobytes()
+        block.buf[offset:offset + len(data)] = data
+    description = {"name": block.name, "rows": rows, "columns": layout, "categories": list(cc.CATEGORY_VALUES)}
+    return block, description
+
+# The shared memory block a worker is attached to, and the crashes in it
+_shared_block = None
+_shared_crashes = None
+
+###############################################################################
+# Worker initializer: attaches to the shared block and wraps its columns in a
+# CrashTable without copying them. Category codes are renumbered only if the
+# worker's codes differ from the parent's (never with fork).
+# dict -> None
+###############################################################################
+def AttachCrashTable(description):
+    global _shared_block, _shared_crashes
+    cc = LoadClusterer()
+    _shared_block = shared_memory.SharedMemory(name=description["name"])
+    rows = description["rows"]
+    crashes = cc.CrashTable()
+    for (name, typecode, offset) in description["columns"]:
+        itemsize = array(typecode).itemsize
+        setattr(crashes, name, _shared_block.buf[offset:offset + (rows * itemsize)].cast(typecode))
+    codes = [cc.CategoryCode(value) for value in description["categories"]]
+    if codes != list(range(len(codes))):
+        crashes.Weather = array('H', [codes[code] for code in crashes.Weather])
+        crashes.Surface = array('H', [codes[code] for code in crashes.Surface])
+    crashes.NearestPrototypeIX = array('i', [-1]) * rows
+    _shared_crashes = crashes
+
+###############################################################################
+# Mean silhouette score of a clustering, over a random sample of the crashes.
+# For each sampled crash: a = mean distance to the sampled crashes in its own
+# cluster, b = the smallest mean distance to the sampled crashes of another
+# cluster, and its score is (b - a) / max(a, b) (0 if it is alone in its
+# cluster). Returns None if the sample has fewer than two clusters.
+# CrashTable * int * seed -> float
+###############################################################################
+def SampledSilhouette(crashes, version, seed):
+    cc = LoadClusterer()
+    rand = random.Random(seed)
+    ixs = sorted(rand.sample(range(len(crashes)), min(SILHOUETTE_SAMPLE, len(crashes))))
+    sample = cc.TakeCrashes(crashes, ixs)
+    labels = [crashes.NearestPrototypeIX[ix] for ix in ixs]
+    if len(set(labels)) < 2:
+        return None
+
+    if cc.np is not None:
+        encoded = cc.EncodeCrashTable(sample) if isinstance(sample, cc.CrashTable) else cc.EncodeCrashes(sample)
+        distances = cc.CrashDistanceArrays(version, cc.ReshapeEncoded(encoded, (-1, 1)),
+                                           cc.ReshapeEncoded(encoded, (1, -1))).tolist()
+    else:
+        rows = list(sample)
+        distances = [[cc.CrashDistance(version, a, b) for b in rows] for a in rows]
+
+    members = {}
+    for (i, label) in enumerate(labels):
+        members.setdefault(label, []).append(i)
+    total = 0
+    for (i, label) in enumerate(labels):
+        if len(members[label]) == 1:
+            continue
+        a = sum(distances[i][j] for j in members[label] if j != i) / (len(members[label]) - 1)
+        b = min(sum(distances[i][j] for j in others) / len(others)
+                for (other, others) in members.items() if other != label)
+        if max(a, b) > 0:
+            total += (b - a) / max(a, b)
+    return total / len(labels)
+
+###############################################################################
+# One run of the grid, in a worker: K-Means on the shared crashes with the
+# given K, distance version and seed.
+# int * int * seed -> dict
+###############################################################################
+def SweepRun(k, version, seed):
+    cc = LoadClusterer()
+    cc.K = k
+    cc.DISTANCE_VERSION = version
+    crashes = _shared_crashes
+    start = time.perf_counter()
+    prototypes = cc.PickInitialPrototypes(crashes, k, seed)
+    (crashes, prototypes, iterations) = cc.RunKMeans(crashes, prototypes, seed)
+    seconds = time.perf_counter() - start
+    return {"k": k, "distance_version": version, "seed": seed,
+            "sse": cc.ComputeSSE(crashes, prototypes),
+            "silhouette": SampledSilhouette(crashes, version, seed),
+            "iterations": iterations,
+            "seconds": seconds}
+
+###############################################################################
+# Runs every combination of SWEEP_K, SWEEP_VERSIONS and SWEEP_SEEDS, spread
+# over SWEEP_WORKERS processes that share the crashes. Results come back in
+# grid order.
+# CrashTable -> List<dict>
+###############################################################################
+def RunSweep(crashes):
+    grid = list(itertools.product(SWEEP_K, SWEEP_VERSIONS, SWEEP_SEEDS))
+    (block, description) = ShareCrashTable(crashes)
+    try:
+        executor = ProcessPoolExecutor(SWEEP_WORKERS, mp_context=multiprocessing.get_context(SWEEP_START_METHOD),
+                                       initializer=AttachCrashTable, initargs=(description,))
+        futures = [executor.submit(SweepRun, k, version, seed) for (k, version, seed) in grid]
+        results = []
+        for future in futures:
+            result = future.result()
+            PrintResult(result)
+            results.append(result)
+        executor.shutdown()
+    finally:
+        block.close()
+        block.unlink()
+    return results
+
+def PrintResult(result):
+    silhouette = "-" if result["silhouette"] is None else "%.4f" % result["silhouette"]
+    print("K=%-3d V%d seed=%-10s SSE=%-14.2f silhouette=%-8s %3d iterations %8.2fs" %
+          (result["k"], result["distance_version"], result["seed"], result["sse"], silhouette,
+           result["iterations"], result["seconds"]))
+
+def WriteResults(results, filename):
+    file = open(filename, "w", newline="")
+    writer = csv.DictWriter(file, RESULT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(results)
+    file.close()
+    print("Finished writing to " + filename)
+
+def Main():
+    cc = LoadClusterer()
+    print("Reading " + SWEEP_CSV + "...")
+    crashes = cc.ReadInCachedCrashTable(SWEEP_CSV)
+    print("Sweeping " + str(len(SWEEP_K) * len(SWEEP_VERSIONS) * len(SWEEP_SEEDS)) + " runs over " +
+          str(len(crashes)) + " crashes with " + str(SWEEP_WORKERS) + " workers...")
+    results = RunSweep(crashes)
+    WriteResults(results, SWEEP_RESULTS_FILENAME)
+
+if __name__ == "__main__":
+    Main()
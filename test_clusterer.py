@@ -0,0 +1,573 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for crash-clusterer.py
+
+import datetime
+import json
+import os
+import random
+import pytest
+import distancematrix
+from clusterer_loader import LoadClusterer
+from test_distancematrix import RandomMatrix
+
+cc = LoadClusterer()
+
+# Random crashes, made the same way as random starting prototypes
+def SyntheticCrashes(n, seed="crashes"):
+    return cc.PickStartingPrototypes(n, seed)
+
+# The NumPy engine assigns the same prototypes and gives the same SSE as the
+# Python one, within floating point tolerance
+def test_numpy_sse_matches_python(monkeypatch):
+    pytest.importorskip("numpy")
+    crashes = SyntheticCrashes(600)
+    prototypes = SyntheticCrashes(7, "prototypes")
+    for version in (1, 2, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        monkeypatch.setattr(cc, "ENGINE", "python")
+        cc.AssignNearestPrototypes(crashes, prototypes)
+        assigned = [crash.NearestPrototypeIX for crash in crashes]
+        python_sse = cc.ComputeSSE(crashes, prototypes)
+        monkeypatch.setattr(cc, "ENGINE", "numpy")
+        numpy_sse = cc.ComputeSSE(crashes, prototypes)
+        assert numpy_sse == pytest.approx(python_sse, rel=1e-9)
+        cc.AssignNearestPrototypes(crashes, prototypes)
+        assert [crash.NearestPrototypeIX for crash in crashes] == assigned
+        assert cc.AssignedSSE(crashes) == pytest.approx(python_sse, rel=1e-9)
+
+# Writes crashes as cleaned.csv, the way transformer.py does. Crashes without
+# coordinates get empty ones, and Feb 29 is written as Feb 28.
+def WriteCleaned(filename, crashes):
+    f = open(filename, "w", newline="")
+    f.write("Latitude,Longitude,Date,Time,Injuries,Fatalities,WeatherCondition,SurfaceCondition\n")
+    for (i, crash) in enumerate(crashes):
+        coordinates = "," if i % 50 == 0 else "%.7f,%.7f" % (43 + (i % 97) / 300, -77.8 + (i % 89) / 200)
+        date = datetime.date.fromordinal(cc.DAY_OF_YEAR_BASE + crash.DayOfYear)
+        f.write(coordinates + ",%02d-%d,%d:%02d,%d,0,\"%s\",\"%s\"\n" % (
+            date.month, date.day, crash.Time.hour, crash.Time.minute, crash.Injuries,
+            crash.WeatherCondition, crash.SurfaceCondition))
+    f.close()
+
+# Equal, or both NaN (crashes without coordinates)
+def SameValue(a, b):
+    return a == b or (a != a and b != b)
+
+# Every attribute a Crash has, which a CrashRow has to have too
+CRASH_ATTRIBUTES = ["WeatherCondition", "SurfaceCondition", "Injuries", "Date", "Time", "Latitude", "Longitude",
+                    "NearestPrototypeIX", "NearestDistance", "DayOfYear", "MinuteOfDay"]
+
+# A CrashRow has every attribute of a Crash, with the same values
+def test_crash_row_has_crash_attributes():
+    crash = SyntheticCrashes(1)[0]
+    assert sorted(vars(crash)) == sorted(CRASH_ATTRIBUTES)
+    table = cc.CrashTable()
+    table.Append(crash.WeatherCondition, crash.SurfaceCondition, crash.Injuries, crash.Date, crash.Time)
+    row = table[0]
+    for name in CRASH_ATTRIBUTES:
+        assert SameValue(getattr(row, name), getattr(crash, name)) or name == "NearestDistance"
+
+# Objects, a table read from the csv and a table memory-mapped from the cache
+# (built on the first read, used on the second) hold the same crashes, and
+# give the same assignments and SSE
+def test_storage_parity(monkeypatch, tmp_path):
+    filename = str(tmp_path / "cleaned.csv")
+    WriteCleaned(filename, SyntheticCrashes(500))
+    prototypes = SyntheticCrashes(6, "prototypes")
+    stores = {"objects": cc.ReadInCrashes(filename), "table": cc.ReadInCrashTable(filename)}
+    assert cc.ReadInCachedCrashTable(filename) is not None
+    assert cc.crashcache.OpenCache(cc.crashcache.CacheFilename(filename), filename) is not None
+    stores["cache"] = cc.ReadInCachedCrashTable(filename)
+    for version in (1, 2, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        results = {}
+        for (storage, crashes) in stores.items():
+            cc.AssignNearestPrototypes(crashes, prototypes)
+            results[storage] = ([crash.NearestPrototypeIX for crash in crashes], cc.AssignedSSE(crashes),
+                                cc.ComputeSSE(crashes, prototypes))
+        assert results["table"] == results["objects"]
+        assert results["cache"] == results["objects"]
+    for (crash, row, cached) in zip(stores["objects"], stores["table"], stores["cache"]):
+        for name in CRASH_ATTRIBUTES:
+            assert SameValue(getattr(row, name), getattr(crash, name))
+            assert SameValue(getattr(cached, name), getattr(crash, name))
+
+# What makes up a prototype
+def PrototypeValues(crash):
+    return (crash.WeatherCondition, crash.SurfaceCondition, crash.Injuries, crash.Date, crash.Time)
+
+# Running totals rebuild the prototype ComputeClusterMean computes from the
+# crashes, including after a round trip through JSON
+def test_cluster_statistics_match_mean():
+    crashes = SyntheticCrashes(300)
+    for size in (1, 2, 7, 50, 300):
+        cluster = crashes[:size]
+        stats = cc.StatisticsForClustering([cluster])[0]
+        expected = PrototypeValues(cc.ComputeClusterMean(cluster, None))
+        assert PrototypeValues(stats.Prototype(None)) == expected
+        assert PrototypeValues(cc.ClusterStatistics.FromJSON(stats.ToJSON()).Prototype(None)) == expected
+    assert cc.ClusterStatistics().Prototype(crashes[0]) is crashes[0]
+
+# PartialFit on a fitted clustering assigns the new crashes the same way
+# AssignNearestPrototypes does, and gives the prototypes of the clusters with
+# the new crashes added to them
+def test_partial_fit_matches_assignment(monkeypatch):
+    monkeypatch.setattr(cc, "DISTANCE_VERSION", 1)
+    crashes = SyntheticCrashes(400)
+    (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, SyntheticCrashes(5, "prototypes"), float('inf'))
+    clusters = cc.SeparateClusters(crashes, len(prototypes))
+    statistics = cc.StatisticsForClustering(clusters)
+
+    batch = SyntheticCrashes(120, "batch")
+    (new_prototypes, batch_sse) = cc.PartialFit(batch, prototypes, statistics)
+    assigned = [crash.NearestPrototypeIX for crash in batch]
+
+    expected_batch = cc.AssignNearestPrototypes(SyntheticCrashes(120, "batch"), prototypes)
+    assert assigned == [crash.NearestPrototypeIX for crash in expected_batch]
+    assert batch_sse == cc.ComputeSSE(expected_batch, prototypes)
+    for i in range(len(prototypes)):
+        grown = clusters[i] + [crash for crash in batch if crash.NearestPrototypeIX == i]
+        assert PrototypeValues(new_prototypes[i]) == PrototypeValues(cc.ComputeClusterMean(grown, prototypes[i]))
+
+# The same SEED picks the same prototypes, for every kind of seeding
+def test_seeding_is_deterministic(monkeypatch):
+    crashes = SyntheticCrashes(400)
+    for seeding in ("random", "kmeans++", "kmeans||"):
+        monkeypatch.setattr(cc, "SEEDING", seeding)
+        monkeypatch.setattr(cc, "SEED", "first")
+        first = [PrototypeValues(p) for p in cc.PickInitialPrototypes(crashes, 6)]
+        assert [PrototypeValues(p) for p in cc.PickInitialPrototypes(crashes, 6)] == first
+        monkeypatch.setattr(cc, "SEED", "second")
+        assert [PrototypeValues(p) for p in cc.PickInitialPrototypes(crashes, 6)] != first
+
+# The closest candidates k-means|| keeps track of over its passes are the ones
+# ClosestDistances finds over all the candidates at once, so the candidate
+# weights are the counts of crashes closest to each one
+def test_kmeans_parallel_closest_candidates():
+    crashes = SyntheticCrashes(300)
+    candidates = SyntheticCrashes(20, "candidates")
+    (closest, nearest) = cc.ClosestDistances(crashes, candidates[:1])
+    for (start, end) in [(1, 4), (4, 11), (11, 20)]:
+        (distances, new_nearest) = cc.ClosestDistances(crashes, candidates[start:end])
+        (closest, nearest) = cc.CloserOf(closest, nearest, distances, new_nearest, start)
+    assert (list(closest), list(nearest)) == tuple(list(result) for result in cc.ClosestDistances(crashes, candidates))
+
+# K-Means never ends on prototypes worse than the ones it started from, so
+# good seeds stay good
+def test_kmeans_keeps_better_prototypes(monkeypatch):
+    crashes = SyntheticCrashes(500)
+    for version in (1, 2, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        prototypes = cc.PickKMeansParallelPrototypes(crashes, 5, "keep")
+        cc.AssignNearestPrototypes(crashes, prototypes)
+        start_sse = cc.ComputeSSE(crashes, prototypes)
+        (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, prototypes, float('inf'))
+        assert cc.ComputeSSE(crashes, prototypes) <= start_sse
+
+# N_INIT restarts keep the one with the lowest SSE, whether run here or by
+# forked workers
+def test_restarts_keep_lowest_sse(monkeypatch):
+    crashes = SyntheticCrashes(400)
+    monkeypatch.setattr(cc, "K", 4)
+    monkeypatch.setattr(cc, "SEEDING", "kmeans++")
+    monkeypatch.setattr(cc, "N_INIT", 4)
+    monkeypatch.setattr(cc, "_restart_crashes", crashes)
+    restart_sses = [cc.KMeansRestart(restart)[0] for restart in range(4)]
+    assert len(set(restart_sses)) > 1
+    for workers in (1, 2):
+        monkeypatch.setattr(cc, "N_INIT_WORKERS", workers)
+        (crashes, prototypes) = cc.BestOfRestarts(crashes)
+        assert cc.ComputeSSE(crashes, prototypes) == min(restart_sses)
+
+# Hamerly's bounds give the same assignments and SSE as assigning every crash
+# against every prototype
+def test_hamerly_matches_full_assignment(monkeypatch):
+    for version in (1, 2, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        results = {}
+        for assignment in ("full", "hamerly"):
+            monkeypatch.setattr(cc, "ASSIGNMENT", assignment)
+            crashes = SyntheticCrashes(800)
+            prototypes = cc.PickKMeansPlusPlusPrototypes(crashes, 8, "hamerly")
+            (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, prototypes, float('inf'))
+            results[assignment] = ([crash.NearestPrototypeIX for crash in crashes],
+                                   cc.AssignedSSE(crashes), cc.ComputeSSE(crashes, prototypes))
+        assert results["hamerly"][0] == results["full"][0]
+        assert results["hamerly"][1] == pytest.approx(results["full"][1], rel=1e-12)
+        assert results["hamerly"][1] == pytest.approx(results["hamerly"][2], rel=1e-12)
+
+# Crashes in k tight groups, each with its own conditions, injuries, day
+# and time of day
+def ClusteredCrashes(n, k, seed="clustered"):
+    rand = random.Random(seed)
+    weather = ["CLEAR", "CLOUDY", "RAIN", "SNOW"]
+    surface = ["DRY", "WET", "SNOW/ICE", "SLUSH"]
+    centers = [(weather[i % 4], surface[(i // 4) % 4], 1 + (i % 3), 15 + (i * 350 // k), (i * 613) % 1440)
+               for i in range(k)]
+    crashes = []
+    for i in range(n):
+        (weather_condition, surface_condition, injuries, day, minute) = centers[rand.randrange(k)]
+        date = datetime.date.fromordinal(cc.DAY_OF_YEAR_BASE + (day + rand.randint(-4, 4)) % 365)
+        minute = min(1439, max(0, minute + rand.randint(-30, 30)))
+        crashes.append(cc.Crash(weather_condition, surface_condition, injuries, date,
+                                datetime.time(minute // 60, minute % 60)))
+    return crashes
+
+# On clustered crashes the bounds skip most of the N*K distances an iteration
+# would take, with and without recording the exact distances for the SSE,
+# and still assign every iteration the way AssignNearestPrototypes does
+def test_hamerly_skips_distances(monkeypatch):
+    k = 8
+    for version in (1, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        for record_distances in (True, False):
+            crashes = ClusteredCrashes(2000, k)
+            prototypes = cc.PickKMeansPlusPlusPrototypes(crashes, k, "hamerly")
+            assigner = cc.HamerlyAssigner(crashes, record_distances)
+            iterations = 0
+            while True:
+                iterations += 1
+                previous = [crash.NearestPrototypeIX for crash in crashes]
+                assigner.Assign(prototypes)
+                assigned = [crash.NearestPrototypeIX for crash in crashes]
+                cc.AssignNearestPrototypes(crashes, prototypes)
+                assert assigned == [crash.NearestPrototypeIX for crash in crashes]
+                if record_distances:
+                    assert cc.AssignedSSE(crashes) == pytest.approx(cc.ComputeSSE(crashes, prototypes), rel=1e-12)
+                if assigned == previous or iterations == 20:
+                    break
+                prototypes = cc.FindPrototypesForClustering(cc.SeparateClusters(crashes, k), prototypes)
+            assert iterations > 1
+            assert assigner.DistanceEvaluations < 0.6 * len(crashes) * k * iterations
+
+# Every iteration sends one event, to the callbacks and as one JSON line to
+# ITERATION_LOG, with the SSE, reassignments and cluster sizes of that
+# iteration; only the last one is converged and it has no separate/prototypes
+# timings
+def test_iteration_events(monkeypatch, tmp_path):
+    log = str(tmp_path / "iterations.jsonl")
+    events = []
+    monkeypatch.setattr(cc, "DISTANCE_VERSION", 1)
+    monkeypatch.setattr(cc, "ITERATION_LOG", log)
+    monkeypatch.setattr(cc, "ITERATION_CALLBACKS", [events.append])
+    monkeypatch.setattr(cc, "_current_restart", 2)
+    crashes = SyntheticCrashes(400)
+    (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, SyntheticCrashes(5, "prototypes"), float('inf'))
+
+    logged = [json.loads(line) for line in open(log)]
+    assert len(logged) == len(events) == iterations > 1
+    for (event, line) in zip(events, logged):
+        assert {name: line[name] for name in event} == event
+        assert line["pid"] == os.getpid()
+    assert [event["iteration"] for event in events] == list(range(1, len(events) + 1))
+    assert [event["converged"] for event in events] == [False] * (len(events) - 1) + [True]
+    assert events[0]["reassigned"] == len(crashes)
+    for event in events:
+        assert event["event"] == "iteration" and event["restart"] == 2 and event["sse_bound"] == 0
+        assert sum(event["cluster_sizes"]) == len(crashes)
+        assert len(event["cluster_sizes"]) == len(prototypes)
+        assert event["assign_seconds"] >= 0 and event["sse_seconds"] >= 0
+        assert ("separate_seconds" in event) == ("prototypes_seconds" in event) == (not event["converged"])
+    assert events[-1]["sse"] >= cc.ComputeSSE(crashes, prototypes)
+    assert events[-1]["cluster_sizes"] == [len(cluster) for cluster in cc.SeparateClusters(crashes, len(prototypes))]
+    sses = [event["sse"] for event in events]
+    assert sses[:-1] == sorted(sses[:-1], reverse=True)
+
+# Without a log or callbacks, nothing is timed or counted
+def test_no_iteration_events(monkeypatch):
+    monkeypatch.setattr(cc, "ITERATION_LOG", None)
+    monkeypatch.setattr(cc, "ITERATION_CALLBACKS", [])
+    assert cc.StartIterationEvent(SyntheticCrashes(10), 1) is cc.NO_ITERATION_EVENT
+
+# With GRAPH_OUTPUT set the graph of more than ten clusters is written to the
+# file, for both styles, without a display: the Agg backend and no plt.show
+def test_graph_output(monkeypatch, tmp_path):
+    def Show():
+        raise AssertionError("plt.show needs a display")
+    monkeypatch.setattr(cc.plt, "show", Show)
+    crashes = SyntheticCrashes(600)
+    prototypes = SyntheticCrashes(12, "prototypes")
+    clusters = cc.SeparateClusters(cc.AssignNearestPrototypes(crashes, prototypes), len(prototypes))
+    monkeypatch.setattr(cc, "GRAPH_MAX_POINTS", 20)
+    for style in ("hexbin", "scatter"):
+        output = str(tmp_path / (style + ".png"))
+        monkeypatch.setattr(cc, "GRAPH_STYLE", style)
+        monkeypatch.setattr(cc, "GRAPH_OUTPUT", output)
+        cc.GenerateGraph(clusters)
+        assert cc.plt.get_backend().lower() == "agg"
+        assert open(output, "rb").read(8) == b"\x89PNG\r\n\x1a\n"
+
+# Every cluster gets its own color, however many there are
+def test_cluster_colors_differ():
+    for k in (4, 10, 12, 20, 21, 50):
+        colors = [cc.to_rgba(cc.ClusterColor(i, k)) for i in range(k)]
+        assert len(set(colors)) == k
+
+# IncrementalKMeans clusters everything again when there is no saved state,
+# when the crashes added since the last full clustering fit it worse than
+# INCREMENTAL_SSE_DRIFT allows (even when the whole history still fits), when
+# cleaned.csv changed before where it got, and when the settings changed
+def test_incremental_refits(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cc, "K", 4)
+    monkeypatch.setattr(cc, "DISTANCE_VERSION", 1)
+    monkeypatch.setattr(cc, "SEEDING", "kmeans++")
+    refits = []
+    FullKMeansState = cc.FullKMeansState
+    monkeypatch.setattr(cc, "FullKMeansState", lambda filename: refits.append(filename) or FullKMeansState(filename))
+    def Run(crashes):
+        WriteCleaned("cleaned.csv", crashes)
+        cc.IncrementalKMeans("cleaned.csv")
+        return json.load(open(cc.KMEANS_STATE_FILENAME))
+
+    history = ClusteredCrashes(2000, 4, "history")
+    state = Run(history)
+    assert len(refits) == 1 and state["added_count"] == 0
+    fitted = state["fitted_sse"]
+
+    good = ClusteredCrashes(300, 4, "good")
+    state = Run(history + good)
+    assert len(refits) == 1
+    assert state["added_count"] == 300
+    assert state["offset"] == os.path.getsize("cleaned.csv")
+    assert cc.SSEDrift(state) < cc.INCREMENTAL_SSE_DRIFT
+
+    # Over the whole history these would still be within the drift
+    bad = SyntheticCrashes(30, "bad")
+    cc.AssignNearestPrototypes(bad, [cc.CrashFromJSON(prototype) for prototype in state["prototypes"]])
+    history_sse = (fitted * len(history)) + state["added_sse"] + cc.AssignedSSE(bad)
+    assert (history_sse / (len(history) + 330)) / fitted - 1 < cc.INCREMENTAL_SSE_DRIFT
+    state = Run(history + good + bad)
+    assert len(refits) == 2 and state["added_count"] == 0
+
+    state = Run(history + good + bad)
+    assert len(refits) == 2
+
+    rewritten = history + good + bad
+    rewritten[10] = bad[0]
+    Run(rewritten)
+    assert len(refits) == 3
+
+    monkeypatch.setattr(cc, "K", 5)
+    assert cc.LoadKMeansState("cleaned.csv") is None
+    assert len(Run(rewritten)["prototypes"]) == 5
+    assert len(refits) == 4
+
+# The SSE added up from the distances the assignment recorded is the SSE
+# ComputeSSE computes, bit for bit, for either engine and storage
+def test_assigned_sse_is_exact(monkeypatch, tmp_path):
+    filename = str(tmp_path / "cleaned.csv")
+    WriteCleaned(filename, SyntheticCrashes(700))
+    prototypes = SyntheticCrashes(6, "prototypes")
+    engines = ["python"]
+    try:
+        import numpy
+        engines.append("numpy")
+    except ImportError:
+        pass
+    for engine in engines:
+        monkeypatch.setattr(cc, "ENGINE", engine)
+        for crashes in (cc.ReadInCrashes(filename), cc.ReadInCrashTable(filename)):
+            for version in (1, 2, 3):
+                monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+                cc.AssignNearestPrototypes(crashes, prototypes)
+                assert cc.AssignedSSE(crashes) == cc.ComputeSSE(crashes, prototypes)
+
+# With a sampled SSE, K-Means stops once it is confident the SSE stopped
+# going down, and ends on a full assignment to the prototypes it returns
+def test_sampled_sse_stops(monkeypatch):
+    def Guard(event):
+        assert event["iteration"] < 100
+    monkeypatch.setattr(cc, "SSE_MODE", "sampled")
+    monkeypatch.setattr(cc, "SSE_SAMPLE_SIZE", 200)
+    monkeypatch.setattr(cc, "ITERATION_CALLBACKS", [Guard])
+    for version in (1, 2, 3):
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", version)
+        crashes = SyntheticCrashes(1500)
+        (crashes, prototypes, iterations) = cc.CrashKMeans(crashes, SyntheticCrashes(5, "prototypes"), float('inf'))
+        assert 1 < iterations < 100
+        assigned = [crash.NearestPrototypeIX for crash in crashes]
+        cc.AssignNearestPrototypes(crashes, prototypes)
+        assert assigned == [crash.NearestPrototypeIX for crash in crashes]
+    # A sample of every crash has no uncertainty left
+    assert cc.EstimateTotal([1.0, 2.0, 3.0], 3) == (6.0, 0)
+
+# DBSCAN by comparing every pair of crashes: core crashes, their hotspots (as
+# sets of crashes), and for every other crash the hotspots of its nearest core
+# crashes within the radius
+def BruteForceDBSCAN(xs, ys, radius, min_crashes):
+    n = len(xs)
+    def Within(i, j):
+        (dx, dy) = (xs[j] - xs[i], ys[j] - ys[i])
+        return dx * dx + dy * dy <= radius * radius
+    core = [i for i in range(n) if sum([1 for j in range(n) if Within(i, j)]) >= min_crashes]
+    hotspot_of = {}
+    hotspots = []
+    for start in core:
+        if start in hotspot_of:
+            continue
+        hotspot_of[start] = len(hotspots)
+        members = [start]
+        for i in members:
+            for j in core:
+                if j not in hotspot_of and Within(i, j):
+                    hotspot_of[j] = len(hotspots)
+                    members.append(j)
+        hotspots.append(frozenset(members))
+    joins = {}
+    for i in range(n):
+        near = [((xs[j] - xs[i]) ** 2 + (ys[j] - ys[i]) ** 2, j) for j in core if i not in hotspot_of and Within(i, j)]
+        if near:
+            closest = min([distance for (distance, j) in near])
+            joins[i] = set([hotspot_of[j] for (distance, j) in near if distance == closest])
+    return (set(core), hotspots, hotspot_of, joins)
+
+# Crashes on whole meters, so many pairs are exactly the radius apart, with
+# some on grid cell boundaries, some sharing a spot, and some without
+# coordinates
+def DBSCANPoints(radius, seed):
+    rng = random.Random(seed)
+    cell_size = cc.GridIndex([], [], radius).CellSize
+    xs = []
+    ys = []
+    for center in range(6):
+        (cx, cy) = (rng.randint(-40, 40), rng.randint(-40, 40))
+        for i in range(rng.randint(3, 25)):
+            xs.append(float(cx + rng.randint(-6, 6)))
+            ys.append(float(cy + rng.randint(-6, 6)))
+    for i in range(30):
+        xs.append(rng.randint(-8, 8) * cell_size)
+        ys.append(rng.choice([rng.randint(-8, 8) * cell_size, float(rng.randint(-40, 40))]))
+    for (x, y) in [(0.0, 0.0), (radius, 0.0), (0.0, -radius), (radius, radius), (2 * radius, 0.0), (0.0, 0.0)]:
+        xs.append(x + 60)
+        ys.append(y + 60)
+    xs.extend([float("nan"), 3.0])
+    ys.extend([0.0, float("nan")])
+    order = list(range(len(xs)))
+    rng.shuffle(order)
+    return ([xs[i] for i in order], [ys[i] for i in order])
+
+# DBSCAN finds the same core crashes, hotspots and border crashes as
+# comparing every pair, and numbers the hotspots biggest first
+def test_dbscan_matches_brute_force():
+    for radius in (5.0, 3.0):
+        for min_crashes in (2, 3, 5, 8):
+            for seed in range(4):
+                (xs, ys) = DBSCANPoints(radius, seed)
+                labels = cc.DBSCAN(xs, ys, radius, min_crashes)
+                (core, hotspots, hotspot_of, joins) = BruteForceDBSCAN(xs, ys, radius, min_crashes)
+
+                # Core crashes: each hotspot has one label, and no two share one
+                assert sorted(set([frozenset([i for i in core if labels[i] == label]) for label in set(labels)]) -
+                              set([frozenset()]), key=sorted) == sorted(hotspots, key=sorted)
+                assert all([labels[i] != cc.NOISE for i in core])
+                label_of = dict([(hotspot_of[min(hotspot)], labels[min(hotspot)]) for hotspot in hotspots])
+
+                # Everything else: noise, or a hotspot of a nearest core crash
+                for i in range(len(xs)):
+                    if i in core:
+                        continue
+                    if i in joins:
+                        assert labels[i] in [label_of[hotspot] for hotspot in joins[i]]
+                    else:
+                        assert labels[i] == cc.NOISE
+
+                sizes = [list(labels).count(label) for label in range(len(hotspots))]
+                assert sorted(set(labels) - set([cc.NOISE])) == list(range(len(hotspots)))
+                assert sizes == sorted(sizes, reverse=True)
+
+# PAM the slow way: BUILD adds the crash giving the lowest total, SWAP makes
+# the swap giving the lowest total until none lowers it, every total worked
+# out from scratch
+def BruteForcePAM(full, k):
+    n = len(full)
+    def Total(medoids):
+        return sum([min([full[medoid][o] for medoid in medoids]) for o in range(n)])
+    medoids = []
+    for medoid_ix in range(min(k, n)):
+        medoids.append(min([candidate for candidate in range(n) if candidate not in medoids],
+                           key=lambda candidate: Total(medoids + [candidate])))
+    while 1 < len(medoids) < n:
+        total = Total(medoids)
+        swaps = [(Total(medoids[:ix] + [candidate] + medoids[ix + 1:]), ix, candidate)
+                 for candidate in range(n) if candidate not in medoids for ix in range(len(medoids))]
+        (best_total, ix, candidate) = min(swaps)
+        if best_total >= total - (1e-9 * total):
+            break
+        medoids[ix] = candidate
+    return medoids, Total(medoids)
+
+# KMedoidsPAM picks the same medoids, in the same order, as BruteForcePAM
+def test_pam_matches_brute_force():
+    for n in (1, 2, 9, 25):
+        for k in (1, 2, 3, 5):
+            (matrix, full) = RandomMatrix(n, "pam" + str(n))
+            (medoids, total) = cc.KMedoidsPAM(matrix, k)
+            (expected, expected_total) = BruteForcePAM(full, k)
+            assert medoids == expected
+            assert total == pytest.approx(expected_total, rel=1e-9)
+
+# Agglomerative clustering the slow way: merge the closest two clusters, the
+# linkage worked out from every pair of their crashes, until one is left.
+# Returns every merge as (distance, crashes of the merged cluster).
+def BruteForceMerges(full, linkage):
+    clusters = [[ix] for ix in range(len(full))]
+    merges = []
+    while len(clusters) > 1:
+        closest = None
+        for a in range(len(clusters)):
+            for b in range(a + 1, len(clusters)):
+                pairs = [full[i][j] for i in clusters[a] for j in clusters[b]]
+                distance = {"single": min, "complete": max, "average": lambda pairs: sum(pairs) / len(pairs)}[linkage](pairs)
+                if closest is None or distance < closest[0]:
+                    closest = (distance, a, b)
+        (distance, a, b) = closest
+        merges.append((distance, frozenset(clusters[a] + clusters[b])))
+        clusters[a] = clusters[a] + clusters[b]
+        del clusters[b]
+    return merges
+
+# The nearest-neighbor chain makes the same merges, at the same distances, as
+# always merging the closest two clusters, and cuts into the same clusters
+def test_agglomerative_matches_brute_force():
+    for n in (1, 2, 30):
+        (matrix, full) = RandomMatrix(n, "agglomerative" + str(n))
+        for linkage in ("single", "complete", "average"):
+            merges = cc.AgglomerativeMerges(matrix, linkage)
+            members = dict([(ix, [ix]) for ix in range(n)])
+            made = []
+            for (distance, a, b) in merges:
+                members[min(a, b)] = members[min(a, b)] + members.pop(max(a, b))
+                made.append((distance, frozenset(members[min(a, b)])))
+            expected = BruteForceMerges(full, linkage)
+            assert sorted([crashes for (distance, crashes) in made], key=sorted) == \
+                sorted([crashes for (distance, crashes) in expected], key=sorted)
+            distances = dict([(crashes, distance) for (distance, crashes) in expected])
+            for (distance, crashes) in made:
+                assert distance == pytest.approx(distances[crashes], rel=1e-9)
+            for k in (1, 3, n):
+                labels = cc.CutMerges(merges, n, k)
+                clusters = [[ix] for ix in range(n)]
+                for (distance, crashes) in expected[:n - k]:
+                    clusters = [cluster for cluster in clusters if not crashes.issuperset(cluster)] + [sorted(crashes)]
+                assert sorted([[ix for ix in range(n) if labels[ix] == label] for label in set(labels)]) == sorted(clusters)
+
+# A matrix the workers write into a file is reopened from it, matches the one
+# worked out in this process, and clusters the same
+def test_matrix_file_from_workers(monkeypatch, tmp_path):
+    sample = SyntheticCrashes(60)
+    monkeypatch.setattr(cc, "_distance_matrices", {})
+    in_memory = cc.PairwiseDistances(sample)
+    monkeypatch.setattr(cc, "_distance_matrices", {})
+    monkeypatch.setattr(cc, "DISTANCE_MATRIX_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(cc, "DISTANCE_MATRIX_WORKERS", 2)
+    cc.PairwiseDistances(sample)
+    assert os.listdir(str(tmp_path)) == [os.path.basename(distancematrix.MatrixFilename(str(tmp_path), cc.MatrixKey(sample)))]
+
+    monkeypatch.setattr(cc, "_distance_matrices", {})
+    monkeypatch.setattr(cc, "DISTANCE_MATRIX_WORKERS", 1)
+    monkeypatch.setattr(cc, "DistanceMatrixBlock", None)
+    reopened = cc.PairwiseDistances(sample)
+    assert isinstance(reopened.Values, memoryview)
+    assert [list(reopened.Row(i)) for i in range(len(sample))] == [list(in_memory.Row(i)) for i in range(len(sample))]
+    assert cc.KMedoidsPAM(reopened, 4) == cc.KMedoidsPAM(in_memory, 4)
+    assert cc.AgglomerativeMerges(reopened, "average") == cc.AgglomerativeMerges(in_memory, "average")
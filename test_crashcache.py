@@ -0,0 +1,115 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for crashcache.py
+
+import csv
+import math
+import os
+import crashcache
+
+WEATHER = ["CLEAR", "CLOUDY", "SNOW, BLOWING", "RAIN"]
+SURFACE = ["DRY", "WET", "SNOW/ICE"]
+
+# Rows of cleaned.csv as the csv module reads them, every seventh without
+# coordinates
+def Rows(n, offset=0):
+    rows = []
+    for i in range(offset, offset + n):
+        coordinates = ["", ""] if i % 7 == 0 else ["%.7f" % (43 + i / 10000), "%.7f" % (-77.5 - i / 10000)]
+        rows.append(coordinates + ["%02d-%d" % ((i % 12) + 1, (i % 28) + 1), "%d:%02d" % (i % 24, i % 60),
+                                   str(i % 5), "0", WEATHER[i % 4], SURFACE[i % 3]])
+    return rows
+
+def WriteSource(filename, rows):
+    f = open(filename, "w", newline="")
+    f.write("Latitude,Longitude,Date,Time,Injuries,Fatalities,WeatherCondition,SurfaceCondition\n")
+    csv.writer(f, lineterminator="\n").writerows(rows)
+    f.close()
+
+def CheckColumns(cached, rows):
+    (categories, columns) = cached
+    assert len(columns["Injuries"]) == len(rows)
+    for (i, row) in enumerate(rows):
+        (day, minutes, injuries, weather, surface, lat, lon) = crashcache.ParseCleanedRow(row)
+        assert columns["DayOfYear"][i] == day
+        assert columns["MinuteOfDay"][i] == minutes
+        assert columns["Injuries"][i] == injuries
+        assert categories[columns["Weather"][i]] == weather
+        assert categories[columns["Surface"][i]] == surface
+        if row[0] == "":
+            assert math.isnan(columns["Latitude"][i]) and math.isnan(columns["Longitude"][i])
+        else:
+            assert (columns["Latitude"][i], columns["Longitude"][i]) == (lat, lon)
+
+# A builder that spills to disk, with rows added one at a time and from a
+# worker's builder, writes the same cache as one that keeps everything in
+# memory, and the cache reads back the rows it was given
+def test_roundtrip_spilled(monkeypatch, tmp_path):
+    monkeypatch.setattr(crashcache, "SPILL_ROWS", 100)
+    source = str(tmp_path / "cleaned.csv")
+    rows = Rows(450)
+    WriteSource(source, rows)
+
+    spilled = crashcache.CacheBuilder(spill=True)
+    for row in rows[:250]:
+        spilled.Add(row)
+    worker = crashcache.CacheBuilder()
+    for row in rows[250:]:
+        worker.Add(row)
+    spilled.AddBuilder(worker)
+    spilled.Write(str(tmp_path / "spilled.bin"), source)
+
+    in_memory = crashcache.CacheBuilder()
+    for row in rows:
+        in_memory.Add(row)
+    in_memory.Write(str(tmp_path / "memory.bin"), source)
+
+    assert open(str(tmp_path / "spilled.bin"), "rb").read() == open(str(tmp_path / "memory.bin"), "rb").read()
+    CheckColumns(crashcache.OpenCache(str(tmp_path / "spilled.bin"), source), rows)
+
+def test_roundtrip_empty(tmp_path):
+    source = str(tmp_path / "cleaned.csv")
+    WriteSource(source, [])
+    crashcache.CacheBuilder().Write(str(tmp_path / "cleaned.bin"), source)
+    CheckColumns(crashcache.OpenCache(str(tmp_path / "cleaned.bin"), source), [])
+
+# The cache is used while its source has the same size and mtime, or the
+# same size and contents, and not after the format changes
+def test_staleness(monkeypatch, tmp_path):
+    source = str(tmp_path / "cleaned.csv")
+    cache = str(tmp_path / "cleaned.bin")
+    rows = Rows(50)
+    WriteSource(source, rows)
+    builder = crashcache.CacheBuilder()
+    for row in rows:
+        builder.Add(row)
+    builder.Write(cache, source)
+    written = os.stat(source)
+    assert crashcache.OpenCache(cache, source) is not None
+
+    # Touched but not changed: the sha1 still matches
+    os.utime(source, ns=(written.st_atime_ns, written.st_mtime_ns + 10 ** 9))
+    CheckColumns(crashcache.OpenCache(cache, source), rows)
+
+    # Changed in place, same size: the sha1 doesn't match
+    data = open(source, "rb").read()
+    open(source, "wb").write(data.replace(b"CLEAR", b"CLEAN"))
+    assert os.path.getsize(source) == written.st_size
+    assert crashcache.OpenCache(cache, source) is None
+
+    # Same size and mtime are trusted without hashing
+    os.utime(source, ns=(written.st_atime_ns, written.st_mtime_ns))
+    assert crashcache.OpenCache(cache, source) is not None
+
+    # Appended to: the size doesn't match
+    open(source, "wb").write(data + b",,01-1,0:00,1,0,CLEAR,DRY\n")
+    assert crashcache.OpenCache(cache, source) is None
+
+    open(source, "wb").write(data)
+    assert crashcache.OpenCache(cache, source) is not None
+    monkeypatch.setattr(crashcache, "FORMAT_VERSION", crashcache.FORMAT_VERSION + 1)
+    assert crashcache.OpenCache(cache, source) is None
+    monkeypatch.undo()
+
+    assert crashcache.OpenCache(str(tmp_path / "missing.bin"), source) is None
+    open(cache, "wb").write(b"NOTACACHE" + b"\0" * 64)
+    assert crashcache.OpenCache(cache, source) is None
@@ -0,0 +1,49 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for distancematrix.py
+
+import random
+from array import array
+import distancematrix
+
+# A matrix of n crashes with random distances, and the same distances as a
+# full list of lists
+def RandomMatrix(n, seed="matrix"):
+    rand = random.Random(seed)
+    values = array('f', [rand.random() for i in range(distancematrix.PairCount(n))])
+    full = [[0.0] * n for i in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            full[i][j] = full[j][i] = values[distancematrix.PairOffset(n, i, j)]
+    return distancematrix.DistanceMatrix(n, values), full
+
+# Rows read back every pair, either way around, and 0 for the diagonal
+def test_rows():
+    for n in (0, 1, 2, 7):
+        (matrix, full) = RandomMatrix(n)
+        for i in range(n):
+            assert list(matrix.Row(i)) == full[i]
+            for j in range(n):
+                if i != j:
+                    assert matrix.Values[matrix.Offset(i, j)] == full[i][j]
+
+# Blocks written in any order into the file make the same matrix as the one
+# in memory. The file is only opened once it is finished, and only for its
+# key.
+def test_file_roundtrip(tmp_path):
+    for n in (0, 1, 2, 40):
+        (matrix, full) = RandomMatrix(n)
+        filename = distancematrix.MatrixFilename(str(tmp_path), "key" + str(n))
+        temp_filename = distancematrix.CreateMatrixFile(filename, "key" + str(n), n)
+        blocks = distancematrix.BlockRanges(n, 5)
+        assert [row for (start, end) in blocks for row in range(start, end)] == list(range(n))
+        for (start, end) in reversed(blocks):
+            values = matrix.Values[distancematrix.PairOffset(n, start, start + 1):
+                                   distancematrix.PairOffset(n, end - 1, end - 1) + (n - end + 1)]
+            distancematrix.WriteRows(temp_filename, n, start, values)
+        assert distancematrix.OpenMatrixFile(filename, "key" + str(n)) is None
+        distancematrix.FinishMatrixFile(temp_filename, filename)
+
+        opened = distancematrix.OpenMatrixFile(filename, "key" + str(n))
+        assert len(opened) == n
+        assert [list(opened.Row(i)) for i in range(n)] == full
+        assert distancematrix.OpenMatrixFile(filename, "other key") is None
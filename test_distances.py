@@ -0,0 +1,113 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for the date and time distances of crash-clusterer.py
+
+import datetime
+import pytest
+from clusterer_loader import LoadClusterer
+
+cc = LoadClusterer()
+
+def Lookup(d1, d2):
+    return cc.DAY_DIFFERENCE_TABLE[(cc.DayOfYear(d1) * 366) + cc.DayOfYear(d2)]
+
+def Date(year, month, day):
+    return datetime.date(year, month, day)
+
+###############################################################################
+# DATE DIFFERENCES
+# DateDifference (the reference) and the day of the year lookup agree when
+# the first date is later in the year, by at most half a year
+###############################################################################
+def test_date_difference_agrees():
+    for (d1, d2, days) in [(Date(2010, 3, 10), Date(2010, 1, 1), 68),
+                           (Date(2010, 7, 2), Date(2010, 1, 1), 182),
+                           (Date(2010, 3, 1), Date(2010, 2, 28), 1),
+                           (Date(2010, 12, 31), Date(2010, 1, 1), 1),
+                           (Date(2013, 6, 1), Date(2011, 6, 1), 0)]:
+        assert cc.DateDifference(d1, d2) == days
+        assert Lookup(d1, d2) == days
+
+# The reference is signed, the lookup isn't
+def test_date_difference_sign():
+    assert cc.DateDifference(Date(2010, 1, 1), Date(2010, 3, 10)) == -68
+    assert Lookup(Date(2010, 1, 1), Date(2010, 3, 10)) == 68
+    assert cc.DateDifference(Date(2010, 2, 28), Date(2010, 3, 1)) == -1
+    assert Lookup(Date(2010, 2, 28), Date(2010, 3, 1)) == 1
+
+# Across the new year the lookup goes the short way around. The reference
+# only wraps one way, and wraps with the dates' real years.
+def test_date_difference_year_wrap():
+    assert cc.DateDifference(Date(2010, 1, 1), Date(2010, 12, 31)) == -364
+    assert Lookup(Date(2010, 1, 1), Date(2010, 12, 31)) == 1
+    assert cc.DateDifference(Date(2012, 12, 31), Date(2010, 1, 1)) == -730
+    assert Lookup(Date(2012, 12, 31), Date(2010, 1, 1)) == 1
+    assert Lookup(Date(2010, 1, 1), Date(2010, 7, 3)) == 182
+
+# A leap day counts as Feb 28, same as the transformer does; the reference
+# can't take one at all
+def test_date_difference_leap_day():
+    assert Lookup(Date(2012, 2, 29), Date(2010, 2, 28)) == 0
+    assert Lookup(Date(2012, 2, 29), Date(2010, 3, 1)) == 1
+    with pytest.raises(ValueError):
+        cc.DateDifference(Date(2012, 2, 29), Date(2010, 3, 1))
+
+# Over every pair of days of a year, the two either agree, differ only in
+# sign, or differ because the reference wraps the wrong way
+def test_date_difference_every_pair():
+    agree = 0
+    negative = 0
+    wrapped = 0
+    for day1 in range(365):
+        d1 = datetime.date.fromordinal(cc.DAY_OF_YEAR_BASE + day1)
+        for day2 in range(365):
+            d2 = datetime.date.fromordinal(cc.DAY_OF_YEAR_BASE + day2)
+            reference = cc.DateDifference(d1, d2)
+            lookup = cc.DAY_DIFFERENCE_TABLE[(day1 * 366) + day2]
+            if reference == lookup:
+                agree += 1
+            elif reference == -lookup:
+                negative += 1
+            else:
+                wrapped += 1
+                assert lookup == 365 + reference
+    assert (agree, negative, wrapped) == (66795, 49777, 16653)
+
+# Versions 1 and 2 give the same distance either way when the dates agree,
+# and the circular one is smaller (closer) when they don't
+def test_crash_distance_date_modes(monkeypatch):
+    later = cc.Crash("CLEAR", "DRY", 1, Date(2010, 3, 10), datetime.time(9, 0))
+    earlier = cc.Crash("CLEAR", "WET", 2, Date(2010, 1, 1), datetime.time(17, 30))
+    for version in (1, 2):
+        monkeypatch.setattr(cc, "DATE_DIFFERENCE", "reference")
+        reference = (cc.CrashDistance(version, later, earlier), cc.CrashDistance(version, earlier, later))
+        monkeypatch.setattr(cc, "DATE_DIFFERENCE", "circular")
+        circular = (cc.CrashDistance(version, later, earlier), cc.CrashDistance(version, earlier, later))
+        assert circular[0] == pytest.approx(reference[0])
+        assert circular[1] == pytest.approx(circular[0])
+        assert circular[1] > reference[1]
+
+# The minutes of the day apart are the same as TimeDifference for every pair
+# of times (times don't wrap around midnight in either)
+def test_time_difference():
+    times = [datetime.time(hour, minute) for hour in range(24) for minute in (0, 1, 29, 59)]
+    for t1 in times:
+        for t2 in times:
+            c1 = cc.Crash("CLEAR", "DRY", 0, Date(2010, 1, 1), t1)
+            c2 = cc.Crash("CLEAR", "DRY", 0, Date(2010, 1, 1), t2)
+            assert abs(c1.MinuteOfDay - c2.MinuteOfDay) == cc.TimeDifference(t1, t2)
+
+# The NumPy engine gives the distances the scalar one does, in both date
+# modes, for dates of different years on either side of the new year
+def test_numpy_date_modes_match_scalar(monkeypatch):
+    pytest.importorskip("numpy")
+    days = [0, 1, 45, 58, 59, 181, 182, 183, 200, 300, 363, 364]
+    crashes = [cc.Crash("CLEAR", "DRY", i % 4, datetime.date.fromordinal(Date(year, 1, 1).toordinal() + day),
+                        datetime.time(i % 24, (i * 7) % 60))
+               for (i, (year, day)) in enumerate((year, day) for year in (2010, 2011, 2013) for day in days)]
+    for mode in ("reference", "circular"):
+        monkeypatch.setattr(cc, "DATE_DIFFERENCE", mode)
+        for version in (1, 2):
+            matrix = cc.CrashDistanceMatrix(version, crashes, crashes)
+            for (i, c1) in enumerate(crashes):
+                for (j, c2) in enumerate(crashes):
+                    assert matrix[i, j] == pytest.approx(cc.CrashDistance(version, c1, c2), abs=1e-12)
@@ -0,0 +1,57 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for scoring.py
+
+import datetime
+import json
+import pytest
+import scoring
+
+def Prototypes(cc):
+    return [cc.Crash("\"CLEAR\"", "\"DRY\"", 0, datetime.date(2010, 1, 5), datetime.time(9, 14)),
+            cc.Crash("\"SNOW\"", "\"SNOW/ICE\"", 2, datetime.date(2010, 7, 1), datetime.time(18, 0))]
+
+# Scoring a batch with conditions no prototype has doesn't add category codes
+# to the clusterer, and gives the same answers as scoring one crash at a time
+def test_batch_unknown_conditions():
+    pytest.importorskip("numpy")
+    cc = scoring.LoadClusterer()
+    for version in (1, 2, 3):
+        scorer = scoring.CrashScorer(Prototypes(cc), version)
+        known = len(cc.CATEGORY_VALUES)
+        crashes = [{"date": "01-05", "time": "9:14", "injuries": i % 3,
+                    "weather": "MADE UP " + str(i) if i % 2 else "CLEAR", "surface": "DRY" if i % 3 else "OTHER " + str(i)}
+                   for i in range(2 * scoring.VECTORIZE_MIN_BATCH)]
+        batch = scorer.ScoreBatch(crashes)
+        assert len(cc.CATEGORY_VALUES) == known
+        for (crash, (ix, distance)) in zip(crashes, batch):
+            (single_ix, single_distance) = scorer.Score(crash)
+            assert ix == single_ix
+            assert abs(distance - single_distance) < 1e-9
+
+# A scorer loaded from a saved state scores with that state's distance
+# version and date mode, whatever the clusterer is set to, and leaves the
+# clusterer's settings alone
+def test_load_scorer_keeps_clusterer_settings(monkeypatch, tmp_path):
+    pytest.importorskip("numpy")
+    cc = scoring.LoadClusterer()
+    monkeypatch.setattr(cc, "DISTANCE_VERSION", 3)
+    monkeypatch.setattr(cc, "DATE_DIFFERENCE", "circular")
+    filename = str(tmp_path / "scoring_state.json")
+    json.dump({"settings": {"CLUSTERING": "kmeans", "K": 2, "DISTANCE_VERSION": 1, "DATE_DIFFERENCE": "reference"},
+               "prototypes": [cc.CrashToJSON(prototype) for prototype in Prototypes(cc)]}, open(filename, "w"))
+    scorer = scoring.LoadScorer(filename)
+    assert (cc.DISTANCE_VERSION, cc.DATE_DIFFERENCE) == (3, "circular")
+
+    # Dates where the two modes disagree
+    crashes = [{"date": "%02d-%02d" % (1 + (i % 12), 1 + (i % 28)), "time": "%d:%02d" % (i % 24, i % 60),
+                "injuries": i % 3, "weather": "CLEAR", "surface": "WET"} for i in range(2 * scoring.VECTORIZE_MIN_BATCH)]
+    batch = scorer.ScoreBatch(crashes)
+    assert (cc.DISTANCE_VERSION, cc.DATE_DIFFERENCE) == (3, "circular")
+    prototypes = Prototypes(cc)
+    for (crash, (ix, distance)) in zip(crashes, batch):
+        crash = scorer.Crash(crash)
+        expected = [cc.CrashDistance(1, crash, prototype, "reference") for prototype in prototypes]
+        assert scorer.Nearest(crash) == (expected.index(min(expected)), min(expected))
+        assert (ix, distance) == (expected.index(min(expected)), pytest.approx(min(expected), abs=1e-9))
+    circular = [scoring.CrashScorer(prototypes, 1, "circular").Score(crash)[1] for crash in crashes]
+    assert circular != [distance for (ix, distance) in batch]
@@ -0,0 +1,32 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for sweep.py
+
+import pytest
+import sweep
+from clusterer_loader import LoadClusterer
+from test_clusterer import SyntheticCrashes, WriteCleaned
+
+cc = LoadClusterer()
+
+# Workers started either way, on the crashes they share, get the SSE and
+# iteration count RunKMeans gets on the same crashes here
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_sweep_matches_direct_run(monkeypatch, tmp_path, start_method):
+    filename = str(tmp_path / "cleaned.csv")
+    WriteCleaned(filename, SyntheticCrashes(300))
+    crashes = cc.ReadInCachedCrashTable(filename)
+    monkeypatch.setattr(sweep, "SWEEP_K", [3])
+    monkeypatch.setattr(sweep, "SWEEP_VERSIONS", [1, 3])
+    monkeypatch.setattr(sweep, "SWEEP_SEEDS", ["sweep"])
+    monkeypatch.setattr(sweep, "SWEEP_WORKERS", 2)
+    monkeypatch.setattr(sweep, "SWEEP_START_METHOD", start_method)
+    results = sweep.RunSweep(crashes)
+
+    assert [(result["k"], result["distance_version"]) for result in results] == [(3, 1), (3, 3)]
+    for result in results:
+        monkeypatch.setattr(cc, "DISTANCE_VERSION", result["distance_version"])
+        monkeypatch.setattr(cc, "K", 3)
+        prototypes = cc.PickInitialPrototypes(crashes, 3, "sweep")
+        (clustering, prototypes, iterations) = cc.RunKMeans(crashes, prototypes, "sweep")
+        assert result["iterations"] == iterations
+        assert result["sse"] == cc.ComputeSSE(clustering, prototypes)
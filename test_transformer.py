@@ -0,0 +1,190 @@
+# Authors: Ryan Lisnoff & Derek Brown
+# Purpose: Tests for transformer.py
+
+import csv
+import hashlib
+import json
+import os
+import benchmark
+import crashcache
+import transformer
+from clusterer_loader import LoadClusterer
+
+# A column stays exact up to the cap, then only the values it already counted
+# keep being counted and the rest go towards the unique value estimate
+def test_value_counter_overflow():
+    counter = transformer.ValueCounter([0], cap=3)
+    for value in ["a", "b", "a", "c"]:
+        counter.Add([value])
+    assert not counter.Overflowed(0)
+    assert counter.Cardinality(0) == 3
+
+    for i in range(1000):
+        counter.Add(["new" + str(i)])
+    counter.Add(["a"])
+    assert counter.Overflowed(0)
+    assert counter.Counts[0] == {"a": 3, "b": 1, "c": 1}
+    assert counter[0] == {"a", "b", "c"}
+    # HyperLogLog with 4096 registers is within a few percent
+    assert abs(counter.Cardinality(0) - 1003) < 50
+
+# Merging the counters of two chunks gives the same counts as one counter
+# over both, including a column that overflowed in one of them
+def test_value_counter_merge():
+    first = transformer.ValueCounter([0, 1], cap=5)
+    second = transformer.ValueCounter([0, 1], cap=5)
+    whole = transformer.ValueCounter([0, 1], cap=5)
+    for i in range(20):
+        point = [str(i % 3), str(i)]
+        (first if i < 10 else second).Add(point)
+        whole.Add(point)
+    first.Merge(second)
+    assert first.Counts[0] == whole.Counts[0]
+    assert first.Overflowed(1) and whole.Overflowed(1)
+    assert abs(first.Cardinality(1) - 20) <= 1
+
+# The projection keeps only the kept columns, converts dates and times,
+# quotes nominal values and removes rows missing a required column
+def test_projection():
+    point = [""] * 21
+    point[2] = "MONROE"
+    (point[7], point[8], point[9], point[10]) = ("43.1", "-77.5", "1/5/10", "9:14 PM")
+    (point[12], point[13], point[19], point[20]) = ("1", "0", "CLOUDY", " SNOW \"ICE\" ")
+    assert transformer.FormatPoint(point) == '43.1,-77.5,01-5,21:14,1,0,"CLOUDY","SNOW ""ICE"""\n'
+    point[2] = " "
+    assert transformer.FormatPoint(point) is None
+    assert transformer.FormatPoint(point[:20]) is None
+
+# Nominal values are written sorted and quoted, whatever order the set has
+def test_arff_nominal_values_sorted():
+    assert transformer.SetToARFFString({"SNOW", "CLEAR", "A \"B\", C"}) == '{"A ""B"", C","CLEAR","SNOW"}'
+
+# Cleaning the export in parallel chunks writes the same cleaned.csv, ARFF
+# and cache columns, byte for byte, and counts the same values as the serial
+# pipeline
+def RunTransform(monkeypatch, workers):
+    monkeypatch.setattr(transformer, "WORKERS", workers)
+    monkeypatch.setattr(transformer, "CHUNK_SIZE", 50000)
+    (headers, uniques) = transformer.StreamTransform()
+    (categories, columns) = crashcache.OpenCache("cleaned.bin", "cleaned.csv")
+    columns = {name: [categories[code] for code in column] if name in ("Weather", "Surface") else column.tobytes()
+               for (name, column) in columns.items()}
+    return open("cleaned.csv", "rb").read(), open("crashes.arff", "rb").read(), columns, uniques.Counts
+
+def test_parallel_transform_is_byte_identical(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    benchmark.WriteSyntheticExport("raw.csv", 5000, "parallel")
+    monkeypatch.setattr(transformer, "RAW_FILENAME", "raw.csv")
+    assert len(transformer.SplitByteRanges("raw.csv", 50000)) > 3
+    serial = RunTransform(monkeypatch, 1)
+    parallel = RunTransform(monkeypatch, 3)
+    assert parallel[0] == serial[0]
+    assert parallel[1] == serial[1]
+    assert parallel[2] == serial[2]
+    assert parallel[3] == serial[3]
+
+# Byte ranges start after the header line however long it is, and end after
+# whole line breaks, \r\n included
+def test_split_byte_ranges(tmp_path):
+    filename = str(tmp_path / "raw.csv")
+    lines = [b"x" * 100000] + [b"%d,a,b" % i for i in range(2000)]
+    open(filename, "wb").write(b"\r\n".join(lines) + b"\r\n")
+    ranges = transformer.SplitByteRanges(filename, 1000)
+    assert ranges[0][0] == len(lines[0]) + 2
+    assert ranges[-1][1] == os.path.getsize(filename)
+    data = open(filename, "rb").read()
+    for (start, end) in ranges:
+        assert data[start - 2:start] == b"\r\n" and data[end - 2:end] == b"\r\n"
+    assert b"".join(data[start:end] for (start, end) in ranges) == b"\r\n".join(lines[1:]) + b"\r\n"
+    open(filename, "wb").write(b"x" * 100000)
+    assert transformer.SplitByteRanges(filename, 1000) == []
+
+# Runs the transformer the way Main does, into the current directory
+def RunMain(monkeypatch, incremental):
+    monkeypatch.setattr(transformer, "INCREMENTAL", incremental)
+    transformer.Main()
+    return open("cleaned.csv", "rb").read()
+
+# An export and the same export with rows added to the end
+def WriteExports(filename, rows, added_rows):
+    benchmark.WriteSyntheticExport(filename, rows + added_rows, "incremental")
+    whole = open(filename, "rb").read()
+    end = 0
+    for i in range(rows + 1):
+        end = whole.index(b"\r", end) + 1
+    open(filename, "wb").write(whole[:end])
+    return whole[:end], whole
+
+# With INCREMENTAL, a run after rows were added to the export only cleans
+# those and ends up with the cleaned.csv a full run writes. The state keeps
+# the size and sha1 of the export up to where it got; an export that changed
+# before there is transformed again in full.
+def test_incremental_transform(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(transformer, "RAW_FILENAME", "raw.csv")
+    monkeypatch.setattr(transformer, "WORKERS", 1)
+    monkeypatch.setattr(transformer, "WRITE_CACHE", False)
+    (prefix, whole) = WriteExports("raw.csv", 2000, 500)
+    assert not transformer.IncrementalTransform()
+    RunMain(monkeypatch, True)
+    state = json.load(open(transformer.TRANSFORM_STATE_FILENAME))
+    assert state["raw_offset"] == len(prefix)
+    assert state["raw_prefix_sha1"] == hashlib.sha1(prefix).hexdigest()
+
+    open("raw.csv", "wb").write(whole)
+    assert transformer.IncrementalTransform()
+    incremental = open("cleaned.csv", "rb").read()
+    state = json.load(open(transformer.TRANSFORM_STATE_FILENAME))
+    assert state["raw_offset"] == len(whole)
+    assert state["raw_prefix_sha1"] == hashlib.sha1(whole).hexdigest()
+    assert incremental == RunMain(monkeypatch, False)
+
+    # Nothing added: nothing appended
+    assert transformer.IncrementalTransform()
+    assert open("cleaned.csv", "rb").read() == incremental
+
+    # Rewritten before the high-water mark: the sha1 doesn't match, so
+    # everything is transformed again
+    rewritten = whole.replace(b",43.", b",44.", 1)
+    open("raw.csv", "wb").write(rewritten)
+    assert not transformer.IncrementalTransform()
+    assert open("cleaned.csv", "rb").read() == incremental
+    fallback = RunMain(monkeypatch, True)
+    assert fallback != incremental
+    assert fallback == RunMain(monkeypatch, False)
+
+# Conditions with commas, doubled quotes and line breaks in them come out of
+# ReadCSVRows the way csv.reader reads them, and reach the clusterer whole,
+# whether it reads cleaned.csv or the cache
+def test_quoted_values_end_to_end(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    benchmark.WriteSyntheticExport("raw.csv", 60, "quoted")
+    rows = list(csv.reader(open("raw.csv", newline="")))
+    values = ["SNOW, BLOWING", "SLEET \"FREEZING\"", "RAIN\nHEAVY", "FOG,\r\n\"SMOKE\", \"\""]
+    for (i, value) in enumerate(values):
+        rows[1 + i][19] = value
+        rows[20 + i][20] = value
+    f = open("raw.csv", "w", newline="")
+    csv.writer(f, lineterminator="\r\n").writerows(rows)
+    f.close()
+    f = open("raw.csv", newline="")
+    assert list(transformer.ReadCSVRows(f)) == rows
+    f.close()
+
+    monkeypatch.setattr(transformer, "RAW_FILENAME", "raw.csv")
+    monkeypatch.setattr(transformer, "WORKERS", 1)
+    monkeypatch.setattr(transformer, "WRITE_CACHE", True)
+    transformer.StreamTransform()
+    kept = [transformer.ProjectPoint(row) for row in rows[1:] if transformer.FormatPoint(row) is not None]
+    expected = [(point[6], point[7]) for point in kept]
+    assert len(expected) == 60
+    assert [weather for (weather, surface) in expected[:4]] == values
+    assert [surface for (weather, surface) in expected[19:23]] == values
+
+    cc = LoadClusterer()
+    for crashes in (cc.ReadInCrashes("cleaned.csv"), cc.ReadInCrashTable("cleaned.csv")):
+        assert [(crash.WeatherCondition, crash.SurfaceCondition) for crash in crashes] == expected
+    (categories, columns) = crashcache.OpenCache("cleaned.bin", "cleaned.csv")
+    assert [(categories[w], categories[s]) for (w, s) in zip(columns["Weather"], columns["Surface"])] == expected
+    crashes = cc.ReadInCachedCrashTable("cleaned.csv")
+    assert [(crash.WeatherCondition, crash.SurfaceCondition) for crash in crashes] == expected
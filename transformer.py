@@ -20,84 +20,270 @@
 # WeatherCondition Numeric (Grade best to worst, 0 in middle is unknown)
 # RoadCondition Numeric (Grade best to worst)
 
-# Takes ~60 seconds to run, be patient!
+import csv
+import functools
+import io
+import itertools
+import os
+import json
+import shutil
+import hashlib
+import math
+import operator
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import crashcache
+
+# The raw crash export we are transforming
+RAW_FILENAME = "2015UpdateJan-Feb2010-March2013-Dec2014.csv"
+# "memory" reads the whole export into memory before writing anything out,
+# "stream" cleans and writes one line at a time so memory use stays constant
+PIPELINE = "stream"
+# The streaming pipeline needs the unique values of the nominal attributes
+# before it can write the ARFF header. Either:
+#       "prescan" reads just those columns in a quick first pass, or
+#       "finalize" collects them while streaming and writes the header last
+ARFF_HEADER = "prescan"
+# Number of processes cleaning the export in the streaming pipeline.
+# With more than 1, the export is split into CHUNK_SIZE byte ranges that are
+# cleaned in parallel and written out in order. The ARFF header is then always
+# written last, since the workers count the values anyway.
+WORKERS = 1
+CHUNK_SIZE = 16 * 1024 * 1024
+# Also write cleaned.bin, a binary copy of cleaned.csv the clusterer can
+# memory-map instead of parsing the csv again (see crashcache.py)
+WRITE_CACHE = True
+# What happens to each column of the export, in order:
+#       (ARFF attribute name, type, keep, required)
+# Types are "date" (ConvertDate, MM-dd), "time" (ConvertTime, HH:mm),
+# "numeric" (copied as is) and "nominal" (quoted, the ARFF header lists the
+# values seen). Only kept columns go to cleaned.csv and crashes.arff, in this
+# order; the ARFF header and the cleaned.csv header come from here too, so
+# they always match the data. Rows with an empty required column are removed,
+# whether the column is kept or not. See CompileProjection.
+SCHEMA = [
+    ("QueryID", "numeric", False, False),           # QUERYID
+    ("CaseNumber", "numeric", False, False),        # CASE #
+    ("County", "nominal", False, True),             # REGN_CNTY_CDE
+    ("Municipality", "nominal", False, False),
+    ("MuniType", "numeric", False, False),          # MUNITYPE
+    ("ReferenceMarker", "nominal", False, False),   # REF_MRKR
+    ("AtIntersection", "nominal", False, False),    # ATINTERSECTION_IND
+    ("Latitude", "numeric", True, False),
+    ("Longitude", "numeric", True, False),
+    ("Date", "date", True, False),
+    ("Time", "time", True, False),
+    ("CrashType", "nominal", False, False),
+    ("Injuries", "numeric", True, False),
+    ("Fatalities", "numeric", True, False),
+    ("NumVehicles", "numeric", False, False),
+    ("AccidentType", "nominal", False, False),      # ACCD_TYP
+    ("CollisionType", "nominal", False, False),     # COLLISION_TYP
+    ("TrafficControl", "nominal", False, False),    # TRAF_CNTL
+    ("LightCondition", "nominal", False, False),
+    ("WeatherCondition", "nominal", True, False),
+    ("SurfaceCondition", "nominal", True, False),
+]
+# Indexes of the nominal attributes written to the ARFF header
+NOMINAL_INDEXES = [index for (index, (name, kind, keep, required)) in enumerate(SCHEMA) if keep and kind == "nominal"]
+# These are the indexes that we want to look at unique values for
+# to potentially reduce them to numeric attributes
+INDEXES_OF_INTEREST = [3,11,15,16,17,18,19,20]
+# Once a column has more unique values than this, new values are only counted
+# towards an estimate of how many unique values it has (see ValueCounter).
+# None counts everything exactly.
+UNIQUE_VALUE_CAP = 10000
+# Per column value counts get written here, for the clusterer to reuse
+VALUE_COUNTS_FILENAME = "value_counts.csv"
+# With INCREMENTAL, only the lines added to the end of the export since the
+# last run are cleaned and appended to cleaned.csv. Every run remembers how
+# far into the export it got (and a hash of that much of it) in
+# TRANSFORM_STATE_FILENAME; if the export changed anywhere before that point,
+# or there is no state yet, everything is transformed again.
+# crashes.arff, the value counts and cleaned.bin are only rewritten by full
+# runs (the clusterer rebuilds a stale cleaned.bin itself).
+INCREMENTAL = False
+TRANSFORM_STATE_FILENAME = "transform_state.json"
+
+# Counts how often each value shows up in the columns we track.
+# Values are added to a Counter per column, so each value costs a dictionary
+# update instead of copying the whole set of uniques.
+# If a column goes over the cap, the values already counted keep being counted
+# exactly, and everything else only goes into a HyperLogLog (number of unique
+# values) so memory stays bounded.
+# Indexing a ValueCounter gives the set of values seen in that column, so it
+# can be used in place of the old list of unique sets.
+class ValueCounter:
+    def __init__(self, indexes, cap=None):
+        self.Indexes = sorted(set(indexes))
+        self.Cap = cap
+        self.Counts = {index: Counter() for index in self.Indexes}
+        self.Sketches = {}
+
+    def __getitem__(self, index):
+        return set(self.Counts.get(index, ()))
+
+    # Adds the non-empty values of the tracked indexes of a point
+    def Add(self, point):
+        for index in self.Indexes:
+            if index < len(point):
+                value = point[index].strip()
+                if value != "":
+                    self.AddValue(index, value)
+
+    def AddValue(self, index, value, count=1):
+        counts = self.Counts[index]
+        sketch = self.Sketches.get(index)
+        if sketch is not None:
+            sketch.Add(value)
+            if value not in counts:
+                return
+        elif self.Cap is not None and value not in counts and len(counts) >= self.Cap:
+            sketch = self.StartSketch(index)
+            sketch.Add(value)
+            return
+        counts[value] += count
+
+    # Starts the HyperLogLog of a column going over the cap, with the values
+    # counted exactly so far
+    def StartSketch(self, index):
+        sketch = HyperLogLog()
+        for seen_value in self.Counts[index]:
+            sketch.Add(seen_value)
+        self.Sketches[index] = sketch
+        return sketch
+
+    # Adds everything counted by another ValueCounter to this one
+    def Merge(self, other):
+        for index in other.Indexes:
+            if index not in self.Counts:
+                self.Counts[index] = Counter()
+                self.Indexes = sorted(self.Indexes + [index])
+            for value, count in other.Counts[index].items():
+                self.AddValue(index, value, count)
+            if index in other.Sketches:
+                if index not in self.Sketches:
+                    self.StartSketch(index)
+                self.Sketches[index].Merge(other.Sketches[index])
+
+    # True if the column went over the cap and not every value is counted
+    def Overflowed(self, index):
+        return index in self.Sketches
+
+    # Number of unique values in the column (estimated if it overflowed)
+    def Cardinality(self, index):
+        if index in self.Sketches:
+            return max(len(self.Counts[index]), self.Sketches[index].Estimate())
+        return len(self.Counts[index])
+
+# 64 bit hash of a value that is the same in every process (unlike hash())
+# string -> int
+def StableHash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+
+# HyperLogLog: estimates the number of unique values with 2^precision
+# registers (4096 by default, about 1.6% error)
+class HyperLogLog:
+    def __init__(self, precision=12):
+        self.Precision = precision
+        self.Registers = [0] * (1 << precision)
+
+    def Add(self, value):
+        h = StableHash(value)
+        register = h >> (64 - self.Precision)
+        rest = h & ((1 << (64 - self.Precision)) - 1)
+        rank = (64 - self.Precision) - rest.bit_length() + 1
+        if rank > self.Registers[register]:
+            self.Registers[register] = rank
+
+    def Estimate(self):
+        m = len(self.Registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.Registers)
+        zeros = self.Registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # Small range correction
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def Merge(self, other):
+        self.Registers = [max(a, b) for a, b in zip(self.Registers, other.Registers)]
+
+# Writes the exact per column value counts out as Column,Value,Count lines,
+# most common first. A column that went over the cap only has its exactly
+# counted values written, and how many unique values it has is printed.
+def WriteValueCounts(headers, counter):
+    file = open(VALUE_COUNTS_FILENAME, "w")
+    file.write("Column,Value,Count\n")
+    for index in counter.Indexes:
+        for value, count in counter.Counts[index].most_common():
+            file.write(headers[index].strip() + "," + value + "," + str(count) + "\n")
+        if counter.Overflowed(index):
+            print(headers[index].strip() + " has about " + str(counter.Cardinality(index)) + " unique values, only "
+                  + str(len(counter.Counts[index])) + " of them are counted in " + VALUE_COUNTS_FILENAME)
+    file.close()
+    print("Finished writing to " + VALUE_COUNTS_FILENAME)
+
 # If write=true, write out unique values
-# Returns all possible values for each column, as well as the headers for the columns
+# Returns the values seen in the columns we track (a ValueCounter), as well
+# as the headers for the columns
 # And all the data, that way we don't need to pass through twice
 def GetHeadersUniqueValuesAndData(write):
-    # These are the indexes that we want to look at unique values for
-    # to potentially reduce them to numeric attributes
-    indexes_of_interest = [3,11,15,16,17,18,19,20]
     data = []
-    f = open("2015UpdateJan-Feb2010-March2013-Dec2014.csv")
-    headers = next(f).split(',')
-    uniques = [set() for i in range(len(headers))]
+    f = open(RAW_FILENAME, newline="")
+    reader = ReadCSVRows(f)
+    headers = next(reader)
+    uniques = ValueCounter(INDEXES_OF_INTEREST + NOMINAL_INDEXES, UNIQUE_VALUE_CAP)
     print("Reading in values...")
     num_lines = 0
     next_prompt = 1000
-    for line in f:
+    for values in reader:
         if num_lines >= next_prompt:
             print("Read "+ str(num_lines) +" lines...")
             next_prompt += 1000
-        values = line.split(',')
         data.append(values)
-        for valIndex in range(len(values)):
-            # Add to set for unique values
-            if values[valIndex].strip() != "":
-                uniques[valIndex] = uniques[valIndex].union([values[valIndex].strip()])
+        uniques.Add(values)
         num_lines += 1
     print("Reading done! Read in "+ str(num_lines) +" lines.")
     if(write):
         print("Writing out unique values...")
-        for uIndex in range(len(uniques)):
-            if uIndex in indexes_of_interest:
-                # Output a file with unique vals for that attribute
-                newFileName = "Unique_" + headers[uIndex]
-                newFile = open(newFileName, 'w')
-                for uniqueval in uniques[uIndex]:
-                    newFile.write(uniqueval.strip() + "\n")
+        for uIndex in INDEXES_OF_INTEREST:
+            # Output a file with unique vals for that attribute
+            newFileName = "Unique_" + headers[uIndex]
+            newFile = open(newFileName, 'w')
+            for uniqueval in sorted(uniques[uIndex]):
+                newFile.write(uniqueval.strip() + "\n")
     f.close()
     
     return headers, uniques, data
 
 # Converts set string to ARFF notation for WEKA
 # This is used for nominal attributes
+# Values are quoted like the data rows quote them, so commas and quotes in a
+# value come through unchanged. They are sorted, so the header is the same on
+# every run (sets iterate in a different order each run).
 # set() -> string
 def SetToARFFString(s):
-    base_string = s.__str__()
-    return base_string.replace("'","\"").replace(", ", ",")
+    return "{" + ",".join("\"" + value.replace("\"", "\"\"") + "\"" for value in sorted(s)) + "}"
     
 # Writes initial header to ARFF file
 # This includes initial comments, relation and attributes
-# If you plan on skipping an attribute, make sure the @ATTRIBUTE here is commented out
+# The attributes are the kept columns of SCHEMA
 def WriteHeaderBlock(file, headers, uniques):
     init_comments = "%1. Title: Car Crash Data\n%\n%2. Sources: Nicholas Livadas, Oct. 8, 2015\n%\n%3. Authors: Ryan Lisnoff & Derek Brown\n"
     relation = "@RELATION crash\n\n"
-    skip_indeces = [0,1,2,3,4,5,6,7,8,11,15,16,17,18]
     attr_block = []
-
-    # Now we need to make all the different attributes we plan to use
-    # Skip QUERYID
-    #attr_block.append("@ATTRIBUTE CaseNumber NUMERIC\n")
-    # Skip REGN_CNTY_CDE
-    #attr_block.append("@ATTRIBUTE Municipality " + SetToARFFString(uniques[3]) + "\n")
-    # Skip MUNITYPE
-    # Skip REF_MRKR
-    #attr_block.append("@ATTRIBUTE AtIntersection {Y,N}\n")
-    #attr_block.append("@ATTRIBUTE Latitude NUMERIC\n")
-    #attr_block.append("@ATTRIBUTE Longitude NUMERIC\n")
-    attr_block.append("@ATTRIBUTE Date date \"MM-dd\"\n")
-    attr_block.append("@ATTRIBUTE Time date \"HH:mm\"\n")
-    #attr_block.append("@ATTRIBUTE CrashType"+ SetToARFFString(uniques[11]) +"\n")
-    attr_block.append("@ATTRIBUTE Injuries NUMERIC\n")
-    attr_block.append("@ATTRIBUTE Fatalities NUMERIC\n")
-    #attr_block.append("@ATTRIBUTE NumVehicles NUMERIC\n")
-    #attr_block.append("@ATTRIBUTE AccidentType"+ SetToARFFString(uniques[15]) +"\n")
-    #attr_block.append("@ATTRIBUTE CollisionType"+ SetToARFFString(uniques[16]) +"\n")
-    # Skip TRAF_CNTL
-    #attr_block.append("@ATTRIBUTE LightCondition"+ SetToARFFString(uniques[18]) +"\n")
-    attr_block.append("@ATTRIBUTE WeatherCondition"+ SetToARFFString(uniques[19]) +"\n")
-    attr_block.append("@ATTRIBUTE SurfaceCondition"+ SetToARFFString(uniques[20]) +"\n")
+    for (index, (name, kind, keep, required)) in enumerate(SCHEMA):
+        if not keep:
+            continue
+        if kind == "date":
+            attr_block.append("@ATTRIBUTE " + name + " date \"MM-dd\"\n")
+        elif kind == "time":
+            attr_block.append("@ATTRIBUTE " + name + " date \"HH:mm\"\n")
+        elif kind == "numeric":
+            attr_block.append("@ATTRIBUTE " + name + " NUMERIC\n")
+        else:
+            attr_block.append("@ATTRIBUTE " + name + SetToARFFString(uniques[index]) + "\n")
     
     file.write(init_comments)
     file.write(relation)
@@ -105,12 +291,17 @@ def WriteHeaderBlock(file, headers, uniques):
         file.write(attr)
 
 def WriteDataBlock(file, data):
-    file.write("\n@DATA\n")
+    WriteDataBlockHeader(file)
     for datapoint in data:
         file.write(datapoint)
 
+def WriteDataBlockHeader(file):
+    file.write("\n@DATA\n")
+
 # Either returns the time unchanged, or if it has AM/PM, convert to 24 hour
 # WEKA needs it in format HH:mm
+# There are only so many different times, so each one is converted once
+@functools.lru_cache(maxsize=16384)
 def ConvertTime(time):
     if(time == ""):
         return "00:00"
@@ -131,6 +322,8 @@ def ConvertTime(time):
 # Converts the slash style date into a date we can use
 # Here we drop the year because we're not so interested in it
 # WEKA needs it in form MM:dd
+# Memoized like ConvertTime
+@functools.lru_cache(maxsize=16384)
 def ConvertDate(date):
     split_date = date.split('/')
     month = split_date[0]
@@ -146,46 +339,133 @@ def ConvertDate(date):
 
 # Here is where the datapoints are formatted so that WEKA
 # can parse them according to the attributes we defined.
-# Anything in skip_indeces must also be commented out in the @ATTRIBUTE section!
-# list<list<>> -> list<string>
-def FormatData(data):
+# Which columns are kept, and how, is set in SCHEMA
+# Kept points are also added to cache, if given
+# list<list<>> * CacheBuilder -> list<string>
+def FormatData(data, cache=None):
     print("Cleaning data...")
     formatted = []
-    skip_indeces = [0,1,2,3,4,5,6,7,8,11,14,15,16,17,18]
-    numeric_indeces = [1,7,8,12,13,14]
     num_removed = 0
     for point in data:
-        skip_this_point = False
-        datastring = ""
-        for attrIndex in range(len(point)):
-            if attrIndex not in skip_indeces:
-                if attrIndex == 9: # Date
-                    datastring += ConvertDate(point[attrIndex]) + ","
-                elif attrIndex == 10: # Time
-                    datastring += ConvertTime(point[attrIndex]) + ","
-                elif attrIndex == 20: # No comma
-                    datastring += "\"" + point[attrIndex].strip() + "\"\n"
-                elif attrIndex == 3 and point[attrIndex] == "":
-                    skip_this_point = True
-                    num_removed += 1
-                    break
-                else:
-                    if attrIndex in numeric_indeces:
-                        datastring += point[attrIndex] + ","
-                    else:
-                        datastring += "\"" + point[attrIndex] + "\","
-                        
-        if not skip_this_point:
+        datastring = FormatAndCachePoint(point, cache)
+        if datastring is None:
+            num_removed += 1
+        else:
             formatted.append(datastring)
     print("Cleaning done. Removed "+ str(num_removed) + " points. New Total points: "+ str(len(formatted)))    
     return formatted
 
+# Quotes a nominal value, doubling any quotes in it so cleaned.csv reads
+# back with the csv module
+# string -> string
+def QuoteNominal(value):
+    return '"' + value.replace('"', '""') + '"'
+
+# Same for the last column, which also gets stripped of spaces
+# string -> string
+def QuoteLastNominal(value):
+    return '"' + value.strip().replace('"', '""') + '"'
+
+# How each type of column is written out. str gives a string back as it is.
+CONVERTERS = {"date": ConvertDate, "time": ConvertTime, "numeric": str, "nominal": QuoteNominal}
+
+# Function that picks the values at the given indexes out of a point, as a
+# tuple (itemgetter gives a bare value for a single index)
+# list<int> -> (list<> -> tuple)
+def ColumnGetter(indexes):
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda point: (point[index],)
+    if len(indexes) == 0:
+        return lambda point: ()
+    return operator.itemgetter(*indexes)
+
+# Builds the function that formats a single datapoint (see FormatData) from
+# a schema. Everything that depends on the schema is worked out once here: a
+# getter for the kept columns, one converter per kept column and a getter for
+# the required columns. Each row then only touches those columns, with no per
+# column checks. The last column gets stripped of spaces.
+# Rows with the wrong number of columns or an empty required column are
+# removed (returns None).
+# Without quote, the function returns the converted values as a list instead,
+# nominal values unquoted, the way the csv module reads the line back.
+# list<(string, string, bool, bool)> * bool -> (list<> -> string)
+def CompileProjection(schema, quote=True):
+    last = len(schema) - 1
+    kept = []
+    converters = []
+    for (index, (name, kind, keep, required)) in enumerate(schema):
+        if not keep:
+            continue
+        if kind not in CONVERTERS:
+            raise ValueError("Unknown column type " + kind + " for " + name)
+        converter = CONVERTERS[kind] if quote or kind != "nominal" else str
+        if index == last:
+            if kind == "nominal":
+                converter = QuoteLastNominal if quote else str.strip
+            else:
+                converter = (lambda value, convert=converter: convert(value.strip()))
+        kept.append(index)
+        converters.append(converter)
+    get_kept = ColumnGetter(kept)
+    get_required = ColumnGetter([index for (index, (name, kind, keep, required)) in enumerate(schema) if required])
+    converters = tuple(converters)
+    columns = len(schema)
+
+    def FormatPoint(point):
+        if len(point) != columns:
+            return None
+        for value in get_required(point):
+            if value == "" or value.isspace():
+                return None
+        return ",".join([convert(value) for (convert, value) in zip(converters, get_kept(point))]) + "\n"
+
+    def ProjectPoint(point):
+        if len(point) != columns:
+            return None
+        for value in get_required(point):
+            if value == "" or value.isspace():
+                return None
+        return [convert(value) for (convert, value) in zip(converters, get_kept(point))]
+    return FormatPoint if quote else ProjectPoint
+
+# Formats a single datapoint, see FormatData and CompileProjection
+# Returns None if the point should be removed
+# list<> -> string
+FormatPoint = CompileProjection(SCHEMA)
+# The values of the cleaned.csv line of a datapoint, for the binary cache
+# list<> -> list<string>
+ProjectPoint = CompileProjection(SCHEMA, quote=False)
+
+# Formats a datapoint and, if it is kept and cache isn't None, adds its
+# values to cache
+# list<> * CacheBuilder -> string
+def FormatAndCachePoint(point, cache):
+    datastring = FormatPoint(point)
+    if datastring is not None and cache is not None:
+        cache.Add(ProjectPoint(point))
+    return datastring
+
 # Writes the formatted data to a new CSV file
 def WriteCleanCSV(data):
     print("Writing to cleaned CSV file")
     filename = "cleaned.csv"
     file = open(filename, "w")
-    headers = ["Date", "Time", "Injuries", "Fatalities", "WeatherCondition", "Surface Condition"]
+    WriteCleanCSVHeader(file)
+
+    for point_index in range(len(data)):
+        file.write(str(data[point_index]))
+
+    file.close()
+    print("Finished writing to cleaned.csv")
+
+# Names of the columns cleaned.csv has, in order
+# None -> list<string>
+def KeptColumnNames():
+    return [name for (name, kind, keep, required) in SCHEMA if keep]
+
+def WriteCleanCSVHeader(file):
+    headers = KeptColumnNames()
     for header_index in range(len(headers)):
         file.write(headers[header_index])
         if(header_index == len(headers) - 1):
@@ -193,11 +473,11 @@ def WriteCleanCSV(data):
         else:
             file.write(",")
 
-    for point_index in range(len(data)):
-        file.write(str(data[point_index]))
-
-    file.close()
-    print("Finished writing to cleaned.csv")
+# Writes the binary cache of cleaned.csv, which must be written already
+def WriteCrashCache(cache):
+    filename = crashcache.CacheFilename("cleaned.csv")
+    cache.Write(filename, "cleaned.csv")
+    print("Finished writing to " + filename)
 
 def WriteARFF(headers, uniques, formatted_data):
     arff = open("crashes.arff", "w")
@@ -206,12 +486,288 @@ def WriteARFF(headers, uniques, formatted_data):
     arff.close()
     print("Finished writing to crashes.arff...")
     
+# Yields the values of each row of a csv file opened with newline="".
+# Gives the same rows as csv.reader, but lines without quotes (all of the
+# export) are just split on commas, which is a little faster (about 1.2x on
+# the export here). A line with a quote goes to csv.reader, along with the
+# lines after it if a quoted value has a line break in it.
+# file -> generator<list<string>>
+def ReadCSVRows(file):
+    lines = iter(file)
+    for line in lines:
+        if '"' in line:
+            yield next(csv.reader(itertools.chain((line,), lines)))
+        else:
+            yield line.rstrip('\r\n').split(',')
+
+# Yields the values of each line of the raw export, one line at a time
+# string -> generator<list<string>>
+def ReadRawPoints(filename):
+    f = open(filename, newline="")
+    reader = ReadCSVRows(f)
+    next(reader) # toss out the header
+    num_lines = 0
+    next_prompt = 1000
+    for point in reader:
+        if num_lines >= next_prompt:
+            print("Read "+ str(num_lines) +" lines...")
+            next_prompt += 1000
+        yield point
+        num_lines += 1
+    f.close()
+    print("Reading done! Read in "+ str(num_lines) +" lines.")
+
+# Yields the formatted datapoints, dropping the ones FormatPoint removes
+# If uniques is given, every point is counted in it as the points go by (this
+# includes points that get removed, same as GetHeadersUniqueValuesAndData)
+# Kept points are also added to cache, if given
+# generator<list<string>> * ValueCounter * CacheBuilder -> generator<string>
+def CleanPoints(points, uniques=None, cache=None):
+    num_removed = 0
+    num_kept = 0
+    for point in points:
+        if uniques is not None:
+            uniques.Add(point)
+        datastring = FormatAndCachePoint(point, cache)
+        if datastring is None:
+            num_removed += 1
+        else:
+            num_kept += 1
+            yield datastring
+    print("Cleaning done. Removed "+ str(num_removed) + " points. New Total points: "+ str(num_kept))
+
+# Quick first pass over the export that only counts the values of the given
+# indexes, nothing else is held in memory
+# string * list<int> -> list<string>, ValueCounter
+def ScanNominalValues(filename, indexes):
+    print("Scanning nominal values...")
+    f = open(filename, newline="")
+    reader = ReadCSVRows(f)
+    headers = next(reader)
+    uniques = ValueCounter(indexes, UNIQUE_VALUE_CAP)
+    for point in reader:
+        uniques.Add(point)
+    f.close()
+    return headers, uniques
+
+# Single pass pipeline: read -> convert date and time -> drop rows with an
+# empty REGN_CNTY_CDE -> write
+# Writes cleaned.csv and crashes.arff at the same time, one point at a time.
+# With ARFF_HEADER = "finalize" the ARFF data block goes to a temporary file
+# which is appended to the header once all the unique values are known.
+def StreamTransform():
+    prescan = ARFF_HEADER == "prescan" and WORKERS <= 1
+    if prescan:
+        headers, uniques = ScanNominalValues(RAW_FILENAME, INDEXES_OF_INTEREST + NOMINAL_INDEXES)
+        arff = open("crashes.arff", "w")
+        WriteHeaderBlock(arff, headers, uniques)
+        arff_data = arff
+    else:
+        f = open(RAW_FILENAME, newline="")
+        headers = next(ReadCSVRows(f))
+        f.close()
+        uniques = ValueCounter(INDEXES_OF_INTEREST + NOMINAL_INDEXES, UNIQUE_VALUE_CAP)
+        arff_data = open("crashes.arff.data", "w")
+    WriteDataBlockHeader(arff_data)
+
+    clean_csv = open("cleaned.csv", "w")
+    WriteCleanCSVHeader(clean_csv)
+    # The cache spills its columns to temporary files as it goes
+    cache = crashcache.CacheBuilder(spill=True) if WRITE_CACHE else None
+    if WORKERS > 1:
+        cleaned = ParallelCleanPoints(RAW_FILENAME, uniques, cache)
+    else:
+        # The prescan already counted every point
+        counter = uniques if not prescan else None
+        cleaned = CleanPoints(ReadRawPoints(RAW_FILENAME), counter, cache)
+    for datastring in cleaned:
+        arff_data.write(datastring)
+        clean_csv.write(datastring)
+    clean_csv.close()
+    print("Finished writing to cleaned.csv")
+    if WRITE_CACHE:
+        WriteCrashCache(cache)
+
+    if not prescan:
+        arff_data.close()
+        arff = open("crashes.arff", "w")
+        WriteHeaderBlock(arff, headers, uniques)
+        arff_data = open("crashes.arff.data")
+        shutil.copyfileobj(arff_data, arff)
+        arff_data.close()
+        os.remove("crashes.arff.data")
+    arff.close()
+    print("Finished writing to crashes.arff...")
+    return headers, uniques
+
+# Splits the export (after its header line) into byte ranges of about
+# chunk_size bytes. Every range ends right after a line break (\r, \n or
+# \r\n, same as reading the file in text mode), so no line is cut in two.
+# A quoted value with a line break in it could still be cut, the export has
+# none.
+# string * int -> list<(int, int)>
+def SplitByteRanges(filename, chunk_size):
+    f = open(filename, "rb")
+    size = os.path.getsize(filename)
+    start = LineEnd(f, 0, size)
+    ranges = []
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            end = LineEnd(f, end, size)
+        ranges.append((start, end))
+        start = end
+    f.close()
+    return ranges
+
+# Position right after the first line break that ends at or after position in
+# a file (size if there is none), reading 64KB at a time however long the
+# line is. A \r\n counts as one line break even if position is between them.
+# file * int * int -> int
+def LineEnd(f, position, size):
+    if position > 0:
+        position -= 1
+    f.seek(position)
+    rest = f.read(64 * 1024)
+    while rest != b"":
+        breaks = [ix for ix in (rest.find(b"\r"), rest.find(b"\n")) if ix >= 0]
+        if breaks:
+            position += min(breaks) + 1
+            f.seek(position - 1)
+            if f.read(2) == b"\r\n":
+                position += 1
+            return position
+        position += len(rest)
+        rest = f.read(64 * 1024)
+    return size
+
+# Cleans the lines in one byte range of the export, in a worker process.
+# Returns the formatted lines as one string, the number of points removed
+# and kept, the values counted in the range and, with with_cache, a
+# CacheBuilder holding the kept points (None otherwise).
+# string * int * int * bool -> string, int, int, ValueCounter, CacheBuilder
+def CleanChunk(filename, start, end, with_cache=False):
+    f = open(filename, "rb")
+    f.seek(start)
+    raw = f.read(end - start)
+    f.close()
+    uniques = ValueCounter(INDEXES_OF_INTEREST + NOMINAL_INDEXES, UNIQUE_VALUE_CAP)
+    cache = crashcache.CacheBuilder() if with_cache else None
+    formatted = []
+    num_removed = 0
+    # Decodes and splits lines exactly like ReadRawPoints does
+    for point in ReadCSVRows(io.TextIOWrapper(io.BytesIO(raw), newline="")):
+        uniques.Add(point)
+        datastring = FormatAndCachePoint(point, cache)
+        if datastring is None:
+            num_removed += 1
+        else:
+            formatted.append(datastring)
+    return "".join(formatted), num_removed, len(formatted), uniques, cache
+
+# Same as CleanPoints(ReadRawPoints(filename), uniques, cache), but the byte
+# ranges of the export are cleaned by WORKERS processes. Chunks are yielded
+# (and their counts and cached columns added to uniques and cache) in the
+# order of the file, and only a few chunks per worker are in flight at a time
+# so memory stays bounded.
+# string * ValueCounter * CacheBuilder -> generator<string>
+def ParallelCleanPoints(filename, uniques, cache=None):
+    ranges = SplitByteRanges(filename, CHUNK_SIZE)
+    print("Cleaning " + str(len(ranges)) + " chunks with " + str(WORKERS) + " workers...")
+    num_removed = 0
+    num_kept = 0
+    executor = ProcessPoolExecutor(WORKERS)
+    pending = deque()
+    next_range = 0
+    while next_range < len(ranges) or pending:
+        while next_range < len(ranges) and len(pending) < 2 * WORKERS:
+            (start, end) = ranges[next_range]
+            pending.append(executor.submit(CleanChunk, filename, start, end, cache is not None))
+            next_range += 1
+        (chunk, chunk_removed, chunk_kept, chunk_uniques, chunk_cache) = pending.popleft().result()
+        uniques.Merge(chunk_uniques)
+        if cache is not None:
+            cache.AddBuilder(chunk_cache)
+        num_removed += chunk_removed
+        num_kept += chunk_kept
+        yield chunk
+    executor.shutdown()
+    print("Cleaning done. Removed "+ str(num_removed) + " points. New Total points: "+ str(num_kept))
+
+# Returns the size of the export and its sha1, to tell next time whether it
+# was only appended to. Assumes the export isn't written to during a run.
+# string -> int, string
+def ExportHighWaterMark(filename):
+    size = os.path.getsize(filename)
+    return size, crashcache.PrefixHash(filename, size)
+
+# Remembers how far into the export cleaned.csv goes, and which columns it has
+def WriteTransformState(offset, prefix_sha1):
+    state = {"raw_filename": RAW_FILENAME, "raw_offset": offset, "raw_prefix_sha1": prefix_sha1,
+             "cleaned_size": os.path.getsize("cleaned.csv"), "columns": KeptColumnNames()}
+    f = open(TRANSFORM_STATE_FILENAME + ".tmp", "w")
+    json.dump(state, f)
+    f.close()
+    os.replace(TRANSFORM_STATE_FILENAME + ".tmp", TRANSFORM_STATE_FILENAME)
+
+# Cleans the lines added to the export since the last run and appends them to
+# cleaned.csv. Returns False, doing nothing, if there is no usable state from
+# a last run: the export or cleaned.csv changed other than by appending, or
+# SCHEMA keeps other columns now.
+# None -> bool
+def IncrementalTransform():
+    if not os.path.exists(TRANSFORM_STATE_FILENAME) or not os.path.exists("cleaned.csv"):
+        return False
+    f = open(TRANSFORM_STATE_FILENAME)
+    state = json.load(f)
+    f.close()
+    if state["raw_filename"] != RAW_FILENAME or os.path.getsize("cleaned.csv") != state["cleaned_size"]:
+        return False
+    if state.get("columns") != KeptColumnNames():
+        return False
+    if os.path.getsize(RAW_FILENAME) < state["raw_offset"]:
+        return False
+    if crashcache.PrefixHash(RAW_FILENAME, state["raw_offset"]) != state["raw_prefix_sha1"]:
+        return False
+
+    (offset, prefix_sha1) = ExportHighWaterMark(RAW_FILENAME)
+    # The export doesn't end with a line break, so the new lines start with one
+    start = state["raw_offset"]
+    f = open(RAW_FILENAME, "rb")
+    f.seek(start)
+    first = f.read(2)
+    f.close()
+    if first == b"\r\n":
+        start += 2
+    elif first[:1] in (b"\r", b"\n"):
+        start += 1
+    (formatted, num_removed, num_kept, uniques, cache) = CleanChunk(RAW_FILENAME, start, offset)
+    clean_csv = open("cleaned.csv", "a")
+    clean_csv.write(formatted)
+    clean_csv.close()
+    WriteTransformState(offset, prefix_sha1)
+    print("Cleaning done. Removed "+ str(num_removed) + " new points. Appended " + str(num_kept) + " points to cleaned.csv")
+    print("crashes.arff and " + VALUE_COUNTS_FILENAME + " were not updated, run with INCREMENTAL = False to rewrite them")
+    return True
+
 def Main():
     print("Starting transformer!")
-    headers, uniques, datapoints = GetHeadersUniqueValuesAndData(False)
-    formatted_data = FormatData(datapoints)
-    WriteARFF(headers, uniques, formatted_data)
-    WriteCleanCSV(formatted_data)
+    if INCREMENTAL and IncrementalTransform():
+        print("Done!")
+        return
+    if PIPELINE == "stream":
+        headers, uniques = StreamTransform()
+    else:
+        headers, uniques, datapoints = GetHeadersUniqueValuesAndData(False)
+        cache = crashcache.CacheBuilder() if WRITE_CACHE else None
+        formatted_data = FormatData(datapoints, cache)
+        WriteARFF(headers, uniques, formatted_data)
+        WriteCleanCSV(formatted_data)
+        if WRITE_CACHE:
+            WriteCrashCache(cache)
+    WriteValueCounts(headers, uniques)
+    WriteTransformState(*ExportHighWaterMark(RAW_FILENAME))
     print("Done!")
-    
-Main()
+
+if __name__ == "__main__":
+    Main()